@@ -1,3 +1,5 @@
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.conf import settings
 
@@ -18,3 +20,29 @@ class CustomJWTAuthentication(JWTAuthentication):
             return self.get_user(validated_token), validated_token
         except:
             return None
+
+
+@database_sync_to_async
+def get_jwt_user(raw_token):
+    try:
+        authentication = CustomJWTAuthentication()
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except Exception:
+        return None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Channels middleware that sets scope['user'] from the same JWT auth cookie
+    the REST API reads. Place it inside AuthMiddlewareStack, which parses the
+    cookies and falls back to the session user.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token = scope.get('cookies', {}).get(settings.AUTH_COOKIE)
+        if raw_token:
+            user = await get_jwt_user(raw_token)
+            if user is not None:
+                scope['user'] = user
+        return await super().__call__(scope, receive, send)
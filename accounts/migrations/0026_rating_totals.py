@@ -0,0 +1,38 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0025_payment_completed_at_payment_next_poll_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='landlordprofile',
+            name='profile_completeness',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='landlordprofile',
+            name='review_rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='landlordprofile',
+            name='review_rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tenantprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tenantprofile',
+            name='rating_sum',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.8 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0026_rating_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='landlordprofile',
+            name='rating_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tenantprofile',
+            name='rating_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -67,7 +67,27 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
         return self.email
 
 
-class LandlordProfile(models.Model):
+class MaintainedFieldsMixin:
+    """
+    For models whose rating totals are kept current with QuerySet.update()
+    (api.signals, api.ratings). A full save() of an existing row leaves
+    maintained_fields out, so an instance loaded before the latest update
+    can't write stale copies back; name them in update_fields to write them.
+    """
+    maintained_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not (args or self._state.adding or kwargs.get('force_insert')
+                or kwargs.get('update_fields') is not None):
+            skipped = set(self.maintained_fields) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+                and field.attname not in skipped]
+        super().save(*args, **kwargs)
+
+
+class LandlordProfile(MaintainedFieldsMixin, models.Model):
     user = models.OneToOneField(
         UserAccount, on_delete=models.CASCADE, related_name='landlord_profile')
 
@@ -101,12 +121,23 @@ class LandlordProfile(models.Model):
         default=False, blank=True, null=True)
     current_rating = models.DecimalField(
         max_digits=3, decimal_places=2, blank=True, null=True, default=0.00)
+    # Inputs to current_rating, kept current by api.signals: reviews on the
+    # landlord's properties and the weighted share of the profile filled in
+    review_rating_sum = models.PositiveIntegerField(default=0)
+    review_rating_count = models.PositiveIntegerField(default=0)
+    profile_completeness = models.FloatField(default=0)
+    # When current_rating or its inputs were last written; unlike
+    # last_updated, not a sign the landlord edited the profile
+    rating_updated_at = models.DateTimeField(null=True, blank=True)
+
+    maintained_fields = ('current_rating', 'review_rating_sum', 'review_rating_count',
+                         'rating_updated_at')
 
     def __str__(self):
         return f"Landlord Profile: {self.user.email}"
 
 
-class TenantProfile(models.Model):
+class TenantProfile(MaintainedFieldsMixin, models.Model):
     user = models.OneToOneField(
         UserAccount, on_delete=models.CASCADE, related_name='tenant_profile')
     # Personal Information
@@ -184,6 +215,13 @@ class TenantProfile(models.Model):
         max_length=100, blank=True, null=True)
     current_rating = models.DecimalField(
         max_digits=3, decimal_places=2, blank=True, null=True, default=0.00)
+    # Running totals of TenantRating.rating behind current_rating
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    # When current_rating or its totals were last written
+    rating_updated_at = models.DateTimeField(null=True, blank=True)
+
+    maintained_fields = ('current_rating', 'rating_sum', 'rating_count', 'rating_updated_at')
 
     def __str__(self):
         return f"Tenant Profile: {self.user.email}"
@@ -222,9 +260,21 @@ class PricingTier(models.Model):
 
 
 class Payment(models.Model):
+    """A Paynow mobile transaction, polled until Paynow reports a final status"""
+    PURPOSE_CHOICES = (
+        ('subscription', 'Subscription'),
+        ('rent', 'Rent'),
+        ('lease_document', 'Lease Document'),
+    )
+    # Paynow statuses (lowercased) after which a transaction never changes
+    PAID_STATUSES = ('paid', 'awaiting delivery', 'delivered')
+    FINAL_STATUSES = PAID_STATUSES + \
+        ('cancelled', 'failed', 'disputed', 'refunded', 'expired')
+
     tenant = models.ForeignKey(
         TenantProfile, on_delete=models.CASCADE, null=True, blank=True)
-    reference = models.CharField(max_length=100, null=True, blank=True)
+    reference = models.CharField(
+        max_length=100, null=True, blank=True, db_index=True)
     poll_url = models.URLField(null=True, blank=True)
     status = models.CharField(max_length=50, default='Initiated')
     amount = models.DecimalField(
@@ -232,10 +282,31 @@ class Payment(models.Model):
     phone = models.CharField(max_length=15, null=True, blank=True)
     email = models.EmailField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    purpose = models.CharField(
+        max_length=20, choices=PURPOSE_CHOICES, default='subscription')
+    # RentPayment or LeaseDocumentPayment id, depending on purpose
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    plan = models.CharField(max_length=20, null=True, blank=True)
+    poll_attempts = models.PositiveIntegerField(default=0)
+    next_poll_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_poll_at']),
+        ]
 
     def __str__(self):
         return f"{self.reference} - {self.status}"
 
+    @property
+    def is_final(self):
+        return self.status.lower() in self.FINAL_STATUSES
+
+    @property
+    def is_paid(self):
+        return self.status.lower() in self.PAID_STATUSES
+
 
 class LandlordBalance(models.Model):
     landlord = models.OneToOneField(
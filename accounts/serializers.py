@@ -16,7 +16,7 @@ class LandlordProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = LandlordProfile
         fields = '__all__'
-        read_only_fields = ('user', 'is_profile_complete', 'is_verified', 'last_updated')
+        read_only_fields = ('user', 'is_profile_complete', 'is_verified', 'last_updated', 'rating_updated_at')
         depth = 1
 
 class PricingTierSerializer(serializers.ModelSerializer):
@@ -28,7 +28,7 @@ class TenantProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = TenantProfile
         fields = '__all__'
-        read_only_fields = ('user', 'is_profile_complete', 'last_updated')
+        read_only_fields = ('user', 'is_profile_complete', 'last_updated', 'rating_updated_at')
         depth = 1
 
 class CustomUserSerializer(UserCreateSerializer):
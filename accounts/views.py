@@ -10,7 +10,10 @@ import uuid
 from rest_framework.permissions import AllowAny
 import hashlib
 from .models import Payment
-from paynow import Paynow
+from api.payments import (
+    SUBSCRIPTION_PLANS, PaymentError, start_mobile_payment, finish_payment, poll_payment)
+from api.paynow_gateway import get_gateway
+from api.mail import queue_email, queue_mail
 from django.conf import settings
 from rest_framework.views import APIView
 # from rest_framework.response import Response
@@ -25,6 +28,7 @@ from rest_framework.response import Response
 from rest_framework import status as drf_status
 from .models import LandlordProfile, TenantProfile, PricingTier, TenantRating
 from .serializers import LandlordProfileSerializer, TenantProfileSerializer
+from api.conditional import ConditionalGetMixin
 from api.models import RentPayment
 from django.utils import timezone
 from django.template.loader import render_to_string
@@ -41,7 +45,6 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from bs4 import BeautifulSoup
-from django.db.models import Avg
 from decimal import Decimal
 from accounts.models import LandlordBalance, WithdrawalRequest
 
@@ -131,9 +134,15 @@ class LogoutView(APIView):
         return response
 
 
-class LandlordProfileView(generics.RetrieveUpdateAPIView):
+class LandlordProfileView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     serializer_class = LandlordProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    conditional_model = LandlordProfile
+
+    def get_conditional_lookup(self):
+        if self.request.user.user_type != 'landlord':
+            return None
+        return {'user': self.request.user}
 
     def get_object(self):
         if self.request.user.user_type != 'landlord':
@@ -165,9 +174,15 @@ class LandlordProfileView(generics.RetrieveUpdateAPIView):
         return Response(status=drf_status.HTTP_204_NO_CONTENT)
 
 
-class TenantProfileView(generics.RetrieveUpdateAPIView):
+class TenantProfileView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     serializer_class = TenantProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    conditional_model = TenantProfile
+
+    def get_conditional_lookup(self):
+        if self.request.user.user_type != 'tenant':
+            return None
+        return {'user': self.request.user}
 
     def get_object(self):
         if self.request.user.user_type != 'tenant':
@@ -227,10 +242,17 @@ class TenantProfileListView(generics.ListAPIView):
     permission_classes = [permissions.IsAdminUser]
 
 
-class getTenantProfileView(APIView):
+class getTenantProfileView(ConditionalGetMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    conditional_model = TenantProfile
+
+    def get_conditional_lookup(self):
+        return {'user__id': self.kwargs['pk']}
 
     def get(self, request, pk):
+        return self.conditional_get(request, self.get_profile, pk)
+
+    def get_profile(self, request, pk):
         tenant_profile = TenantProfile.objects.get(user__id=pk)
         serializer = TenantProfileSerializer(tenant_profile)
         return Response(serializer.data)
@@ -248,93 +270,45 @@ class InitiatePaymentView(APIView):
         phone = request.data.get('phone')
         # amount = request.data.get('amount')
         plan = request.data.get('plan')
-        if plan == 'basic':
-            amount = 0.005
-            pricing_tier = PricingTier.objects.get(name='Basic')
-        elif plan == 'standard':
-            amount = 0.015
-            pricing_tier = PricingTier.objects.get(name='Standard')
-        elif plan == 'premium':
-            amount = 0.030
-
-            pricing_tier = PricingTier.objects.get(name='Premium')
-        elif plan == 'luxury':
-            amount = 0.050
-            pricing_tier = PricingTier.objects.get(name='Luxury')
-        else:
-
+        if plan not in SUBSCRIPTION_PLANS:
             return Response({'error': 'Invalid plan'}, status=drf_status.HTTP_400_BAD_REQUEST)
-
-        paynow = Paynow(
-            settings.PAYNOW_INTEGRATION_ID,
-            settings.PAYNOW_INTEGRATION_KEY,
-            settings.PAYNOW_RESULT_URL,
-            settings.PAYNOW_RETURN_URL
-        )
+        amount, _ = SUBSCRIPTION_PLANS[plan]
 
         reference = f'Order_{uuid.uuid4()}'
-        payment = paynow.create_payment(reference, email)
-        payment.add('Order Payment', float(amount))
 
+        # The tenant's plan is upgraded once Paynow reports the payment as paid
         try:
-            response = paynow.send_mobile(payment, phone, 'ecocash')
-
-            if response.success:
-                time.sleep(30)
-                print('success')
-                status = paynow.check_transaction_status(response.poll_url)
-                print(status.status)
-                if status.status == 'paid':
-                    Payment.objects.create(
-                        reference=reference,
-                        poll_url=response.poll_url,
-                        amount=amount,
-                        phone=phone,
-                        email=email,
-                        status=status.status,
-                        tenant=tenant_profile
-                    )
-                    # Update tenant profile
-                    tenant_profile.subscription_plan = plan
-                    tenant_profile.subscription_status = 'active'
-                    tenant_profile.pricing_tier = pricing_tier
-                    tenant_profile.num_properties = pricing_tier.max_properties
-                    tenant_profile.save()
-
-                    return Response({
-                        'poll_url': response.poll_url,
-                        'reference': reference,
-                        'status': status.status
-                    }, status=drf_status.HTTP_200_OK)
-                else:
-                    return Response({'error': 'Payment not successful'}, status=drf_status.HTTP_400_BAD_REQUEST)
-            else:
-                return Response({'error': response.data['error']}, status=drf_status.HTTP_400_BAD_REQUEST)
-
+            payment = start_mobile_payment(
+                'subscription', reference, 'Order Payment', amount, email, phone,
+                tenant=tenant_profile, plan=plan)
+        except PaymentError as e:
+            return Response({'error': str(e)}, status=drf_status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'error': str(e)}, status=drf_status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        return Response({
+            'message': 'Payment initiated, confirm it on your phone',
+            'poll_url': payment.poll_url,
+            'reference': reference,
+            'status': payment.status
+        }, status=drf_status.HTTP_202_ACCEPTED)
+
 
 class PaymentResultView(APIView):
     permission_classes = [AllowAny]  # Allow access without authentication
 
     def post(self, request):
 
-        data = request.data
-        hash_string = '&'.join(
-            [f'{key}={data[key]}' for key in sorted(data.keys()) if key != 'hash'])
-        local_hash = hashlib.sha512(
-            (hash_string + settings.PAYNOW_INTEGRATION_KEY).encode('utf-8')).hexdigest()
-
-        if local_hash != data.get('hash'):
+        # Paynow hashes the posted values in the order they were sent
+        if not get_gateway().verify_status_update(request.data):
             return Response({'error': 'Invalid hash'}, status=drf_status.HTTP_400_BAD_REQUEST)
         status_data = request.data
         reference = status_data.get('reference')
         payment = Payment.objects.filter(reference=reference).first()
 
         if payment:
-            payment.status = status_data.get('status')
-            payment.save()
+            # Paynow may deliver the same result more than once
+            finish_payment(payment.id, status_data.get('status'))
             return Response({'status': 'Updated'}, status=drf_status.HTTP_200_OK)
         else:
             return Response({'error': 'Payment not found'}, status=drf_status.HTTP_404_NOT_FOUND)
@@ -348,21 +322,19 @@ class PaymentStatusView(APIView):
         if not poll_url:
             return Response({'error': 'Poll URL is required'}, status=drf_status.HTTP_400_BAD_REQUEST)
 
-        paynow = Paynow(
-            settings.PAYNOW_INTEGRATION_ID,
-            settings.PAYNOW_INTEGRATION_KEY,
-        )
+        payment = Payment.objects.filter(poll_url=poll_url).first()
+        if not payment:
+            return Response({'error': 'Payment not found'}, status=drf_status.HTTP_404_NOT_FOUND)
 
-        response = paynow.poll_transaction(poll_url)
+        # Final payments are answered from the database without calling Paynow
+        if not payment.is_final:
+            try:
+                payment = poll_payment(payment)
+            except Exception as e:
+                logger.error(f"Failed to poll payment {payment.reference}: {e}")
+                return Response({'error': 'Failed to get payment status'}, status=drf_status.HTTP_400_BAD_REQUEST)
 
-        if response.success:
-            payment_status = response.status
-            # Update your payment model if needed
-            Payment.objects.filter(poll_url=poll_url).update(
-                status=payment_status)
-            return Response({'status': payment_status}, status=drf_status.HTTP_200_OK)
-        else:
-            return Response({'error': 'Failed to get payment status'}, status=drf_status.HTTP_400_BAD_REQUEST)
+        return Response({'status': payment.status}, status=drf_status.HTTP_200_OK)
 
 
 class TenantProfileLimitedView(APIView):
@@ -408,7 +380,7 @@ class AddTenantAccessView(APIView):
             to=[context['recipient_email']]
         )
         email.content_subtype = "html"  # Main content is now HTML
-        email.send()
+        queue_email(email)
 
     @transaction.atomic
     def post(self, request, property_id):
@@ -555,6 +527,7 @@ logger = logging.getLogger(__name__)
 class SetCurrentTenantView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @transaction.atomic
     def post(self, request, property_id):
         if request.user.user_type != 'landlord':
             return Response({"error": "Only landlords can set current tenants."}, status=drf_status.HTTP_403_FORBIDDEN)
@@ -629,12 +602,11 @@ class SetCurrentTenantView(APIView):
 
     def send_email(self, subject, message, recipient_list):
         try:
-            send_mail(
+            queue_mail(
                 subject,
                 message,
                 settings.EMAIL_HOST_USER,
                 recipient_list,
-                fail_silently=False,
             )
         except Exception as e:
             logger.error(f"Failed to send email. Error: {str(e)}")
@@ -728,6 +700,7 @@ class SetCurrentTenantWithLeaseDocView(APIView):
         buffer.seek(0)
         return buffer
 
+    @transaction.atomic
     def post(self, request, property_id):
         print("Received request data:", request.data)
         print("Property ID:", property_id)
@@ -881,12 +854,11 @@ ROJA ACCOMODATION Team"""
 
     def send_email(self, subject, message, recipient_list):
         try:
-            send_mail(
+            queue_mail(
                 subject,
                 message,
                 settings.EMAIL_HOST_USER,
                 recipient_list,
-                fail_silently=False,
             )
         except Exception as e:
             print(f"Failed to send email. Error: {str(e)}")
@@ -900,9 +872,9 @@ ROJA ACCOMODATION Team"""
                 to=recipient_list
             )
             email.attach(filename, pdf_file.getvalue(), 'application/pdf')
-            email.send(fail_silently=False)
+            queue_email(email)
         except Exception as e:
-            print(f"Failed to send email with attachment. Error: {str(e)}")
+            print(f"Failed to queue email with attachment. Error: {str(e)}")
 
 
 class TenantRatingCreateView(APIView):
@@ -926,13 +898,8 @@ class TenantRatingCreateView(APIView):
                 comment=comment
             )
 
-            # Update tenant's overall rating (average of all ratings)
-            avg_rating = TenantRating.objects.filter(
-                tenant=tenant_profile
-            ).aggregate(Avg('rating'))['rating__avg']
-
-            tenant_profile.current_rating = round(float(avg_rating), 2)
-            tenant_profile.save()
+            # The tenant's current_rating is updated from running totals by
+            # the TenantRating signal handlers in api.signals
 
             serializer = TenantRatingSerializer(rating_obj)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -1026,6 +993,7 @@ class LandlordBalanceView(APIView):
 class CreateWithdrawalRequestView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @transaction.atomic
     def post(self, request):
         if request.user.user_type != 'landlord':
             return Response({
@@ -1106,12 +1074,11 @@ class CreateWithdrawalRequestView(APIView):
             Please process this request through the admin interface.
             """
 
-            send_mail(
+            queue_mail(
                 subject,
                 message,
                 settings.EMAIL_HOST_USER,
                 [settings.SUPPORT_EMAIL],
-                fail_silently=False
             )
         except Exception as e:
             print(f"Failed to send admin notification: {str(e)}")
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Property, PropertyImage, Application, Message, LeaseAgreement, Review, HouseType, HouseLocation, Comment, RentPayment
+from .models import Property, PropertyImage, Application, Message, LeaseAgreement, Review, HouseType, HouseLocation, Comment, RentPayment, OutboundEmail
 
 
 class PropertyImageInline(admin.TabularInline):
@@ -14,6 +14,8 @@ class PropertyAdmin(admin.ModelAdmin):
     list_filter = ('is_available', 'bedrooms', 'bathrooms',
                    'accepts_pets', 'has_solar_power', 'has_borehole')
     search_fields = ('title', 'description', 'address', 'owner__email')
+    # Kept current by api.signals; a full save() doesn't write them
+    readonly_fields = Property.maintained_fields
     inlines = [PropertyImageInline]
 
 
@@ -100,3 +102,12 @@ class RentPaymentAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('property', 'tenant')
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts',
+                    'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'to')
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
@@ -0,0 +1,156 @@
+"""
+Write-behind persistence for chat messages.
+
+ChatConsumer broadcasts a message as soon as it arrives and hands the unsaved
+Message to the process-wide message_buffer. The buffer saves everything
+waiting with one bulk_create, either CHAT_FLUSH_INTERVAL milliseconds after
+the first message arrives or as soon as CHAT_FLUSH_SIZE are waiting. Consumers
+flush on disconnect. Once a batch is saved, its participants' notification
+groups are told about it.
+
+If the batch insert fails the messages are saved one at a time, so one bad
+row can't hold up the rest. Rows the database rejects (integrity or data
+errors) are dropped and logged with their content. Rows that failed for
+other reasons, e.g. a lost connection, go back to the front of the buffer
+and are retried with backoff, up to CHAT_SAVE_ATTEMPTS times before they
+are dropped and logged too. The buffer holds at most CHAT_BUFFER_LIMIT
+messages; add() refuses more until it drains. Messages still buffered when
+the process is killed are lost.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+
+from .models import Message
+from .notifications import anotify_new_messages
+
+logger = logging.getLogger(__name__)
+
+
+# Errors caused by the row itself; saving it again would fail the same way
+REJECTED_ERRORS = (IntegrityError, DataError)
+
+
+@database_sync_to_async
+def save_messages(messages):
+    """
+    Save messages in one insert, or one at a time if that fails. Returns
+    (saved, failed), failed being (message, error) pairs.
+    """
+    try:
+        Message.objects.bulk_create(messages)
+        return messages, []
+    except Exception as e:
+        logger.warning(f"Failed to save {len(messages)} chat messages at once, saving them one by one: {e}")
+
+    saved, failed = [], []
+    for message in messages:
+        try:
+            with transaction.atomic():
+                message.save()
+            saved.append(message)
+        except Exception as e:
+            failed.append((message, e))
+    return saved, failed
+
+
+def drop_message(message, reason):
+    logger.error(
+        f"Dropping chat message from user {message.sender_id} to user {message.receiver_id}: "
+        f"{reason}; content: {message.content!r}")
+
+
+class MessageBuffer:
+    def __init__(self, interval=None, size=None, limit=None, attempts=None):
+        self.interval = (interval if interval is not None
+                         else settings.CHAT_FLUSH_INTERVAL) / 1000
+        self.size = size if size is not None else settings.CHAT_FLUSH_SIZE
+        self.limit = limit if limit is not None else settings.CHAT_BUFFER_LIMIT
+        self.attempts = attempts if attempts is not None else settings.CHAT_SAVE_ATTEMPTS
+        self.pending = []
+        # Messages taken by a flush that is still saving them
+        self.saving = 0
+        self.loop = None
+        self.lock = None
+        self.timer = None
+        self.tasks = set()
+
+    def bind(self):
+        # asyncio primitives belong to one event loop; tests and management
+        # commands may run several loops in turn
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.lock = asyncio.Lock()
+            self.timer = None
+            self.tasks = set()
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def add(self, message):
+        """Buffer message to be saved; False if the buffer is full"""
+        self.bind()
+        if len(self.pending) + self.saving >= self.limit:
+            logger.error(f"Chat message buffer is full ({self.limit} messages); refusing a message")
+            return False
+        self.pending.append(message)
+        if len(self.pending) >= self.size:
+            self.spawn(self.flush())
+        elif self.timer is None:
+            self.timer = self.spawn(self.flush_later())
+        return True
+
+    async def flush_later(self, delay=None):
+        await asyncio.sleep(self.interval if delay is None else delay)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Save everything buffered; returns the number of messages written"""
+        self.bind()
+        async with self.lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, []
+            self.saving = len(batch)
+            try:
+                saved, failed = await save_messages(batch)
+            except Exception as e:
+                saved, failed = [], [(message, e) for message in batch]
+            finally:
+                self.saving = 0
+
+            retry = []
+            for message, error in failed:
+                message.save_attempts = getattr(message, 'save_attempts', 0) + 1
+                if isinstance(error, REJECTED_ERRORS):
+                    drop_message(message, error)
+                elif message.save_attempts >= self.attempts:
+                    drop_message(message, f'{message.save_attempts} failed attempts, the last: {error}')
+                else:
+                    retry.append(message)
+
+            if retry:
+                logger.error(f"Failed to save {len(retry)} chat messages; retrying")
+                self.pending[:0] = retry
+                if self.timer is not None:
+                    self.timer.cancel()
+                backoff = 2 ** max(message.save_attempts for message in retry)
+                self.timer = self.spawn(self.flush_later(self.interval * backoff))
+            elif not self.pending and self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        if saved:
+            await anotify_new_messages(saved)
+        return len(saved)
+
+
+message_buffer = MessageBuffer()
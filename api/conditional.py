@@ -0,0 +1,104 @@
+"""
+Conditional GET (ETag and Last-Modified) for single-object endpoints.
+
+ConditionalGetMixin reads the object's timestamps (Property.updated_at, the
+profiles' last_updated and rating_updated_at) with one values() query and
+answers If-None-Match and If-Modified-Since with 304 before the object is
+loaded or serialized.
+
+auto_now only fires on save(). Writes through QuerySet.update() set the
+timestamp with touch(), or touch_rating() for writes of ratings and their
+totals: update_landlord_ratings(changed_only=True) reads last_updated as
+"the profile was edited", so rating writes must leave it alone. Changes to
+rows rendered inside a property (its images, comments, owner and tenants,
+type and location) touch the property (see api.signals).
+"""
+import hashlib
+
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework import status
+
+from accounts.models import LandlordProfile, TenantProfile
+from .models import Property
+
+TIMESTAMP_FIELDS = {
+    Property: 'updated_at',
+    LandlordProfile: 'last_updated',
+    TenantProfile: 'last_updated',
+}
+
+# Set when only the ratings change; Property has no separate one
+RATING_TIMESTAMP_FIELDS = {
+    Property: 'updated_at',
+    LandlordProfile: 'rating_updated_at',
+    TenantProfile: 'rating_updated_at',
+}
+
+
+def touch(model, values):
+    """values for QuerySet.update(), plus the model's timestamp if it has one"""
+    if model in TIMESTAMP_FIELDS:
+        return {**values, TIMESTAMP_FIELDS[model]: timezone.now()}
+    return values
+
+
+def touch_rating(model, values):
+    """Like touch(), for updates of ratings and their totals"""
+    if model in RATING_TIMESTAMP_FIELDS:
+        return {**values, RATING_TIMESTAMP_FIELDS[model]: timezone.now()}
+    return values
+
+
+def touch_property(property_id):
+    Property.objects.filter(id=property_id).update(updated_at=timezone.now())
+
+
+class ConditionalGetMixin:
+    """
+    Validate GETs of one conditional_model row, selected by
+    get_conditional_lookup(). Views defining their own get() call
+    conditional_get() from it.
+    """
+    conditional_model = None
+
+    def get_conditional_lookup(self):
+        """Filter kwargs for the object, or None to answer unconditionally"""
+        return {'pk': self.kwargs['pk']}
+
+    def get(self, request, *args, **kwargs):
+        return self.conditional_get(request, super().get, *args, **kwargs)
+
+    def conditional_get(self, request, get, *args, **kwargs):
+        lookup = self.get_conditional_lookup()
+        updated = None
+        if lookup is not None:
+            fields = {TIMESTAMP_FIELDS[self.conditional_model],
+                      RATING_TIMESTAMP_FIELDS[self.conditional_model]}
+            timestamps = self.conditional_model.objects.filter(**lookup).values_list(*fields).first()
+            # rating_updated_at stays empty until a rating is first written
+            updated = max(filter(None, timestamps or ()), default=None)
+        if updated is None:
+            return get(request, *args, **kwargs)
+
+        # Responses differ per user (e.g. comment reactions) and format
+        validator = ':'.join(str(part) for part in (
+            self.conditional_model._meta.label_lower, sorted(lookup.items()),
+            updated.isoformat(), request.user.pk, request.accepted_renderer.format,
+            request.META.get('QUERY_STRING', '')))
+        etag = '"%s"' % hashlib.sha256(validator.encode()).hexdigest()[:32]
+        last_modified = int(updated.timestamp())  # HTTP dates have one-second resolution
+
+        response = get_conditional_response(
+            request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            response['Last-Modified'] = http_date(last_modified)
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True)
+        return response
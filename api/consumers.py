@@ -2,19 +2,34 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
+from .chat_buffer import message_buffer
 from .models import Message
+from .notifications import notification_group
 from .serializers import MessageSerializer
 
 User = get_user_model()
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        print("Connection attempt received")
-        print("Scope:", self.scope)
         self.room_name = self.scope['url_route']['kwargs']['room_name']
-        print(f"Room name: {self.room_name}")
         self.room_group_name = f'chat_{self.room_name}'
 
+        # The sender is whoever authenticated the socket, resolved once here
+        # rather than looked up from the frame on every message
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+        members = [int(member) for member in self.room_name.split('_')]
+        if self.user.id not in members:
+            await self.close()
+            return
+        # Messages on this socket can only go to the room's other member
+        self.partner_id = members[1] if members[0] == self.user.id else members[0]
+
+        # receiver id -> email, filled in as this connection sees receivers
+        self.receiver_emails = {}
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -22,6 +37,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'receiver_emails'):
+            # Rejected in connect, never joined the group
+            return
+        # Don't leave this socket's messages waiting on the flush timer
+        await message_buffer.flush()
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -31,15 +51,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message = text_data_json['message']
-        sender_id = text_data_json['sender']
-        receiver_id = text_data_json['receiver']
+        receiver_id = int(text_data_json['receiver'])
+        if receiver_id != self.partner_id:
+            await self.send(text_data=json.dumps({'error': 'Receiver is not in this chat'}))
+            return
 
-        # Convert IDs to email addresses
-        sender_email = await self.get_user_email(sender_id)
-        receiver_email = await self.get_user_email(receiver_id)
+        receiver_email = await self.get_receiver_email(receiver_id)
+        if receiver_email is None:
+            await self.send(text_data=json.dumps({'error': 'Receiver not found'}))
+            return
 
-        # Save message to database
-        await self.save_message(sender_email, receiver_email, message)
+        # Saved in the background by the write-behind buffer, so the
+        # broadcast doesn't wait on the insert
+        if not message_buffer.add(Message(
+                sender_id=self.user.id, receiver_id=receiver_id, content=message)):
+            await self.send(text_data=json.dumps({'error': 'Message could not be sent, try again later'}))
+            return
 
         # Send message to room group
         await self.channel_layer.group_send(
@@ -47,7 +74,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             {
                 'type': 'chat_message',
                 'message': message,
-                'sender': sender_email,
+                'sender': self.user.email,
                 'receiver': receiver_email
             }
         )
@@ -64,16 +91,54 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'receiver': receiver
         }))
 
-    @database_sync_to_async
-    def save_message(self, sender_email, receiver_email, content):
-        sender = User.objects.get(email=sender_email)
-        receiver = User.objects.get(email=receiver_email)
-        Message.objects.create(sender=sender, receiver=receiver, content=content)
+    async def get_receiver_email(self, receiver_id):
+        if receiver_id not in self.receiver_emails:
+            self.receiver_emails[receiver_id] = await self.get_user_email(receiver_id)
+        return self.receiver_emails[receiver_id]
 
     @database_sync_to_async
     def get_user_email(self, user_id):
-        try:
-            user = User.objects.get(id=user_id)
-            return user.email
-        except User.DoesNotExist:
-            return None
\ No newline at end of file
+        return User.objects.filter(id=user_id).values_list('email', flat=True).first()
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Relays the user's notification group (see api.notifications) to the
+    socket. The first frame is the current unread count; later frames are
+    deltas and inbox updates.
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = notification_group(self.user.id)
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.send(text_data=json.dumps({
+            'type': 'unread_count',
+            'unread_count': await self.get_unread_count()
+        }))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def unread_count(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'unread_count',
+            'delta': event['delta'],
+            'chats': event['chats']
+        }))
+
+    async def inbox_update(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'inbox_update',
+            'chat': event['chat']
+        }))
+
+    @database_sync_to_async
+    def get_unread_count(self):
+        return Message.objects.filter(receiver=self.user, is_read=False).count()
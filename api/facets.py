@@ -0,0 +1,76 @@
+"""
+Facet counts for the property browse listing.
+
+property_facets() counts a filtered queryset by location, house type,
+bedroom bucket and amenity in one query. Rows are grouped by (location,
+type, bedroom bucket), the amenity counts are conditional aggregates of
+each group, and the groups are summed per facet here. The number of groups
+is bounded by the small location and type tables, not by the catalogue.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+AMENITIES = ['pool', 'garden', 'has_solar_power', 'has_borehole', 'accepts_pets', 'accepts_smokers']
+
+# Bedroom counts from here up share one bucket, e.g. "5+"
+MAX_BEDROOM_BUCKET = 5
+
+# Query parameters that change how results are shown, not which match
+NON_FILTER_PARAMS = {'cursor', 'page_size', 'ordering', 'fields', 'expand', 'view', 'format'}
+
+
+def facet_cache_key(query_params):
+    """Cache key for a filter, ignoring parameter order and display-only parameters"""
+    items = sorted(
+        (key, value.strip())
+        for key in query_params if key not in NON_FILTER_PARAMS
+        for value in query_params.getlist(key) if value.strip()
+    )
+    return 'property_facets:' + hashlib.sha256(urlencode(items).encode()).hexdigest()
+
+
+def add_count(counts, key, name, count):
+    if key is None:
+        return
+    entry = counts.setdefault(key, {'id': key, 'name': name, 'count': 0})
+    entry['count'] += count
+
+
+def property_facets(queryset):
+    bedroom_bucket = Case(
+        When(bedrooms__gte=MAX_BEDROOM_BUCKET, then=Value(MAX_BEDROOM_BUCKET)),
+        default=F('bedrooms'), output_field=IntegerField())
+    groups = (
+        queryset.order_by()
+        .annotate(bedroom_bucket=bedroom_bucket)
+        .values('location_id', 'location__name', 'type_id', 'type__name', 'bedroom_bucket')
+        .annotate(count=Count('id'), **{
+            amenity: Count('id', filter=Q(**{amenity: True})) for amenity in AMENITIES})
+    )
+
+    total = 0
+    locations, types, bedrooms = {}, {}, {}
+    amenities = dict.fromkeys(AMENITIES, 0)
+    for group in groups:
+        total += group['count']
+        add_count(locations, group['location_id'], group['location__name'], group['count'])
+        add_count(types, group['type_id'], group['type__name'], group['count'])
+        bedrooms[group['bedroom_bucket']] = bedrooms.get(group['bedroom_bucket'], 0) + group['count']
+        for amenity in AMENITIES:
+            amenities[amenity] += group[amenity]
+
+    def by_count(counts):
+        return sorted(counts.values(), key=lambda entry: (-entry['count'], entry['name']))
+
+    return {
+        'total': total,
+        'location': by_count(locations),
+        'type': by_count(types),
+        'bedrooms': [
+            {'value': f'{bucket}+' if bucket == MAX_BEDROOM_BUCKET else str(bucket), 'count': count}
+            for bucket, count in sorted(bedrooms.items())
+        ],
+        'amenities': amenities,
+    }
@@ -1,5 +1,8 @@
 import django_filters
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
 from .models import Property, HouseLocation
+from .search import search_properties
 
 
 class PropertyFilter(django_filters.FilterSet):
@@ -48,6 +51,14 @@ class PropertyFilter(django_filters.FilterSet):
                   'is_available', 'preferred_lease_term', 'accepts_pets', 'pet_deposit', 'accepts_smokers',
                   'pool', 'garden', 'has_solar_power', 'has_borehole', 'type', 'location']
 
-    def filter_queryset(self, queryset):
-        queryset = super().filter_queryset(queryset)
-        return queryset.distinct()
+
+class PropertySearchFilter(BaseFilterBackend):
+    """?search= through api.search, best matches first, then the view's own ordering"""
+    search_param = api_settings.SEARCH_PARAM
+
+    def filter_queryset(self, request, queryset, view):
+        terms = request.query_params.get(self.search_param, '').strip()
+        if not terms:
+            return queryset
+        return search_properties(queryset, terms).order_by(
+            '-search_rank', *queryset.query.order_by)
@@ -0,0 +1,217 @@
+"""
+Property image pipeline.
+
+Uploads are saved untouched and marked PENDING so creating a listing does
+not wait on Pillow. process_pending_images(), run by the
+process_property_images command, watermarks them in a process pool, swaps
+the stored file for the watermarked JPEG and stores WebP derivatives
+(thumb, card, full) beside it.
+
+Images are claimed (PROCESSING, with claimed_at) in a short transaction and
+processed with no locks held; each result is then saved in its own
+transaction. Files the row no longer points to are deleted only once that
+transaction commits, so a rollback never leaves a row pointing at a
+deleted file; files saved for a transaction that rolls back are deleted
+straight away, so they aren't left behind with no row pointing at them.
+"""
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PropertyImage
+from .utils import (
+    open_rgb, apply_watermark, encode_jpeg, make_derivatives,
+    watermarked_name, derivative_name)
+
+logger = logging.getLogger(__name__)
+
+# A claim older than this is assumed to belong to a worker that died
+CLAIM_LEASE = timedelta(minutes=10)
+
+
+def read_image(image):
+    image.image.open('rb')
+    try:
+        return image.image.read()
+    finally:
+        image.image.close()
+
+
+def watermark_job(data):
+    """Runs in a worker process; errors are returned so one bad file doesn't stop the batch"""
+    try:
+        image = open_rgb(data)
+        apply_watermark(image)
+        return (encode_jpeg(image), make_derivatives(image)), None
+    except Exception as e:
+        return None, str(e)
+
+
+def derivatives_job(data):
+    """Like watermark_job, for images that are already watermarked"""
+    try:
+        return make_derivatives(open_rgb(data)), None
+    except Exception as e:
+        return None, str(e)
+
+
+def delete_on_commit(storage, name):
+    transaction.on_commit(lambda: storage.delete(name))
+
+
+@contextmanager
+def delete_on_error(storage):
+    """
+    Yields a list for the names of files saved in the block. If the block
+    raises, e.g. as its transaction rolls back, those files are deleted.
+    Enter it before transaction.atomic() so the rollback comes first.
+    """
+    saved = []
+    try:
+        yield saved
+    except Exception:
+        for name in saved:
+            try:
+                storage.delete(name)
+            except Exception as e:
+                logger.error(f"Failed to delete orphaned file {name}: {e}")
+        raise
+
+
+def mark_failed(image, error):
+    logger.error(f"Failed to process image {image.id}: {error}")
+    image.processing_status = 'FAILED'
+    image.save(update_fields=['processing_status'])
+
+
+def save_derivatives(image, derivatives, saved):
+    """
+    Store derivative files next to image.image and record them on the row,
+    adding their names to saved (see delete_on_error). Call inside the
+    transaction that saves the row.
+    """
+    storage = image.image.storage
+    for old in image.derivatives.values():
+        delete_on_commit(storage, old['name'])
+
+    image.derivatives = {}
+    for derivative, (content, width, height) in derivatives.items():
+        name = storage.save(derivative_name(
+            image.image.name, derivative), ContentFile(content))
+        saved.append(name)
+        image.derivatives[derivative] = {
+            'name': name, 'width': width, 'height': height}
+
+
+def run_jobs(job, images, executor=None):
+    """Yield (image, result, error) for images whose file could be read"""
+    readable, originals = [], []
+    for image in images:
+        try:
+            originals.append(read_image(image))
+            readable.append(image)
+        except Exception as e:
+            yield image, None, str(e)
+
+    run = executor.map if executor is not None else map
+    for image, (result, error) in zip(readable, run(job, originals)):
+        yield image, result, error
+
+
+def claim_pending_images(batch_size):
+    """Mark up to batch_size PENDING (or abandoned PROCESSING) images as ours"""
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked lets several workers share the queue
+        images = list(
+            PropertyImage.objects.select_for_update(skip_locked=True)
+            .filter(Q(processing_status='PENDING') |
+                    Q(processing_status='PROCESSING', claimed_at__lt=now - CLAIM_LEASE))
+            .order_by('id')[:batch_size]
+        )
+        PropertyImage.objects.filter(id__in=[image.id for image in images]).update(
+            processing_status='PROCESSING', claimed_at=now)
+    for image in images:
+        image.processing_status = 'PROCESSING'
+        image.claimed_at = now
+    return images
+
+
+def still_claimed(image):
+    """Lock the row, if our claim on it has not been taken over"""
+    return PropertyImage.objects.select_for_update().filter(
+        id=image.id, processing_status='PROCESSING', claimed_at=image.claimed_at).exists()
+
+
+def process_pending_images(batch_size=20, executor=None):
+    """
+    Watermark up to batch_size PENDING images, using executor (e.g. a
+    ProcessPoolExecutor) for the Pillow work when given. Returns
+    (done, failed) counts for this batch.
+    """
+    done = failed = 0
+
+    images = claim_pending_images(batch_size)
+    for image, result, error in run_jobs(watermark_job, images, executor):
+        try:
+            with delete_on_error(image.image.storage) as saved, transaction.atomic():
+                if not still_claimed(image):
+                    logger.warning(f"Lost the claim on image {image.id}; skipping it")
+                    continue
+                if error:
+                    mark_failed(image, error)
+                    failed += 1
+                    continue
+
+                watermarked, derivatives = result
+                original_name = image.image.name
+                image.image.save(watermarked_name(original_name),
+                                 ContentFile(watermarked), save=False)
+                saved.append(image.image.name)
+                save_derivatives(image, derivatives, saved)
+                image.processing_status = 'DONE'
+                image.save(update_fields=[
+                           'image', 'derivatives', 'processing_status'])
+                delete_on_commit(image.image.storage, original_name)
+                done += 1
+        except Exception as e:
+            # Storage or database errors: this image stays claimed and is
+            # retried once the lease runs out; the rest of the batch carries on
+            logger.exception(f"Failed to save processed image {image.id}: {e}")
+            failed += 1
+
+    return done, failed
+
+
+def backfill_derivatives(after_id=0, batch_size=20, executor=None, force=False):
+    """
+    Generate derivatives for the next batch_size watermarked images after
+    after_id that have none (all of them with force). Returns
+    (done, failed, last_id); last_id is None once there are no more.
+    """
+    done = failed = 0
+    images = PropertyImage.objects.filter(
+        processing_status='DONE', id__gt=after_id)
+    if not force:
+        images = images.filter(derivatives={})
+    images = list(images.order_by('id')[:batch_size])
+
+    for image, derivatives, error in run_jobs(derivatives_job, images, executor):
+        if error:
+            # Leave the row alone; the original upload may just be missing
+            logger.error(
+                f"Failed to build derivatives for image {image.id}: {error}")
+            failed += 1
+            continue
+
+        with delete_on_error(image.image.storage) as saved, transaction.atomic():
+            save_derivatives(image, derivatives, saved)
+            image.save(update_fields=['derivatives'])
+        done += 1
+
+    return done, failed, images[-1].id if images else None
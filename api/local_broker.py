@@ -0,0 +1,145 @@
+"""
+A small in-process stand-in for Redis pub/sub.
+
+It speaks just enough of the Redis protocol (PUBLISH, SUBSCRIBE,
+UNSUBSCRIBE, PING and the handshake commands redis-py sends, over RESP2
+or RESP3) for channels_redis.pubsub.RedisPubSubChannelLayer, so several Daphne
+processes, tests and benchmarks can share a channel layer without a
+Redis server. Run it with `python manage.py local_channel_broker` and set
+CHANNEL_REDIS_URL=redis://127.0.0.1:6390/0. Not for production use.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+def encode(value, push=False):
+    """
+    Encode a reply. Lists are arrays, or RESP3 push frames with push=True
+    (pub/sub messages on a RESP3 connection); dicts are RESP3 maps.
+    """
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, dict):
+        return b'%%%d\r\n' % len(value) + b''.join(
+            encode(key) + encode(item) for key, item in value.items())
+    prefix = b'>' if push else b'*'
+    return prefix + b'%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+
+
+SERVER_INFO = {
+    'server': 'redis',
+    'version': '7.0.0',
+    'id': 1,
+    'mode': 'standalone',
+    'role': 'master',
+    'modules': [],
+}
+
+
+class LocalBroker:
+    def __init__(self):
+        self.subscribers = defaultdict(set)  # channel -> {writer}
+        self.protocols = {}  # writer -> 2 or 3, as negotiated with HELLO
+
+    async def read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, e.g. from redis-cli or telnet
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    def push(self, writer, value):
+        writer.write(encode(value, push=self.protocols.get(writer) == 3))
+
+    async def handle_client(self, reader, writer):
+        subscriptions = set()
+        self.protocols[writer] = 2
+        try:
+            while True:
+                command = await self.read_command(reader)
+                if command is None:
+                    break
+                if not command:
+                    continue
+                name = command[0].upper()
+                args = command[1:]
+
+                if name == b'PUBLISH':
+                    channel, data = args
+                    receivers = self.subscribers.get(channel, ())
+                    for receiver in list(receivers):
+                        self.push(receiver, [b'message', channel, data])
+                    writer.write(encode(len(receivers)))
+                elif name == b'SUBSCRIBE':
+                    for channel in args:
+                        self.subscribers[channel].add(writer)
+                        subscriptions.add(channel)
+                        self.push(
+                            writer, [b'subscribe', channel, len(subscriptions)])
+                elif name == b'UNSUBSCRIBE':
+                    for channel in args or list(subscriptions):
+                        self.unsubscribe(channel, writer)
+                        subscriptions.discard(channel)
+                        self.push(
+                            writer, [b'unsubscribe', channel, len(subscriptions)])
+                elif name == b'HELLO':
+                    protocol = int(args[0]) if args else 2
+                    self.protocols[writer] = protocol
+                    info = dict(SERVER_INFO, proto=protocol)
+                    if protocol == 3:
+                        writer.write(encode(info))
+                    else:
+                        writer.write(encode(
+                            [part for pair in info.items() for part in pair]))
+                elif name == b'PING':
+                    writer.write(b'+PONG\r\n')
+                elif name in (b'CLIENT', b'SELECT', b'AUTH', b'FLUSHALL', b'FLUSHDB'):
+                    writer.write(b'+OK\r\n')
+                elif name == b'QUIT':
+                    writer.write(b'+OK\r\n')
+                    break
+                else:
+                    writer.write(b"-ERR unknown command '%s'\r\n" % name)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscriptions:
+                self.unsubscribe(channel, writer)
+            self.protocols.pop(writer, None)
+            writer.close()
+
+    def unsubscribe(self, channel, writer):
+        receivers = self.subscribers.get(channel)
+        if receivers is not None:
+            receivers.discard(writer)
+            if not receivers:
+                del self.subscribers[channel]
+
+    async def serve(self, host='127.0.0.1', port=6390, ready=None):
+        """
+        Serve until cancelled. With port 0 the OS picks a free port; the
+        bound one is in self.port by the time ready is set.
+        """
+        server = await asyncio.start_server(self.handle_client, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info(f"Local channel broker listening on {host}:{self.port}")
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,183 @@
+"""
+Email outbox.
+
+Views queue messages instead of talking to SMTP inside the request. The
+rows are written in the caller's transaction, so an email is only sent if
+the work it describes was committed. The send_queued_emails command
+delivers them in batches over a single SMTP connection.
+
+A batch is claimed by marking it SENDING in a short transaction, and sent
+with no transaction or row locks held. Each email's outcome is saved as
+soon as it is known. A claim older than CLAIM_LEASE belongs to a worker that
+died, and its emails are sent again, so delivery is at least once.
+"""
+import logging
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.utils import timezone
+
+from .models import OutboundEmail, OutboundEmailAttachment
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+FIRST_RETRY_DELAY = timedelta(minutes=1)
+MAX_RETRY_DELAY = timedelta(hours=1)
+CLAIM_LEASE = timedelta(minutes=10)
+
+
+def queue_email(message):
+    """Queue an EmailMessage; attachments must be (filename, content, mimetype)"""
+    with transaction.atomic():
+        email = OutboundEmail.objects.create(
+            subject=message.subject,
+            body=message.body,
+            content_subtype=message.content_subtype,
+            from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+            to=list(message.to),
+            cc=list(message.cc),
+            bcc=list(message.bcc),
+            reply_to=list(message.reply_to),
+        )
+        OutboundEmailAttachment.objects.bulk_create([
+            OutboundEmailAttachment(
+                email=email,
+                filename=filename,
+                content=content.encode('utf-8') if isinstance(
+                    content, str) else content,
+                mimetype=mimetype
+            )
+            for filename, content, mimetype in message.attachments
+        ])
+    return email
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    """Queued counterpart of django.core.mail.send_mail"""
+    return queue_email(EmailMessage(
+        subject=subject,
+        body=message,
+        from_email=from_email,
+        to=recipient_list
+    ))
+
+
+def build_message(email, connection=None):
+    message = EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        cc=email.cc,
+        bcc=email.bcc,
+        reply_to=email.reply_to,
+        connection=connection
+    )
+    message.content_subtype = email.content_subtype
+    for attachment in email.attachments.all():
+        message.attach(attachment.filename, bytes(
+            attachment.content), attachment.mimetype)
+    return message
+
+
+def claim_due_emails(batch_size):
+    """Mark up to batch_size due (or abandoned SENDING) emails as ours"""
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked lets several workers drain the outbox side by side
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='PENDING', next_attempt_at__lte=now) |
+                    Q(status='SENDING', claimed_at__lt=now - CLAIM_LEASE))
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            status='SENDING', claimed_at=now)
+    for email in emails:
+        email.status = 'SENDING'
+        email.claimed_at = now
+    prefetch_related_objects(emails, 'attachments')
+    return emails
+
+
+def is_connection_error(error):
+    """True for errors of the SMTP connection rather than of one email"""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    # SMTPException is an OSError too; the others are socket errors
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def deliver(connection, email):
+    connection.open()  # No-op while the connection is up
+    connection.send_messages([build_message(email, connection)])
+
+
+def send_queued_emails(batch_size=50):
+    """
+    Send up to batch_size due emails over one SMTP connection. Failed
+    emails are retried with exponential backoff, and marked FAILED after
+    MAX_ATTEMPTS. If the connection drops it is reopened; if SMTP can't be
+    reached, the unsent emails go back to the queue without using up an
+    attempt. Returns (sent, failed, deferred) counts for this batch,
+    deferred being the emails put back because SMTP was unreachable.
+    """
+    sent = failed = deferred = 0
+    emails = claim_due_emails(batch_size)
+    if not emails:
+        return sent, failed, deferred
+
+    connection = get_connection(fail_silently=False)
+    try:
+        for index, email in enumerate(emails):
+            try:
+                try:
+                    deliver(connection, email)
+                except Exception as e:
+                    if not is_connection_error(e):
+                        raise
+                    # Reconnect and try once more
+                    connection.close()
+                    deliver(connection, email)
+            except Exception as e:
+                if is_connection_error(e):
+                    logger.error(f"SMTP connection failed, returning {len(emails) - index} emails to the queue: {e}")
+                    release(emails[index:], e)
+                    deferred = len(emails) - index
+                    break
+                schedule_retry(email, e)
+                email.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error'])
+                failed += 1
+            else:
+                email.status = 'SENT'
+                email.sent_at = timezone.now()
+                email.attempts += 1
+                email.save(update_fields=['status', 'attempts', 'sent_at'])
+                sent += 1
+    finally:
+        connection.close()
+
+    return sent, failed, deferred
+
+
+def release(emails, error):
+    """Put claimed emails back in the queue without counting an attempt"""
+    OutboundEmail.objects.filter(id__in=[email.id for email in emails]).update(
+        status='PENDING', next_attempt_at=timezone.now() + FIRST_RETRY_DELAY,
+        last_error=str(error))
+
+
+def schedule_retry(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'FAILED'
+    else:
+        email.status = 'PENDING'
+        email.next_attempt_at = timezone.now() + min(
+            FIRST_RETRY_DELAY * (2 ** (email.attempts - 1)), MAX_RETRY_DELAY)
@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+import queue
+import threading
+import time
+
+from channels_redis.pubsub import RedisPubSubChannelLayer
+from django.core.management.base import BaseCommand, CommandError
+
+from api.local_broker import LocalBroker
+from api.utils import percentile
+
+GROUP = 'chat_benchmark'
+
+
+def fanout_worker(url, sockets, messages, timeout, ready, results):
+    """One simulated Daphne process holding `sockets` consumers in GROUP"""
+    async def run():
+        layer = RedisPubSubChannelLayer(hosts=[url])
+        channels = [await layer.new_channel() for _ in range(sockets)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        ready.put(True)
+
+        latencies = []
+
+        async def drain(channel):
+            for _ in range(messages):
+                message = await layer.receive(channel)
+                latencies.append(time.time() - message['sent'])
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(drain(channel) for channel in channels)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        results.put(latencies)
+        await layer.flush()
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = ('Measure chat group fan-out latency through the Redis pub/sub channel '
+            'layer across several worker processes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of processes, like separate Daphne workers')
+        parser.add_argument('--sockets', type=int, default=25,
+                            help='Group members (open chat sockets) per process')
+        parser.add_argument('--messages', type=int, default=200,
+                            help='Messages sent to the group')
+        parser.add_argument('--rate', type=float, default=500,
+                            help='Messages sent per second')
+        parser.add_argument('--redis-url', default=None,
+                            help='Broker to use; defaults to a local stand-in on a free port')
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        url = options['redis_url'] or self.start_local_broker()
+
+        context = multiprocessing.get_context('spawn')
+        ready, results = context.Queue(), context.Queue()
+        processes = [
+            context.Process(target=fanout_worker, args=(
+                url, options['sockets'], options['messages'], options['timeout'],
+                ready, results))
+            for _ in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for _ in processes:
+                ready.get(timeout=options['timeout'])
+        except queue.Empty:
+            raise CommandError(f'Workers could not join the group through {url}')
+
+        started = time.perf_counter()
+        asyncio.run(self.send_messages(url, options['messages'], options['rate']))
+        send_time = time.perf_counter() - started
+
+        latencies = []
+        for _ in processes:
+            latencies.extend(results.get(timeout=options['timeout'] + 5))
+        for process in processes:
+            process.join()
+
+        expected = options['workers'] * options['sockets'] * options['messages']
+        latencies.sort()
+        self.stdout.write(
+            f"{options['messages']} messages to {options['workers']} processes x "
+            f"{options['sockets']} sockets in {send_time:.2f}s via {url}")
+        self.stdout.write(f'Delivered {len(latencies)}/{expected}')
+        if latencies:
+            self.stdout.write(
+                f'Fan-out latency: p50 {percentile(latencies, 50) * 1000:.2f}ms, '
+                f'p95 {percentile(latencies, 95) * 1000:.2f}ms, '
+                f'p99 {percentile(latencies, 99) * 1000:.2f}ms, '
+                f'max {latencies[-1] * 1000:.2f}ms')
+
+    async def send_messages(self, url, messages, rate):
+        layer = RedisPubSubChannelLayer(hosts=[url])
+        for seq in range(messages):
+            await layer.group_send(GROUP, {
+                'type': 'chat_message', 'seq': seq, 'sent': time.time()})
+            await asyncio.sleep(1 / rate)
+        await layer.flush()
+
+    def start_local_broker(self):
+        ready = threading.Event()
+        broker = LocalBroker()
+
+        def run():
+            # Port 0: the OS assigns a free port
+            asyncio.run(broker.serve('127.0.0.1', 0, ready))
+
+        threading.Thread(target=run, daemon=True).start()
+        if not ready.wait(5):
+            raise CommandError('Local channel broker did not start')
+        return f'redis://127.0.0.1:{broker.port}/0'
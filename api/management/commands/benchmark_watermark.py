@@ -0,0 +1,57 @@
+import time
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from api import utils
+
+
+class Command(BaseCommand):
+    help = 'Measure add_watermark throughput with a cold and a warm watermark cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Images watermarked per run')
+        parser.add_argument('--sizes', default='4000x3000,4032x3024,3264x2448',
+                            help='Comma separated WIDTHxHEIGHT photo sizes to cycle through')
+        parser.add_argument('--watermark', default=None,
+                            help='Watermark file to use instead of WATERMARK_PATH')
+
+    def handle(self, *args, **options):
+        if options['watermark']:
+            utils.WATERMARK_PATH = options['watermark']
+        try:
+            utils.load_watermark(1000)
+        except OSError as e:
+            raise CommandError(f'Cannot load watermark: {e}')
+
+        photos = []
+        for size in options['sizes'].split(','):
+            width, height = (int(n) for n in size.split('x'))
+            buffer = BytesIO()
+            Image.new('RGB', (width, height), (120, 140, 160)).save(
+                buffer, format='JPEG', quality=90)
+            photos.append(buffer.getvalue())
+
+        def run(cold):
+            utils.clear_watermark_cache()
+            start = time.perf_counter()
+            for i in range(options['iterations']):
+                if cold:
+                    # What every call paid before the cache existed
+                    utils.clear_watermark_cache()
+                photo = photos[i % len(photos)]
+                utils.add_watermark(SimpleUploadedFile('photo.jpg', photo))
+            return time.perf_counter() - start
+
+        cold = run(cold=True)
+        warm = run(cold=False)
+        iterations = options['iterations']
+
+        self.stdout.write(
+            f'Uncached: {iterations / cold:.2f} images/s ({cold / iterations * 1000:.1f} ms each)')
+        self.stdout.write(
+            f'Cached:   {iterations / warm:.2f} images/s ({warm / iterations * 1000:.1f} ms each)')
+        self.stdout.write(f'Cache: {utils.scaled_watermark.cache_info()}')
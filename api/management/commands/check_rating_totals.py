@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.ratings import verify_rating_totals
+
+
+class Command(BaseCommand):
+    help = ('Recount the rating totals kept by api.signals from the source rows and '
+            'report (or with --fix, repair) any that drifted')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Rewrite drifted totals and re-derive their ratings')
+
+    def handle(self, *args, **options):
+        drifted = verify_rating_totals(fix=options['fix'])
+        for model, ids in drifted.items():
+            if ids:
+                shown = ', '.join(str(id) for id in ids[:20])
+                more = f' and {len(ids) - 20} more' if len(ids) > 20 else ''
+                self.stdout.write(self.style.WARNING(
+                    f'{model}: {len(ids)} drifted ({shown}{more})'))
+            else:
+                self.stdout.write(f'{model}: all totals match')
+        if options['fix'] and any(drifted.values()):
+            self.stdout.write(self.style.SUCCESS('Drifted totals repaired'))
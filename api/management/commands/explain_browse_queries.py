@@ -0,0 +1,108 @@
+import json
+import re
+import statistics
+import time
+from urllib.parse import parse_qsl
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+
+from api.views import PropertyListCreateView
+
+# Representative ?query strings for /api/properties-filter/; pass --file
+# with ones captured from real traffic to replay those instead
+BROWSE_QUERIES = [
+    '',
+    'page_size=20',
+    'location=Avondale',
+    'location=Avondale&page_size=20',
+    'type=Flat',
+    'price_min=100&price_max=500',
+    'price_min=100&price_max=500&ordering=price',
+    'bedrooms_min=3',
+    'bedrooms_min=2&price_max=800',
+    'location=Borrowdale&bedrooms_min=2&price_max=800',
+    'pool=true',
+    'garden=true&accepts_pets=true',
+    'has_solar_power=true&has_borehole=true&page_size=20',
+    'ordering=-price&page_size=20',
+    'search=garden',
+]
+
+EXECUTION_TIME = re.compile(r'Execution Time: ([\d.]+) ms')
+# Index names in PostgreSQL and SQLite plans
+INDEX_USED = re.compile(r'(?:USING (?:COVERING )?INDEX|Scan(?: Backward)? using|Index Scan on) (\w+)')
+
+
+class Command(BaseCommand):
+    help = ('Replay property browse filter combinations through PropertyListCreateView '
+            'and report their query plans and timings (EXPLAIN ANALYZE on PostgreSQL)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None,
+                            help='JSON list of query strings to replay instead of the built-in set')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per query; the median is reported')
+        parser.add_argument('--plans', action='store_true',
+                            help='Print the full plan of each query')
+
+    def handle(self, *args, **options):
+        queries = BROWSE_QUERIES
+        if options['file']:
+            try:
+                with open(options['file']) as f:
+                    queries = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['file']}: {e}")
+
+        analyze = connection.vendor == 'postgresql'
+        factory = RequestFactory()
+        total = 0
+        for query in queries:
+            queryset = self.browse_queryset(factory, query)
+            timings = []
+            for _ in range(options['repeat']):
+                if analyze:
+                    plan = queryset.all().explain(analyze=True)
+                    timings.append(float(EXECUTION_TIME.search(plan).group(1)))
+                else:
+                    # Just the SQL, like EXPLAIN ANALYZE; no model instances or prefetches
+                    sql, params = queryset.query.sql_with_params()
+                    with connection.cursor() as cursor:
+                        started = time.perf_counter()
+                        cursor.execute(sql, params)
+                        cursor.fetchall()
+                        timings.append((time.perf_counter() - started) * 1000)
+            if not analyze:
+                plan = queryset.explain()
+
+            median = statistics.median(timings)
+            total += median
+            indexes = sorted(set(INDEX_USED.findall(plan)))
+            self.stdout.write(
+                f"{median:8.2f}ms  {query or '(no filters)'}  "
+                f"[{', '.join(indexes) or 'no index'}]")
+            if options['plans']:
+                self.stdout.write(plan + '\n')
+
+        method = 'EXPLAIN ANALYZE execution time' if analyze else 'SQL wall time'
+        self.stdout.write(
+            f'{len(queries)} queries, {total:.2f}ms total ({method}, median of {options["repeat"]})')
+
+    def browse_queryset(self, factory, query):
+        """The queryset PropertyListCreateView.get() would run, limited to one page when paginated"""
+        view = PropertyListCreateView()
+        request = factory.get('/api/properties-filter/', dict(parse_qsl(query)))
+        view.request = view.initialize_request(request)
+        view.request.user = AnonymousUser()
+        view.format_kwarg = None
+
+        queryset = view.get_browse_queryset()
+        if view.paginate(view.request):
+            paginator = view.get_paginator(queryset)
+            page_size = paginator.get_page_size(view.request)
+            ordering = paginator.get_ordering(view.request, queryset, view)
+            queryset = queryset.order_by(*ordering)[:page_size + 1]
+        return queryset
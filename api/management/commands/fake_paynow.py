@@ -0,0 +1,144 @@
+import hashlib
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def paynow_hash(values, integration_key):
+    """Paynow's hash: SHA512 of the values in order plus the lowercased key"""
+    out = ''.join(str(value) for key, value in values.items()
+                  if key.lower() != 'hash')
+    out += integration_key.lower()
+    return hashlib.sha512(out.encode('utf-8')).hexdigest().upper()
+
+
+class Command(BaseCommand):
+    help = ('Run a local stand-in for the Paynow API, for offline development '
+            'and load tests. Set PAYNOW_API_URL=http://<addr>:<port>/interface')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--addr', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--settle', type=float, default=2,
+                            help='Seconds before a transaction stops being "Sent"')
+        parser.add_argument('--fail-rate', type=float, default=0,
+                            help='Fraction of transactions that end "Cancelled"')
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Milliseconds added to every response')
+        parser.add_argument('--callback', action='store_true',
+                            help='POST the final status to the transaction result URL')
+
+    def handle(self, *args, **options):
+        key = settings.PAYNOW_INTEGRATION_KEY or ''
+        transactions = {}
+        lock = threading.Lock()
+        base_url = f"http://{options['addr']}:{options['port']}/interface"
+        command = self
+
+        def final_status(transaction):
+            if time.time() - transaction['created'] < options['settle']:
+                return 'Sent'
+            return transaction['outcome']
+
+        def status_values(guid, transaction):
+            values = {
+                'reference': transaction['reference'],
+                'paynowreference': transaction['paynowreference'],
+                'amount': transaction['amount'],
+                'status': final_status(transaction),
+                'pollurl': f'{base_url}/poll/{guid}',
+            }
+            values['hash'] = paynow_hash(values, key)
+            return values
+
+        def send_callback(guid):
+            transaction = transactions[guid]
+            try:
+                requests.post(transaction['resulturl'],
+                              data=status_values(guid, transaction), timeout=10)
+            except requests.RequestException as e:
+                command.stderr.write(f'Callback for {guid} failed: {e}')
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = parse_qs(self.rfile.read(length).decode('utf-8'))
+                data = {name: values[0] for name, values in body.items()}
+                if options['latency']:
+                    time.sleep(options['latency'] / 1000)
+
+                if self.path.endswith(('/remotetransaction', '/initiatetransaction')):
+                    self.reply(self.initiate(data))
+                elif '/poll/' in self.path:
+                    guid = self.path.rsplit('/', 1)[-1]
+                    with lock:
+                        transaction = transactions.get(guid)
+                    if transaction is None:
+                        self.reply({'status': 'Error', 'error': 'Invalid poll url'})
+                    else:
+                        self.reply(status_values(guid, transaction))
+                else:
+                    self.send_error(404)
+
+            def initiate(self, data):
+                if data.get('hash') != paynow_hash(data, key):
+                    return {'status': 'Error', 'error': 'Invalid hash'}
+
+                guid = uuid.uuid4().hex
+                failed = random.random() < options['fail_rate']
+                transaction = {
+                    'reference': data.get('reference', ''),
+                    'paynowreference': str(random.randint(10 ** 7, 10 ** 8)),
+                    'amount': data.get('amount', '0'),
+                    'resulturl': data.get('resulturl'),
+                    'created': time.time(),
+                    'outcome': 'Cancelled' if failed else 'Paid',
+                }
+                with lock:
+                    transactions[guid] = transaction
+
+                if options['callback'] and transaction['resulturl']:
+                    threading.Timer(options['settle'], send_callback,
+                                    args=[guid]).start()
+
+                values = {
+                    'status': 'Ok',
+                    'instructions': 'Dial *151*2*4# and enter your EcoCash PIN',
+                    'paynowreference': transaction['paynowreference'],
+                    'pollurl': f'{base_url}/poll/{guid}',
+                }
+                if self.path.endswith('/initiatetransaction'):
+                    values['browserurl'] = f'{base_url}/pay/{guid}'
+                values['hash'] = paynow_hash(values, key)
+                return values
+
+            def reply(self, values):
+                body = urlencode(values).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-www-form-urlencoded')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                if options['verbosity'] > 1:
+                    super().log_message(format, *args)
+
+        server = ThreadingHTTPServer((options['addr'], options['port']), Handler)
+        server.daemon_threads = True
+        self.stdout.write(f'Fake Paynow listening on {base_url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
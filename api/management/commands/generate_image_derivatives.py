@@ -0,0 +1,36 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from api.images import backfill_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Generate thumb/card/full WebP derivatives for existing property images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate derivatives that already exist')
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+        last_id = 0
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            while last_id is not None:
+                done, failed, last_id = backfill_derivatives(
+                    last_id, options['batch_size'], executor, options['force'])
+                total_done += done
+                total_failed += failed
+                if done or failed:
+                    self.stdout.write(
+                        f'{total_done} images done, {total_failed} failed')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Generated derivatives for {total_done} images ({total_failed} failed)'
+            )
+        )
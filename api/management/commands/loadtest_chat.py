@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.chat_buffer import message_buffer
+from api.models import Message
+from api.utils import percentile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Drive many concurrent ChatConsumer sockets in process through '
+            'WebsocketCommunicator and report broadcast latency and throughput')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20,
+                            help='Active users to chat as, paired up into rooms')
+        parser.add_argument('--sockets', type=int, default=50)
+        parser.add_argument('--messages', type=int, default=20,
+                            help='Messages sent on each socket')
+        parser.add_argument('--flush-interval', type=int, default=None,
+                            help='Override CHAT_FLUSH_INTERVAL (milliseconds)')
+        parser.add_argument('--flush-size', type=int, default=None,
+                            help='Override CHAT_FLUSH_SIZE; 1 saves every message on its own')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='Seconds to wait for one broadcast')
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(is_active=True).order_by('id')[:options['users']])
+        if len(users) < 2:
+            raise CommandError('Need at least two active users')
+        if options['flush_interval'] is not None:
+            message_buffer.interval = options['flush_interval'] / 1000
+        if options['flush_size'] is not None:
+            message_buffer.size = options['flush_size']
+
+        # Import here so settings are loaded before the routing is built
+        from core.asgi import application
+
+        tokens = {user.id: str(AccessToken.for_user(user)) for user in users}
+        before = Message.objects.count()
+
+        async def run_socket(i):
+            sender = users[i % len(users)]
+            receiver = users[(i + 1) % len(users)]
+            room = f'{min(sender.id, receiver.id)}_{max(sender.id, receiver.id)}'
+            communicator = WebsocketCommunicator(
+                application, f'/ws/chat/{room}/',
+                headers=[(b'cookie', f'{settings.AUTH_COOKIE}={tokens[sender.id]}'.encode())])
+            connected, _ = await communicator.connect()
+            if not connected:
+                return []
+
+            latencies = []
+            for n in range(options['messages']):
+                text = f'loadtest {i} {n}'
+                started = time.perf_counter()
+                await communicator.send_to(text_data=json.dumps(
+                    {'message': text, 'receiver': receiver.id}))
+                # Other sockets in the same room broadcast too; wait for ours
+                while json.loads(await communicator.receive_from(
+                        options['timeout']))['message'] != text:
+                    pass
+                latencies.append(time.perf_counter() - started)
+            await communicator.disconnect()
+            return latencies
+
+        async def run():
+            results = await asyncio.gather(
+                *(run_socket(i) for i in range(options['sockets'])))
+            await message_buffer.flush()
+            return results
+
+        started = time.perf_counter()
+        results = asyncio.run(run())
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for result in results for latency in result)
+        connected = sum(1 for result in results if result)
+        saved = Message.objects.count() - before
+        expected = connected * options['messages']
+
+        self.stdout.write(
+            f"{connected}/{options['sockets']} sockets, {len(latencies)} messages in "
+            f"{elapsed:.2f}s ({len(latencies) / elapsed:.1f} messages/s)")
+        if latencies:
+            self.stdout.write(
+                f'Broadcast latency: p50 {percentile(latencies, 50) * 1000:.2f}ms, '
+                f'p95 {percentile(latencies, 95) * 1000:.2f}ms, '
+                f'p99 {percentile(latencies, 99) * 1000:.2f}ms')
+        self.stdout.write(f'Saved {saved}/{expected} messages')
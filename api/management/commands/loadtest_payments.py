@@ -0,0 +1,86 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from api.models import Property, LeaseDocumentPayment
+from api.payments import start_mobile_payment, poll_payment, PaymentError
+from api.paynow_gateway import get_gateway
+from api.utils import percentile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Push lease document payments through the full Paynow flow against '
+            'the fake gateway (see fake_paynow) and report throughput')
+
+    def add_arguments(self, parser):
+        parser.add_argument('landlord', help='Email of the landlord paying')
+        parser.add_argument('--count', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--poll-interval', type=float, default=0.5,
+                            help='Seconds between status polls of one payment')
+        parser.add_argument('--timeout', type=float, default=60,
+                            help='Give up on a payment after this many seconds')
+
+    def handle(self, *args, **options):
+        gateway = get_gateway()
+        host = urlparse(gateway.URL_INITIATE_MOBILE_TRANSACTION).hostname
+        if host not in ('localhost', '127.0.0.1'):
+            raise CommandError(
+                f'Refusing to load test {host}; point PAYNOW_API_URL at fake_paynow')
+
+        try:
+            landlord = User.objects.get(email=options['landlord'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with email {options['landlord']}")
+        property = Property.objects.filter(owner=landlord).first()
+        if property is None:
+            raise CommandError(f'{landlord.email} has no properties')
+
+        def run_payment(i):
+            started = time.perf_counter()
+            try:
+                lease_payment = LeaseDocumentPayment.objects.create(
+                    landlord=landlord, amount=0.02, status='PENDING', property=property)
+                payment = start_mobile_payment(
+                    'lease_document', f'loadtest_{lease_payment.id}_{uuid.uuid4()}',
+                    'Lease Document Payment', 0.02, landlord.email, '0771111111',
+                    object_id=lease_payment.id)
+
+                while not payment.is_final:
+                    if time.perf_counter() - started > options['timeout']:
+                        return 'timeout', time.perf_counter() - started
+                    time.sleep(options['poll_interval'])
+                    payment = poll_payment(payment)
+
+                return payment.status, time.perf_counter() - started
+            except PaymentError:
+                return 'error', time.perf_counter() - started
+            finally:
+                connection.close()
+
+        gateway.metrics.reset()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(run_payment, range(options['count'])))
+        elapsed = time.perf_counter() - started
+
+        outcomes = {}
+        for outcome, _ in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        durations = sorted(duration for _, duration in results)
+
+        self.stdout.write(
+            f"{len(results)} payments in {elapsed:.2f}s "
+            f"({len(results) / elapsed:.2f} payments/s), concurrency {options['concurrency']}")
+        self.stdout.write(f'Outcomes: {outcomes}')
+        self.stdout.write(
+            f'End to end: p50 {percentile(durations, 50):.2f}s, '
+            f'p95 {percentile(durations, 95):.2f}s')
+        for operation, stats in gateway.metrics.snapshot().items():
+            self.stdout.write(f'Paynow {operation}: {stats}')
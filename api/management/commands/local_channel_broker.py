@@ -0,0 +1,21 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from api.local_broker import LocalBroker
+
+
+class Command(BaseCommand):
+    help = ('Run a local Redis pub/sub stand-in for the channel layer. Set '
+            'CHANNEL_REDIS_URL=redis://<addr>:<port>/0 for Daphne processes to share it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--addr', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6390)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"Local channel broker listening on redis://{options['addr']}:{options['port']}/0")
+        try:
+            asyncio.run(LocalBroker().serve(options['addr'], options['port']))
+        except KeyboardInterrupt:
+            pass
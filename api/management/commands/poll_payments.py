@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from api.payments import due_payments, poll_payment, reschedule_payment
+
+
+class Command(BaseCommand):
+    help = 'Poll Paynow for pending payments and complete the ones that have settled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Poll the currently due payments once and exit')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Maximum number of payments polled per pass')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep between passes')
+
+    def handle(self, *args, **options):
+        while True:
+            self.poll_due_payments(options['batch_size'])
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+    def poll_due_payments(self, batch_size):
+        for payment in due_payments(batch_size):
+            try:
+                payment = poll_payment(payment)
+            except Exception as e:
+                self.stderr.write(
+                    f'Failed to poll payment {payment.reference}: {e}')
+
+            if payment.is_final:
+                self.stdout.write(f'{payment.reference}: {payment.status}')
+            else:
+                reschedule_payment(payment)
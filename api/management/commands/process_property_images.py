@@ -0,0 +1,34 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from api.images import process_pending_images
+
+
+class Command(BaseCommand):
+    help = 'Watermark newly uploaded property images in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process the pending images once and exit')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes')
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Maximum number of images claimed per batch')
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Seconds to sleep when nothing is pending')
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                done, failed = process_pending_images(
+                    options['batch_size'], executor)
+                if done or failed:
+                    self.stdout.write(
+                        f'Processed {done} images, {failed} failed')
+
+                if done + failed < options['batch_size']:
+                    if options['once']:
+                        return
+                    time.sleep(options['interval'])
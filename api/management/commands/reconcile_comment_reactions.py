@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from api.models import Comment, reaction_count
+from api.response_cache import bump_versions
+
+
+class Command(BaseCommand):
+    help = 'Rebuild comment like/dislike counters from the likes/dislikes tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many comments have drifted')
+
+    def handle(self, *args, **options):
+        drifted = Comment.objects.annotate(
+            actual_likes=reaction_count(Comment.likes.through),
+            actual_dislikes=reaction_count(Comment.dislikes.through),
+        ).filter(
+            ~Q(like_count=F('actual_likes')) | ~Q(
+                dislike_count=F('actual_dislikes'))
+        )
+        drifted_ids = list(drifted.values_list('id', flat=True))
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'{len(drifted_ids)} comments have out of date reaction counters')
+            return
+
+        updated = Comment.objects.filter(
+            id__in=drifted_ids).reconcile_reaction_counts()
+        bump_versions(Comment)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully reconciled reaction counters for {updated} comments'
+            )
+        )
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Comment
+from api.sentiment import get_model, score_comments
+
+
+class Command(BaseCommand):
+    help = ('Rate unrated comments with the sentiment model in concurrent, batched '
+            'requests. Safe to interrupt; rerunning carries on with what is left.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['openai', 'stub'], default=None,
+                            help='Defaults to SENTIMENT_MODEL')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Requests in flight; defaults to SENTIMENT_CONCURRENCY')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Comments per prompt; defaults to SENTIMENT_BATCH_SIZE')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Comments read and saved together')
+        parser.add_argument('--limit', type=int, default=None)
+        parser.add_argument('--after-id', type=int, default=0,
+                            help='Resume after this comment id, e.g. to skip ones that keep failing')
+        parser.add_argument('--stub-delay', type=float, default=0,
+                            help='Seconds the stub model takes per request')
+
+    def handle(self, *args, **options):
+        try:
+            model = get_model(options['model'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['stub_delay']:
+            model.delay = options['stub_delay']
+
+        self.stdout.write(
+            f"{Comment.objects.filter(is_rated=False).count()} unrated comments, model {model.name}")
+        started = time.perf_counter()
+        totals = {'rated': 0, 'failed': 0}
+
+        def on_chunk(rated, failed, last_id):
+            totals['rated'] += rated
+            totals['failed'] += failed
+            self.stdout.write(
+                f"Rated {totals['rated']}, failed {totals['failed']}, last id {last_id} "
+                f"({time.perf_counter() - started:.1f}s)")
+
+        score_comments(
+            model=model, limit=options['limit'], after_id=options['after_id'],
+            chunk_size=options['chunk_size'], batch_size=options['batch_size'],
+            concurrency=options['concurrency'], on_chunk=on_chunk)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Rated {totals['rated']} comments in {elapsed:.1f}s; {totals['failed']} failed "
+            f"and stay unrated for the next run"))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from api.mail import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails from the outbox over a reused SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the due emails once and exit')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Maximum number of emails sent per SMTP connection')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed, deferred = send_queued_emails(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent} emails, {failed} failed')
+            if deferred:
+                self.stdout.write(f'SMTP unreachable; {deferred} emails returned to the queue')
+
+            # Keep going while there is a backlog, otherwise wait
+            if deferred or sent + failed < options['batch_size']:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.ratings import update_landlord_ratings
+
+
+class Command(BaseCommand):
+    help = ('Recompute landlord ratings from property reviews and profile '
+            'completeness, by default only for landlords changed since the last run')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute every landlord, e.g. to pick up deleted reviews')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rows = update_landlord_ratings(
+            changed_only=not options['full'], batch_size=options['batch_size'])
+        self.stdout.write(
+            f'Updated {len(rows)} landlord ratings in {time.perf_counter() - started:.2f}s')
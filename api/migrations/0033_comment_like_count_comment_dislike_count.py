@@ -0,0 +1,41 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_reaction_counts(apps, schema_editor):
+    Comment = apps.get_model('api', 'Comment')
+
+    def reaction_count(through):
+        return Coalesce(Subquery(
+            through.objects.filter(comment=OuterRef('pk')).order_by().values(
+                'comment').annotate(total=Count('pk')).values('total')), 0)
+
+    Comment.objects.update(
+        like_count=reaction_count(Comment.likes.through),
+        dislike_count=reaction_count(Comment.dislikes.through),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_property_has_borehole_property_has_solar_power'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_reaction_counts,
+                             migrations.RunPython.noop),
+    ]
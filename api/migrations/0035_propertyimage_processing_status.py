@@ -0,0 +1,30 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+def mark_existing_images_done(apps, schema_editor):
+    # Images uploaded so far were watermarked during the upload request
+    PropertyImage = apps.get_model('api', 'PropertyImage')
+    PropertyImage.objects.update(processing_status='DONE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0034_outboundemail_outboundemailattachment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='propertyimage',
+            name='processing_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=10),
+        ),
+        migrations.RunPython(mark_existing_images_done,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='propertyimage',
+            index=models.Index(fields=['processing_status'], name='api_propert_process_ae1fa3_idx'),
+        ),
+    ]
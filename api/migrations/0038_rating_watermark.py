@@ -0,0 +1,21 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0037_message_conversation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:41
+
+from django.db import migrations, models
+from django.db.models import Count, FloatField, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+# LandlordProfile completeness weights as of this migration
+PROFILE_WEIGHTS = {
+    'is_phone_verified': 1.0, 'is_verified': 0.8, 'is_profile_complete': 0.8,
+    'id_number': 0.7, 'id_image': 0.7, 'proof_of_residence': 0.7,
+    'phone': 0.6, 'alternate_phone': 0.4, 'emergency_contact_name': 0.5,
+    'emergency_contact_phone': 0.5, 'profile_image': 0.5, 'date_of_birth': 0.4,
+    'marital_status': 0.3, 'additional_notes': 0.2,
+}
+
+
+def aggregate(queryset, group_by, function, output_field):
+    return Coalesce(Subquery(
+        queryset.order_by().values(group_by).annotate(value=function).values('value'),
+        output_field=output_field), 0, output_field=output_field)
+
+
+def backfill_rating_totals(apps, schema_editor):
+    Property = apps.get_model('api', 'Property')
+    Review = apps.get_model('api', 'Review')
+    Comment = apps.get_model('api', 'Comment')
+    LandlordProfile = apps.get_model('accounts', 'LandlordProfile')
+    TenantProfile = apps.get_model('accounts', 'TenantProfile')
+    TenantRating = apps.get_model('accounts', 'TenantRating')
+
+    reviews = Review.objects.filter(property=OuterRef('id'))
+    comments = Comment.objects.filter(
+        property=OuterRef('id'), is_rated=True, ai_rating__isnull=False)
+    Property.objects.update(
+        review_rating_sum=aggregate(reviews, 'property', Sum('rating'), IntegerField()),
+        review_rating_count=aggregate(reviews, 'property', Count('id'), IntegerField()),
+        comment_rating_sum=aggregate(comments, 'property', Sum('ai_rating'), FloatField()),
+        comment_rating_count=aggregate(comments, 'property', Count('id'), IntegerField()),
+    )
+
+    owner_reviews = Review.objects.filter(property__owner=OuterRef('user_id'))
+    LandlordProfile.objects.update(
+        review_rating_sum=aggregate(owner_reviews, 'property__owner', Sum('rating'), IntegerField()),
+        review_rating_count=aggregate(owner_reviews, 'property__owner', Count('id'), IntegerField()),
+    )
+    for profile in LandlordProfile.objects.all():
+        score = sum(weight for field, weight in PROFILE_WEIGHTS.items()
+                    if getattr(profile, field) not in [None, '', False])
+        LandlordProfile.objects.filter(id=profile.id).update(
+            profile_completeness=score / sum(PROFILE_WEIGHTS.values()) * 100)
+
+    ratings = TenantRating.objects.filter(tenant=OuterRef('id'), rating__isnull=False)
+    TenantProfile.objects.update(
+        rating_sum=aggregate(ratings, 'tenant', Sum('rating'), models.DecimalField(max_digits=12, decimal_places=2)),
+        rating_count=aggregate(ratings, 'tenant', Count('id'), IntegerField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_rating_watermark'),
+        ('accounts', '0026_rating_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='comment_rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='comment_rating_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='review_rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='review_rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_totals,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# PostgreSQL only; api.search falls back to an in-process index elsewhere.
+# search_vector is generated by the database, so every write keeps it current.
+FORWARD_SQL = [
+    """
+    ALTER TABLE api_property ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(address, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX api_property_search_vector_idx ON api_property USING gin (search_vector)",
+    "CREATE INDEX api_property_title_trgm_idx ON api_property USING gin (title gin_trgm_ops)",
+    "CREATE INDEX api_property_address_trgm_idx ON api_property USING gin (address gin_trgm_ops)",
+    "CREATE INDEX api_houselocation_name_trgm_idx ON api_houselocation USING gin (name gin_trgm_ops)",
+]
+
+REVERSE_SQL = [
+    "DROP INDEX IF EXISTS api_houselocation_name_trgm_idx",
+    "DROP INDEX IF EXISTS api_property_address_trgm_idx",
+    "DROP INDEX IF EXISTS api_property_title_trgm_idx",
+    "DROP INDEX IF EXISTS api_property_search_vector_idx",
+    "ALTER TABLE api_property DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run_on_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_property_rating_totals'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(run_on_postgres(FORWARD_SQL), run_on_postgres(REVERSE_SQL)),
+    ]
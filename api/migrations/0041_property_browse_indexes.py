@@ -0,0 +1,40 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:53
+
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_property_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('current_tenant__isnull', True), ('is_approved', True)), fields=['-overall_rating', '-id'], name='api_prop_browse_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(models.OrderBy(django.db.models.functions.comparison.Coalesce('overall_rating', models.Value(0.0)), descending=True), models.OrderBy(models.F('id'), descending=True), condition=models.Q(('current_tenant__isnull', True), ('is_approved', True)), name='api_prop_browse_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('current_tenant__isnull', True), ('is_approved', True)), fields=['location', '-overall_rating'], name='api_prop_browse_location_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('current_tenant__isnull', True), ('is_approved', True)), fields=['type', '-overall_rating'], name='api_prop_browse_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('current_tenant__isnull', True), ('is_approved', True)), fields=['price'], name='api_prop_browse_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('current_tenant__isnull', True), ('is_approved', True)), fields=['bedrooms', 'price'], name='api_prop_browse_bedrooms_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.8 on 2026-10-18 16:02
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    # Existing reviews count as unchanged since they were written, so the
+    # next changed_only rating run doesn't pick up all of them
+    Review = apps.get_model('api', 'Review')
+    Review.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_outboundemail_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
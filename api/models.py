@@ -1,8 +1,10 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, F, OuterRef, Q, Subquery, Value, When, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
-from accounts.models import TenantProfile
+from accounts.models import MaintainedFieldsMixin, TenantProfile
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
@@ -11,7 +13,11 @@ def upload_to(instance, filename):
     return filename.format(filename=filename)
 
 
-class Property(models.Model):
+# Properties the public browse listing shows
+BROWSABLE = Q(current_tenant__isnull=True, is_approved=True)
+
+
+class Property(MaintainedFieldsMixin, models.Model):
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='properties')
     title = models.CharField(max_length=200)
@@ -55,12 +61,39 @@ class Property(models.Model):
     affidavit = models.FileField(upload_to=upload_to, null=True, blank=True)
     is_approved = models.BooleanField(default=False)
     overall_rating = models.FloatField(default=0, null=True, blank=True)
+    # Running totals behind overall_rating, kept current by api.signals
+    review_rating_sum = models.PositiveIntegerField(default=0)
+    review_rating_count = models.PositiveIntegerField(default=0)
+    comment_rating_sum = models.FloatField(default=0)
+    comment_rating_count = models.PositiveIntegerField(default=0)
+    # Also set when the images, comments or tenants rendered with the
+    # property change (api.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    maintained_fields = ('overall_rating', 'review_rating_sum', 'review_rating_count',
+                         'comment_rating_sum', 'comment_rating_count')
 
     class Meta:
         indexes = [
             models.Index(fields=['owner']),
             models.Index(fields=['title']),
             models.Index(fields=['-overall_rating']),
+            # The public browse listing (PropertyListCreateView) only shows
+            # approved, untenanted properties; these cover its orderings and
+            # the PropertyFilter fields that narrow it most. Check changes
+            # with the explain_browse_queries command.
+            models.Index(fields=['-overall_rating', '-id'], condition=BROWSABLE,
+                         name='api_prop_browse_rating_idx'),
+            models.Index(Coalesce('overall_rating', Value(0.0)).desc(), F('id').desc(),
+                         condition=BROWSABLE, name='api_prop_browse_rank_idx'),
+            models.Index(fields=['location', '-overall_rating'], condition=BROWSABLE,
+                         name='api_prop_browse_location_idx'),
+            models.Index(fields=['type', '-overall_rating'], condition=BROWSABLE,
+                         name='api_prop_browse_type_idx'),
+            models.Index(fields=['price'], condition=BROWSABLE,
+                         name='api_prop_browse_price_idx'),
+            models.Index(fields=['bedrooms', 'price'], condition=BROWSABLE,
+                         name='api_prop_browse_bedrooms_idx'),
         ]
         ordering = ['-overall_rating', '-id']
 
@@ -73,14 +106,30 @@ class Property(models.Model):
 
 
 class PropertyImage(models.Model):
+    # Uploads are stored as-is and watermarked by process_property_images
+    PROCESSING_STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
     property = models.ForeignKey(
         Property, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to=upload_to)
     order = models.PositiveIntegerField(default=0)
+    processing_status = models.CharField(
+        max_length=10, choices=PROCESSING_STATUS_CHOICES, default='PENDING')
+    # When a worker claimed the image; PROCESSING claims older than
+    # api.images.CLAIM_LEASE are taken over by another worker
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # {"thumb": {"name": <storage name>, "width": 320, "height": 240}, ...}
+    derivatives = models.JSONField(default=dict, blank=True)
 
     class Meta:
         indexes = [
             models.Index(fields=['property']),
+            models.Index(fields=['processing_status']),
         ]
         ordering = ['order']
 
@@ -119,6 +168,47 @@ class Application(models.Model):
         return self.applicant.email
 
 
+class MessageQuerySet(models.QuerySet):
+    def involving(self, user):
+        return self.filter(Q(sender=user) | Q(receiver=user))
+
+    def between(self, user, other_user_id):
+        """Both directions of the conversation between user and other_user_id"""
+        return self.filter(
+            Q(sender=user, receiver_id=other_user_id) |
+            Q(sender_id=other_user_id, receiver=user)
+        )
+
+    def with_partner(self, user):
+        """Annotate partner_id, the other participant from user's point of view"""
+        return self.annotate(partner_id=Case(
+            When(sender=user, then=F('receiver_id')),
+            default=F('sender_id'),
+            output_field=models.IntegerField(),
+        ))
+
+    def latest_per_conversation(self, user, count=1):
+        """
+        The `count` most recent messages of each of user's conversations,
+        with sender and receiver joined, in a single query. Each row is
+        annotated with partner_id, position (1 = newest), and the
+        conversation's unread_count (unread by user) and total_messages.
+        """
+        partner = [F('partner_id')]
+        return self.involving(user).with_partner(user).annotate(
+            position=Window(RowNumber(), partition_by=partner,
+                            order_by=F('id').desc()),
+            unread_count=Window(
+                Count(Case(When(receiver=user, is_read=False, then=1))),
+                partition_by=partner),
+            total_messages=Window(Count('id'), partition_by=partner),
+        ).filter(position__lte=count).select_related('sender', 'receiver')
+
+    def conversations(self, user):
+        """One row per conversation: its latest message, newest conversation first"""
+        return self.latest_per_conversation(user).order_by('-id')
+
+
 class Message(models.Model):
     sender = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_messages')
@@ -128,8 +218,16 @@ class Message(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    objects = MessageQuerySet.as_manager()
+
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Chat history is read by (sender, receiver) in both directions
+            # and paged by id
+            models.Index(fields=['sender', 'receiver', 'id']),
+            models.Index(fields=['receiver', 'sender', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.sender.email} to {self.receiver.email}"
@@ -165,6 +263,8 @@ class Review(models.Model):
         validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Lets the changed_only rating runs (api.ratings) find edited reviews
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         indexes = [
@@ -177,6 +277,57 @@ class Review(models.Model):
         return f"{self.reviewer.email} - {self.reviewed.email}"
 
 
+def reaction_count(through):
+    """COUNT subquery over a comment likes/dislikes table, for the outer comment"""
+    return Coalesce(Subquery(
+        through.objects.filter(comment=OuterRef('pk')).order_by().values(
+            'comment').annotate(total=Count('pk')).values('total')), 0)
+
+
+class CommentQuerySet(models.QuerySet):
+    def with_reactions(self, user=None):
+        """Annotate whether a logged in user has liked/disliked each comment"""
+        if user is None or not user.is_authenticated:
+            return self
+        return self.annotate(
+            user_liked=Exists(self.model.likes.through.objects.filter(
+                comment=OuterRef('pk'), useraccount=user)),
+            user_disliked=Exists(self.model.dislikes.through.objects.filter(
+                comment=OuterRef('pk'), useraccount=user)),
+        )
+
+    def reconcile_reaction_counts(self):
+        """Rebuild like_count/dislike_count from the likes/dislikes tables"""
+        return self.update(
+            like_count=reaction_count(self.model.likes.through),
+            dislike_count=reaction_count(self.model.dislikes.through),
+        )
+
+    def for_display(self, user=None):
+        """Everything CommentSerializer needs, in one query"""
+        return self.select_related('commenter').with_reactions(user).order_by('created_at', 'id')
+
+    def as_tree(self):
+        """Evaluate the queryset and attach replies from the same result set"""
+        return attach_replies(list(self))
+
+
+def attach_replies(comments):
+    """
+    Group a list of comments by parent and store each comment's replies on
+    `loaded_replies`, so serializing the tree needs no further queries. The
+    list must contain every reply of the comments in it, e.g. all comments
+    of a set of properties.
+    """
+    replies = {}
+    for comment in comments:
+        if comment.parent_id is not None:
+            replies.setdefault(comment.parent_id, []).append(comment)
+    for comment in comments:
+        comment.loaded_replies = replies.get(comment.id, [])
+    return comments
+
+
 class Comment(models.Model):
     property = models.ForeignKey(
         Property, on_delete=models.CASCADE, related_name='comments')
@@ -196,15 +347,20 @@ class Comment(models.Model):
         settings.AUTH_USER_MODEL, related_name='comment_likes', blank=True)
     dislikes = models.ManyToManyField(
         settings.AUTH_USER_MODEL, related_name='comment_dislikes', blank=True)
+    # Denormalized from likes/dislikes, kept in step by toggle_like/toggle_dislike
+    like_count = models.PositiveIntegerField(default=0)
+    dislike_count = models.PositiveIntegerField(default=0)
+
+    objects = CommentQuerySet.as_manager()
 
     def __str__(self):
         return f"Comment by {self.commenter.email} on {self.property.title}"
 
     def get_like_count(self):
-        return self.likes.count()
+        return self.like_count
 
     def get_dislike_count(self):
-        return self.dislikes.count()
+        return self.dislike_count
 
     def has_user_liked(self, user):
         return self.likes.filter(id=user.id).exists()
@@ -214,25 +370,48 @@ class Comment(models.Model):
 
     def toggle_like(self, user):
         """Toggle like for a user on this comment"""
-        if self.has_user_liked(user):
-            self.likes.remove(user)
-            return False
-        else:
-            if self.has_user_disliked(user):
-                self.dislikes.remove(user)
-            self.likes.add(user)
-            return True
+        return self._toggle_reaction(user, like=True)
 
     def toggle_dislike(self, user):
         """Toggle dislike for a user on this comment"""
-        if self.has_user_disliked(user):
-            self.dislikes.remove(user)
-            return False
+        return self._toggle_reaction(user, like=False)
+
+    def _toggle_reaction(self, user, like):
+        """
+        Add or remove a like/dislike; adding one also clears the opposite
+        reaction. The comment row is locked and read with the user's current
+        reactions first, so concurrent toggles queue behind each other and
+        both counters are written in one UPDATE from the values just read.
+        Returns True if the reaction is now present.
+        """
+        if like:
+            through, opposite = self.likes.through, self.dislikes.through
+            field, opposite_field = 'like_count', 'dislike_count'
         else:
-            if self.has_user_liked(user):
-                self.likes.remove(user)
-            self.dislikes.add(user)
-            return True
+            through, opposite = self.dislikes.through, self.likes.through
+            field, opposite_field = 'dislike_count', 'like_count'
+        reaction = {'comment_id': self.pk, 'useraccount_id': user.pk}
+
+        with transaction.atomic():
+            current = Comment.objects.select_for_update().filter(pk=self.pk).values(
+                field, opposite_field,
+                reacted=Exists(through.objects.filter(**reaction)),
+                opposed=Exists(opposite.objects.filter(**reaction)),
+            ).get()
+            counts = {field: current[field], opposite_field: current[opposite_field]}
+            if current['reacted']:
+                through.objects.filter(**reaction).delete()
+                counts[field] -= 1
+            else:
+                if current['opposed']:
+                    opposite.objects.filter(**reaction).delete()
+                    counts[opposite_field] -= 1
+                through.objects.create(**reaction)
+                counts[field] += 1
+            Comment.objects.filter(pk=self.pk).update(**counts)
+        for name, value in counts.items():
+            setattr(self, name, value)
+        return not current['reacted']
 
 
 # class Comment(models.Model):
@@ -346,3 +525,60 @@ class LeaseDocumentPayment(models.Model):
 
     #     # Call the parent class's save method to actually save the object
     #     super().save(*args, **kwargs)
+
+
+class OutboundEmail(models.Model):
+    """An email queued by a view and delivered by the send_queued_emails command"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    content_subtype = models.CharField(max_length=20, default='plain')
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # When a worker marked it SENDING; see api.mail.CLAIM_LEASE
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - {', '.join(self.to)} - {self.status}"
+
+
+class OutboundEmailAttachment(models.Model):
+    email = models.ForeignKey(
+        OutboundEmail, on_delete=models.CASCADE, related_name='attachments')
+    filename = models.CharField(max_length=255)
+    content = models.BinaryField()
+    mimetype = models.CharField(max_length=100, null=True, blank=True)
+
+    def __str__(self):
+        return self.filename
+
+
+class RatingWatermark(models.Model):
+    """When a rating recompute last started, so the next run can skip unchanged inputs"""
+    name = models.CharField(max_length=50, unique=True)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} - {self.computed_at}"
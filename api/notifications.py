@@ -0,0 +1,116 @@
+"""
+Inbox push notifications.
+
+Each user has a notification group that NotificationConsumer
+(ws/notifications/) relays to every socket they have open, so clients can
+keep their unread badge and chat list current without polling
+UnreadMessageCountView and ChatListView. Two kinds of frame are pushed:
+
+    {"type": "unread_count", "delta": n, "chats": {chat_id: n, ...}}
+        when messages arrive (n > 0) or are read (n < 0)
+    {"type": "inbox_update", "chat": {"chat_id", "other_user", "last_message"}}
+        when a conversation gets a new last message, shaped like a
+        ChatListView entry without the counts
+"""
+import logging
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+
+from .serializers import MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+def notification_group(user_id):
+    return f'notifications_{user_id}'
+
+
+def chat_id(user_id, other_user_id):
+    return f"{min(user_id, other_user_id)}_{max(user_id, other_user_id)}"
+
+
+def unread_count_event(chats):
+    return {'type': 'unread.count', 'delta': sum(chats.values()), 'chats': dict(chats)}
+
+
+def new_message_events(messages):
+    """(group, event) pairs announcing saved messages to both participants"""
+    users = User.objects.in_bulk(
+        {message.sender_id for message in messages} |
+        {message.receiver_id for message in messages})
+
+    unread = defaultdict(lambda: defaultdict(int))  # receiver -> chat -> count
+    latest = {}  # (user, partner) -> newest message between them
+    for message in messages:
+        message.sender = users[message.sender_id]
+        message.receiver = users[message.receiver_id]
+        unread[message.receiver_id][chat_id(message.sender_id, message.receiver_id)] += 1
+        latest[message.sender_id, message.receiver_id] = message
+        latest[message.receiver_id, message.sender_id] = message
+
+    events = []
+    for (user_id, partner_id), message in latest.items():
+        partner = users[partner_id]
+        events.append((notification_group(user_id), {
+            'type': 'inbox.update',
+            'chat': {
+                'chat_id': chat_id(user_id, partner_id),
+                'other_user': {
+                    'id': partner.id,
+                    'email': partner.email,
+                    'first_name': partner.first_name,
+                    'last_name': partner.last_name
+                },
+                'last_message': MessageSerializer(message).data,
+            },
+        }))
+    for receiver_id, chats in unread.items():
+        events.append((notification_group(receiver_id), unread_count_event(chats)))
+    return events
+
+
+def read_events(user_id, read_counts):
+    """
+    The unread_count decrement for user_id having read messages;
+    read_counts is {sender id: messages newly marked read}
+    """
+    chats = {chat_id(user_id, sender_id): -count
+             for sender_id, count in read_counts.items() if count}
+    return [(notification_group(user_id), unread_count_event(chats))] if chats else []
+
+
+async def send_events(events):
+    channel_layer = get_channel_layer()
+    for group, event in events:
+        await channel_layer.group_send(group, event)
+
+
+# Notifications are best effort: a failure is logged and never fails the
+# request or the message write that triggered it
+
+def notify_new_messages(messages):
+    try:
+        async_to_sync(send_events)(new_message_events(messages))
+    except Exception as e:
+        logger.error(f"Failed to push new message notifications: {e}")
+
+
+def notify_messages_read(user_id, read_counts):
+    try:
+        async_to_sync(send_events)(read_events(user_id, read_counts))
+    except Exception as e:
+        logger.error(f"Failed to push read notifications: {e}")
+
+
+async def anotify_new_messages(messages):
+    """notify_new_messages for async callers such as the chat message buffer"""
+    try:
+        await send_events(await database_sync_to_async(new_message_events)(messages))
+    except Exception as e:
+        logger.error(f"Failed to push new message notifications: {e}")
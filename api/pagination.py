@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PropertyCursorPagination(CursorPagination):
+    """Cursor pagination for the public property browse listing"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # rating_rank is overall_rating with NULLs coalesced to 0, annotated by the view
+    ordering = ('-rating_rank', '-id')
+
+
+class PropertySearchCursorPagination(PropertyCursorPagination):
+    """Cursor pagination for ?search= results, by the search_rank api.search annotates"""
+    ordering = ('-search_rank', '-id')
@@ -0,0 +1,181 @@
+"""
+Paynow mobile payments without blocking the request.
+
+Views call start_mobile_payment(), which sends the EcoCash prompt and
+returns straight away with a pending accounts.Payment row. The payment is
+then finished by whichever arrives first: Paynow's result callback
+(PaymentResultView), a status check by the client (PaymentStatusView) or
+the `poll_payments` management command, which polls pending poll URLs with
+exponential backoff. finish_payment() locks the Payment row, so a payment
+is only ever fulfilled once.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Payment, PricingTier, TenantProfile
+from .models import RentPayment, LeaseDocumentPayment
+from .paynow_gateway import get_gateway
+
+# plan -> (amount, PricingTier name)
+SUBSCRIPTION_PLANS = {
+    'basic': (0.005, 'Basic'),
+    'standard': (0.015, 'Standard'),
+    'premium': (0.030, 'Premium'),
+    'luxury': (0.050, 'Luxury'),
+}
+
+# EcoCash prompts take a while to be confirmed, so the first poll waits a bit
+FIRST_POLL_DELAY = timedelta(seconds=15)
+MAX_POLL_DELAY = timedelta(minutes=5)
+# Pending payments older than this are marked expired
+PAYMENT_TIMEOUT = timedelta(hours=1)
+
+
+class PaymentError(Exception):
+    pass
+
+
+def start_mobile_payment(purpose, reference, description, amount, email, phone,
+                         tenant=None, object_id=None, plan=None):
+    """Send an EcoCash prompt and return the pending Payment; raises PaymentError"""
+    payment = Payment.objects.create(
+        purpose=purpose,
+        reference=reference,
+        amount=amount,
+        email=email,
+        phone=phone,
+        tenant=tenant,
+        object_id=object_id,
+        plan=plan,
+        status='created'
+    )
+
+    paynow = get_gateway()
+    paynow_payment = paynow.create_payment(reference, email)
+    paynow_payment.add(description, float(amount))
+
+    try:
+        response = paynow.send_mobile(paynow_payment, phone, 'ecocash')
+    except Exception as e:
+        Payment.objects.filter(id=payment.id).update(status='failed')
+        raise PaymentError(str(e))
+
+    if not response.success:
+        Payment.objects.filter(id=payment.id).update(status='failed')
+        raise PaymentError(response.data.get(
+            'error', 'Payment initialization failed'))
+
+    payment.poll_url = response.poll_url
+    payment.status = 'sent'
+    payment.next_poll_at = timezone.now() + FIRST_POLL_DELAY
+    payment.save(update_fields=['poll_url', 'status', 'next_poll_at'])
+    return payment
+
+
+def poll_payment(payment):
+    """Ask Paynow for the payment's status and finish it if it is final"""
+    status_response = get_gateway().check_transaction_status(payment.poll_url)
+    return finish_payment(payment.id, status_response.status)
+
+
+def finish_payment(payment_id, paynow_status):
+    """
+    Record a status reported by Paynow. Safe to call repeatedly and
+    concurrently: final payments are left alone, and fulfilment runs once,
+    in the same transaction that marks the payment final.
+    """
+    paynow_status = (paynow_status or '').lower()
+
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().get(id=payment_id)
+        if payment.is_final:
+            return payment
+
+        payment.status = paynow_status
+        if payment.is_paid:
+            FULFILMENT_HANDLERS[payment.purpose](payment)
+        if payment.is_final:
+            payment.completed_at = timezone.now()
+            payment.next_poll_at = None
+        payment.save()
+
+    return payment
+
+
+def reschedule_payment(payment):
+    """Back off exponentially before the next poll, or expire the payment"""
+    now = timezone.now()
+    if now - payment.created_at > PAYMENT_TIMEOUT:
+        return finish_payment(payment.id, 'expired')
+
+    payment.poll_attempts += 1
+    delay = min(FIRST_POLL_DELAY * (2 ** payment.poll_attempts), MAX_POLL_DELAY)
+    Payment.objects.filter(id=payment.id).update(
+        poll_attempts=payment.poll_attempts, next_poll_at=now + delay)
+    return payment
+
+
+def due_payments(limit):
+    """Pending payments whose next poll is due, oldest first"""
+    return Payment.objects.filter(
+        poll_url__isnull=False,
+        next_poll_at__lte=timezone.now()
+    ).exclude(status__in=Payment.FINAL_STATUSES).order_by('next_poll_at')[:limit]
+
+
+def fulfil_subscription(payment):
+    _, tier_name = SUBSCRIPTION_PLANS[payment.plan]
+    pricing_tier = PricingTier.objects.get(name=tier_name)
+    tenant_profile = TenantProfile.objects.select_for_update().get(
+        id=payment.tenant_id)
+
+    tenant_profile.subscription_plan = payment.plan
+    tenant_profile.subscription_status = 'active'
+    tenant_profile.pricing_tier = pricing_tier
+    tenant_profile.num_properties = pricing_tier.max_properties
+    tenant_profile.save()
+
+
+def fulfil_rent(payment):
+    rent_payment = RentPayment.objects.select_for_update().get(
+        id=payment.object_id)
+    if rent_payment.status == 'PAID':
+        return
+
+    rent_payment.status = 'PAID'
+    rent_payment.payment_date = timezone.now().date()
+    rent_payment.transaction_id = payment.reference
+    rent_payment.save()
+
+    # Update landlord balance
+    rent_payment.update_landlord_balance()
+
+    # Create next month's payment
+    RentPayment.objects.create(
+        property=rent_payment.property,
+        tenant=rent_payment.tenant,
+        amount=rent_payment.amount,
+        due_date=rent_payment.due_date + timezone.timedelta(days=30),
+        status='PENDING'
+    )
+
+
+def fulfil_lease_document(payment):
+    lease_payment = LeaseDocumentPayment.objects.select_for_update().get(
+        id=payment.object_id)
+    if lease_payment.status == 'PAID':
+        return
+
+    lease_payment.status = 'PAID'
+    lease_payment.payment_date = timezone.now().date()
+    lease_payment.transaction_id = payment.reference
+    lease_payment.save()
+
+
+FULFILMENT_HANDLERS = {
+    'subscription': fulfil_subscription,
+    'rent': fulfil_rent,
+    'lease_document': fulfil_lease_document,
+}
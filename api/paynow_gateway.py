@@ -0,0 +1,166 @@
+"""
+Process-wide Paynow client.
+
+The paynow package posts with module-level requests.post(), so every call
+opens a new TLS connection and waits forever if Paynow hangs. PaynowGateway
+keeps the package's request building and hash checks but sends through a
+pooled requests.Session with timeouts, and records how long each call took.
+Use get_gateway() rather than building Paynow objects in views.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+import requests
+from django.conf import settings
+from paynow.model import Paynow, InitResponse, StatusResponse, HashMismatchException
+from requests.adapters import HTTPAdapter
+
+from .utils import percentile
+
+logger = logging.getLogger(__name__)
+
+# Calls slower than this are logged as warnings
+SLOW_CALL_SECONDS = 5
+
+
+class LatencyMetrics:
+    """Call counts, errors and latency percentiles per Paynow operation"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+    def record(self, operation, seconds, ok):
+        with self.lock:
+            stats = self.operations.setdefault(operation, {
+                'count': 0,
+                'errors': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'recent': deque(maxlen=self.window),
+            })
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['recent'].append(seconds)
+            if not ok:
+                stats['errors'] += 1
+
+    def snapshot(self):
+        """Latencies in milliseconds; percentiles cover the last `window` calls"""
+        with self.lock:
+            result = {}
+            for operation, stats in self.operations.items():
+                recent = sorted(stats['recent'])
+                result[operation] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'avg_ms': round(stats['total'] / stats['count'] * 1000, 2),
+                    'p50_ms': round(percentile(recent, 50) * 1000, 2),
+                    'p95_ms': round(percentile(recent, 95) * 1000, 2),
+                    'max_ms': round(stats['max'] * 1000, 2),
+                }
+            return result
+
+
+class PaynowGateway(Paynow):
+    """Paynow client that reuses pooled HTTP connections"""
+
+    def __init__(self, integration_id, integration_key, return_url, result_url,
+                 api_url=None, timeout=15, pool_size=10):
+        super().__init__(integration_id, integration_key, return_url, result_url)
+        if api_url:
+            api_url = api_url.rstrip('/')
+            self.URL_INITIATE_TRANSACTION = f'{api_url}/initiatetransaction'
+            self.URL_INITIATE_MOBILE_TRANSACTION = f'{api_url}/remotetransaction'
+        self.timeout = timeout
+        self.metrics = LatencyMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def post(self, operation, url, data):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.post(url, data=data, timeout=self.timeout)
+            response.raise_for_status()
+            ok = True
+            return self._Paynow__rebuild_response(parse_qs(response.text))
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.record(operation, elapsed, ok)
+            if elapsed > SLOW_CALL_SECONDS:
+                logger.warning(f"Paynow {operation} took {elapsed:.2f}s")
+
+    # The methods below mirror Paynow's own, swapping requests.post for the
+    # pooled session. Request building and hashing are reused as they are.
+
+    def send(self, payment):
+        return self.initiate('initiate', self.URL_INITIATE_TRANSACTION,
+                             payment, self._Paynow__build(payment))
+
+    def send_mobile(self, payment, phone, method):
+        if not payment.auth_email:
+            raise ValueError('Auth email is required for mobile transactions')
+        return self.initiate('initiate_mobile', self.URL_INITIATE_MOBILE_TRANSACTION,
+                             payment, self._Paynow__build_mobile(payment, phone, method))
+
+    def initiate(self, operation, url, payment, data):
+        if payment.total() <= 0:
+            raise ValueError('Transaction total cannot be less than 1')
+
+        response_object = self.post(operation, url, data)
+
+        # Paynow does not hash error responses
+        if str(response_object['status']).lower() == 'error':
+            return InitResponse(response_object)
+
+        if not self._Paynow__verify_hash(response_object, self.integration_key):
+            raise HashMismatchException("Hashes do not match")
+
+        return InitResponse(response_object)
+
+    def check_transaction_status(self, poll_url):
+        response_object = self.post('poll', poll_url, {})
+        return StatusResponse(response_object, False)
+
+    def verify_status_update(self, data):
+        """Check the hash on a status update Paynow posted to the result URL"""
+        data = {key: data.get(key) for key in data}
+        if 'hash' not in data:
+            return False
+        return self._Paynow__verify_hash(data, self.integration_key)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """The shared PaynowGateway, created on first use"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = PaynowGateway(
+                    settings.PAYNOW_INTEGRATION_ID,
+                    settings.PAYNOW_INTEGRATION_KEY,
+                    return_url=settings.PAYNOW_RETURN_URL,
+                    result_url=settings.PAYNOW_RESULT_URL,
+                    api_url=settings.PAYNOW_API_URL,
+                    timeout=settings.PAYNOW_TIMEOUT,
+                    pool_size=settings.PAYNOW_POOL_SIZE
+                )
+    return _gateway
@@ -0,0 +1,475 @@
+"""
+Set-based rating recomputation.
+
+Landlord ratings are the average rating of the reviews on the landlord's
+properties plus a bonus of up to 1.0 for a complete profile, capped at 5.0.
+Property ratings are a weighted mix of the average review rating, the
+average AI comment rating and the landlord's rating, with the weights of
+missing components redistributed.
+
+Running sums and counts of each rating's inputs are stored next to it and
+kept current by the signal handlers in api.signals, which apply O(1) deltas
+as reviews, AI comment ratings and tenant ratings are created, changed or
+deleted, and then re-derive the affected ratings from the stored totals.
+
+update_landlord_ratings() and update_property_ratings() recompute ratings
+from the source rows instead, in a handful of set-based UPDATEs;
+verify_rating_totals() compares the stored totals against the source rows.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import LandlordProfile, TenantProfile, TenantRating
+from .models import Property, Review, Comment, RatingWatermark
+from .response_cache import bump_versions
+from .conditional import touch_rating
+
+# Weight of each filled-in LandlordProfile field in the completeness score
+LANDLORD_PROFILE_WEIGHTS = {
+    # Most important verifications (highest weights)
+    'is_phone_verified': 1.0,  # Phone verification is most important
+    'is_verified': 0.8,        # General verification
+    'is_profile_complete': 0.8,  # Profile completion status
+
+    # Identity verification (high weights)
+    'id_number': 0.7,
+    'id_image': 0.7,
+    'proof_of_residence': 0.7,
+
+    # Contact information (medium-high weights)
+    'phone': 0.6,
+    'alternate_phone': 0.4,
+    'emergency_contact_name': 0.5,
+    'emergency_contact_phone': 0.5,
+
+    # Personal information (medium weights)
+    'profile_image': 0.5,
+    'date_of_birth': 0.4,
+    'marital_status': 0.3,
+
+    # Additional information (lower weights)
+    'additional_notes': 0.2
+}
+
+# Extra rating points for a fully complete profile
+PROFILE_BONUS = 1.0
+
+LANDLORD_WATERMARK = 'landlord_ratings'
+PROPERTY_WATERMARK = 'property_ratings'
+
+# Share of a property's rating from each component, before redistributing
+# the weight of missing ones
+PROPERTY_WEIGHTS = {
+    'review': 0.5,    # 50% for reviews
+    'comment': 0.3,   # 30% for comments
+    'landlord': 0.2   # 20% for landlord rating
+}
+
+
+def is_filled(field_name):
+    """Q for a profile field that counts towards completeness: not None, '' or False"""
+    field = LandlordProfile._meta.get_field(field_name)
+    if isinstance(field, models.BooleanField):
+        return Q(**{field_name: True})
+    filled = Q(**{f'{field_name}__isnull': False})
+    if isinstance(field, (models.CharField, models.TextField, models.FileField)):
+        filled &= ~Q(**{field_name: ''})
+    return filled
+
+
+def completeness_of(profile):
+    """Python equivalent of profile_completeness() for one LandlordProfile"""
+    score = sum(weight for field, weight in LANDLORD_PROFILE_WEIGHTS.items()
+                if getattr(profile, field, None) not in [None, '', False])
+    return score / sum(LANDLORD_PROFILE_WEIGHTS.values()) * 100
+
+
+def profile_completeness():
+    """Expression for a LandlordProfile's completeness percentage"""
+    score = sum(
+        (Case(When(is_filled(field), then=Value(weight)), default=Value(0.0),
+              output_field=FloatField())
+         for field, weight in LANDLORD_PROFILE_WEIGHTS.items()),
+        Value(0.0, output_field=FloatField()))
+    return score * Value(100 / sum(LANDLORD_PROFILE_WEIGHTS.values()))
+
+
+LANDLORD_FIELDS = [
+    'id', 'user_id', 'user__email', 'user__first_name', 'user__last_name',
+    'current_rating', 'completeness', 'review_total', 'review_count', 'property_count',
+]
+
+
+def landlord_profiles():
+    """
+    Landlords' profile rows as dicts of LANDLORD_FIELDS. Review and property
+    counts are correlated subqueries so the two joins don't multiply each
+    other's rows, and rows are plain values because building 100k model
+    instances costs more than the query itself.
+    """
+    reviews = Review.objects.filter(property__owner=OuterRef('user_id')).order_by()
+    properties = Property.objects.filter(owner=OuterRef('user_id')).order_by()
+    return LandlordProfile.objects.filter(user__user_type='landlord').annotate(
+        completeness=profile_completeness(),
+        review_total=Coalesce(Subquery(
+            reviews.values('property__owner').annotate(total=Sum('rating')).values('total'),
+            output_field=IntegerField()), 0),
+        review_count=Coalesce(Subquery(
+            reviews.values('property__owner').annotate(count=Count('id')).values('count'),
+            output_field=IntegerField()), 0),
+        property_count=Coalesce(Subquery(
+            properties.values('owner').annotate(count=Count('id')).values('count'),
+            output_field=IntegerField()), 0),
+    ).values(*LANDLORD_FIELDS)
+
+
+def landlord_rating(row):
+    """(base rating, profile bonus, final rating) for a landlord_profiles() row"""
+    base_rating = row['review_total'] / row['review_count'] if row['review_count'] else 0
+    bonus = row['completeness'] / 100 * PROFILE_BONUS
+    return base_rating, bonus, min(5.0, round(base_rating + bonus, 1))
+
+
+def changed_landlords(since):
+    """Ids of landlords whose profile or property reviews changed after since"""
+    return set(
+        LandlordProfile.objects.filter(last_updated__gt=since).values_list('user_id', flat=True)
+    ) | set(
+        Review.objects.filter(updated_at__gt=since).values_list('property__owner', flat=True)
+    )
+
+
+def update_landlord_ratings(changed_only=False, batch_size=1000):
+    """
+    Recompute LandlordProfile.current_rating, for every landlord or, with
+    changed_only, for those changed since the last run. Deleted reviews leave
+    no timestamp behind, so they are only picked up by a full run. Returns
+    the landlord_profiles() rows, each with base_rating, profile_bonus and
+    final_rating added.
+    """
+    started = timezone.now()
+    watermark = RatingWatermark.objects.filter(name=LANDLORD_WATERMARK).first()
+
+    rows = landlord_profiles()
+    if changed_only and watermark is not None:
+        rows = rows.filter(user_id__in=changed_landlords(watermark.computed_at))
+    rows = list(rows.iterator(chunk_size=batch_size))
+
+    # Ratings are rounded to one decimal, so there are at most 51 distinct
+    # values: one UPDATE ... WHERE id IN per value (and batch) writes far
+    # fewer statements than a per-row bulk_update, and unchanged rows are
+    # skipped. The updates set rating_updated_at rather than last_updated
+    # (touch_rating()), so writing the ratings does not mark every profile
+    # as changed for the next run.
+    changed = defaultdict(list)
+    for row in rows:
+        row['base_rating'], row['profile_bonus'], row['final_rating'] = landlord_rating(row)
+        if row['current_rating'] is None or float(row['current_rating']) != row['final_rating']:
+            changed[Decimal(str(row['final_rating']))].append(row['id'])
+
+    with transaction.atomic():
+        update_grouped(LandlordProfile, 'current_rating', changed, batch_size)
+        RatingWatermark.objects.update_or_create(
+            name=LANDLORD_WATERMARK, defaults={'computed_at': started})
+    return rows
+
+
+def update_grouped(model, field, changed, batch_size):
+    """Set field to each value in changed ({value: [ids]}) for its ids"""
+    for value, ids in changed.items():
+        for i in range(0, len(ids), batch_size):
+            model.objects.filter(id__in=ids[i:i + batch_size]).update(**touch_rating(model, {field: value}))
+    if changed:
+        bump_versions(model)
+
+
+PROPERTY_FIELDS = [
+    'id', 'title', 'overall_rating', 'review_total', 'review_count',
+    'comment_total', 'comment_count', 'landlord_rating',
+]
+
+
+def property_inputs():
+    """Properties as dicts of PROPERTY_FIELDS, the inputs to property_rating()"""
+    reviews = Review.objects.filter(property=OuterRef('id')).order_by().values('property')
+    comments = Comment.objects.filter(
+        property=OuterRef('id'), is_rated=True, ai_rating__isnull=False
+    ).order_by().values('property')
+    return Property.objects.annotate(
+        review_total=Coalesce(Subquery(
+            reviews.annotate(total=Sum('rating')).values('total'),
+            output_field=IntegerField()), 0),
+        review_count=Coalesce(Subquery(
+            reviews.annotate(count=Count('id')).values('count'),
+            output_field=IntegerField()), 0),
+        comment_total=Coalesce(Subquery(
+            comments.annotate(total=Sum('ai_rating')).values('total'),
+            output_field=FloatField()), 0.0),
+        comment_count=Coalesce(Subquery(
+            comments.annotate(count=Count('id')).values('count'),
+            output_field=IntegerField()), 0),
+        landlord_rating=Subquery(
+            LandlordProfile.objects.filter(user=OuterRef('owner')).values('current_rating')[:1]),
+    ).values(*PROPERTY_FIELDS)
+
+
+def property_rating(row):
+    """Rating breakdown for a property_inputs() row"""
+    review_count = row['review_count']
+    comment_count = row['comment_count']
+    avg_review_rating = row['review_total'] / review_count if review_count else 0.0
+    avg_comment_rating = row['comment_total'] / comment_count if comment_count else 0.0
+    landlord_rating = float(row['landlord_rating'] or 0)
+
+    has_reviews = review_count > 0
+    has_comments = comment_count > 0
+    has_landlord_rating = landlord_rating > 0
+
+    # Calculate adjusted weights based on available components
+    adjusted_weights = {}
+    total_base = 0
+    if has_reviews:
+        adjusted_weights['review'] = PROPERTY_WEIGHTS['review']
+        total_base += PROPERTY_WEIGHTS['review']
+    if has_comments:
+        adjusted_weights['comment'] = PROPERTY_WEIGHTS['comment']
+        total_base += PROPERTY_WEIGHTS['comment']
+    if has_landlord_rating:
+        # Only count landlord rating if there's at least one other component
+        if has_reviews or has_comments:
+            adjusted_weights['landlord'] = PROPERTY_WEIGHTS['landlord']
+            total_base += PROPERTY_WEIGHTS['landlord']
+        else:
+            # If only landlord rating exists, cap its weight
+            adjusted_weights['landlord'] = 0.3
+            total_base = 0.3
+
+    # Normalize weights if necessary
+    if total_base > 0:
+        for key in adjusted_weights:
+            adjusted_weights[key] = adjusted_weights[key] / total_base
+
+    weighted_sum = 0.0
+    if has_reviews:
+        weighted_sum += avg_review_rating * adjusted_weights['review']
+    if has_comments:
+        weighted_sum += avg_comment_rating * adjusted_weights['comment']
+    if has_landlord_rating:
+        weighted_sum += landlord_rating * adjusted_weights['landlord']
+
+    return {
+        'overall_rating': round(weighted_sum if total_base > 0 else 0.0, 1),
+        'review_rating': round(avg_review_rating, 1),
+        'comment_rating': round(avg_comment_rating, 1),
+        'landlord_rating': round(landlord_rating, 1),
+        'review_count': review_count,
+        'comment_count': comment_count,
+        'weights_used': adjusted_weights,
+        'components_present': {
+            'has_reviews': has_reviews,
+            'has_comments': has_comments,
+            'has_landlord_rating': has_landlord_rating
+        }
+    }
+
+
+def changed_properties(since):
+    """
+    Ids of properties with reviews or comments changed after since, or whose
+    landlord's rating inputs changed
+    """
+    return set(
+        Review.objects.filter(updated_at__gt=since).values_list('property_id', flat=True)
+    ) | set(
+        Comment.objects.filter(updated_at__gt=since).values_list('property_id', flat=True)
+    ) | set(
+        Property.objects.filter(owner__in=changed_landlords(since)).values_list('id', flat=True)
+    )
+
+
+def update_property_ratings(changed_only=False, batch_size=1000):
+    """
+    Recompute Property.overall_rating for every property or, with
+    changed_only, for those changed since the last run (deleted reviews and
+    comments need a full run). Returns the property_inputs() rows, each
+    with its property_rating() breakdown under 'rating'.
+    """
+    started = timezone.now()
+    watermark = RatingWatermark.objects.filter(name=PROPERTY_WATERMARK).first()
+
+    rows = property_inputs()
+    if changed_only and watermark is not None:
+        rows = rows.filter(id__in=changed_properties(watermark.computed_at))
+    rows = list(rows.iterator(chunk_size=batch_size))
+
+    changed = defaultdict(list)
+    for row in rows:
+        row['rating'] = property_rating(row)
+        if row['overall_rating'] != row['rating']['overall_rating']:
+            changed[row['rating']['overall_rating']].append(row['id'])
+
+    with transaction.atomic():
+        update_grouped(Property, 'overall_rating', changed, batch_size)
+        RatingWatermark.objects.update_or_create(
+            name=PROPERTY_WATERMARK, defaults={'computed_at': started})
+    return rows
+
+
+# Event-driven maintenance from the stored totals
+
+def stored_property_inputs():
+    """Like property_inputs(), from the totals stored on each Property"""
+    return Property.objects.values(
+        'id', 'overall_rating',
+        review_total=F('review_rating_sum'),
+        review_count=F('review_rating_count'),
+        comment_total=F('comment_rating_sum'),
+        comment_count=F('comment_rating_count'),
+        landlord_rating=F('owner__landlord_profile__current_rating'),
+    )
+
+
+def refresh_property_ratings(property_ids):
+    """Re-derive overall_rating for property_ids from their stored totals"""
+    changed = defaultdict(list)
+    for row in stored_property_inputs().filter(id__in=property_ids):
+        rating = property_rating(row)['overall_rating']
+        if row['overall_rating'] != rating:
+            changed[rating].append(row['id'])
+    update_grouped(Property, 'overall_rating', changed, 1000)
+
+
+def refresh_landlord_rating(user_id):
+    """
+    Re-derive a landlord's current_rating from the stored totals. When it
+    changes, so does the landlord component of each of their properties.
+    """
+    row = LandlordProfile.objects.filter(user_id=user_id).values(
+        'id', 'current_rating',
+        review_total=F('review_rating_sum'),
+        review_count=F('review_rating_count'),
+        completeness=F('profile_completeness'),
+    ).first()
+    if row is None:
+        return
+    rating = landlord_rating(row)[2]
+    if row['current_rating'] is None or float(row['current_rating']) != rating:
+        LandlordProfile.objects.filter(id=row['id']).update(**touch_rating(
+            LandlordProfile, {'current_rating': Decimal(str(rating))}))
+        refresh_property_ratings(
+            Property.objects.filter(owner_id=user_id).values_list('id', flat=True))
+
+
+@transaction.atomic
+def apply_review_delta(property_id, rating, count):
+    """Add rating and count (negative to remove) for reviews on property_id"""
+    Property.objects.filter(id=property_id).update(
+        review_rating_sum=F('review_rating_sum') + rating,
+        review_rating_count=F('review_rating_count') + count)
+    owner_id = Property.objects.filter(id=property_id).values_list('owner_id', flat=True).first()
+    LandlordProfile.objects.filter(user_id=owner_id).update(**touch_rating(LandlordProfile, {
+        'review_rating_sum': F('review_rating_sum') + rating,
+        'review_rating_count': F('review_rating_count') + count}))
+    refresh_landlord_rating(owner_id)
+    refresh_property_ratings([property_id])
+
+
+@transaction.atomic
+def apply_comment_delta(property_id, rating, count):
+    """Add rating and count (negative to remove) for AI-rated comments on property_id"""
+    # Touched too: the comments are rendered with the property
+    Property.objects.filter(id=property_id).update(**touch_rating(Property, {
+        'comment_rating_sum': F('comment_rating_sum') + rating,
+        'comment_rating_count': F('comment_rating_count') + count}))
+    refresh_property_ratings([property_id])
+
+
+@transaction.atomic
+def apply_profile_change(profile):
+    """Store a saved LandlordProfile's completeness and re-derive its rating"""
+    completeness = completeness_of(profile)
+    if completeness != profile.profile_completeness:
+        LandlordProfile.objects.filter(id=profile.id).update(
+            **touch_rating(LandlordProfile, {'profile_completeness': completeness}))
+        profile.profile_completeness = completeness
+        refresh_landlord_rating(profile.user_id)
+
+
+def tenant_rating(rating_sum, rating_count):
+    return round(float(rating_sum) / rating_count, 2) if rating_count else 0.0
+
+
+@transaction.atomic
+def apply_tenant_rating_delta(tenant_id, rating, count):
+    """Add rating and count (negative to remove) to a TenantProfile's totals"""
+    TenantProfile.objects.filter(id=tenant_id).update(**touch_rating(TenantProfile, {
+        'rating_sum': F('rating_sum') + rating,
+        'rating_count': F('rating_count') + count}))
+    totals = TenantProfile.objects.filter(id=tenant_id).values('rating_sum', 'rating_count').first()
+    if totals is not None:
+        TenantProfile.objects.filter(id=tenant_id).update(**touch_rating(TenantProfile, {
+            'current_rating': Decimal(str(tenant_rating(totals['rating_sum'], totals['rating_count'])))}))
+
+
+def verify_rating_totals(fix=False):
+    """
+    Compare every stored total with a recount from the source rows. Returns
+    {model name: [ids that drifted]}; with fix, the drifted totals are
+    rewritten and their ratings re-derived.
+    """
+    drifted = {'Property': [], 'LandlordProfile': [], 'TenantProfile': []}
+
+    stored = {row['id']: row for row in stored_property_inputs().iterator(chunk_size=1000)}
+    for row in property_inputs().iterator(chunk_size=1000):
+        totals = stored[row['id']]
+        if (totals['review_total'], totals['review_count'], totals['comment_count']) != \
+                (row['review_total'], row['review_count'], row['comment_count']) or \
+                abs(totals['comment_total'] - row['comment_total']) > 1e-6:
+            drifted['Property'].append(row['id'])
+            if fix:
+                Property.objects.filter(id=row['id']).update(
+                    review_rating_sum=row['review_total'],
+                    review_rating_count=row['review_count'],
+                    comment_rating_sum=row['comment_total'],
+                    comment_rating_count=row['comment_count'])
+
+    stored = {row['id']: row for row in LandlordProfile.objects.values(
+        'id', 'review_rating_sum', 'review_rating_count', 'profile_completeness').iterator(chunk_size=1000)}
+    for row in landlord_profiles().iterator(chunk_size=1000):
+        totals = stored[row['id']]
+        if (totals['review_rating_sum'], totals['review_rating_count']) != \
+                (row['review_total'], row['review_count']) or \
+                abs(totals['profile_completeness'] - row['completeness']) > 1e-6:
+            drifted['LandlordProfile'].append(row['id'])
+            if fix:
+                LandlordProfile.objects.filter(id=row['id']).update(**touch_rating(LandlordProfile, {
+                    'review_rating_sum': row['review_total'],
+                    'review_rating_count': row['review_count'],
+                    'profile_completeness': row['completeness']}))
+
+    ratings = TenantRating.objects.filter(tenant=OuterRef('id'), rating__isnull=False).order_by().values('tenant')
+    tenants = TenantProfile.objects.annotate(
+        actual_sum=Coalesce(Subquery(ratings.annotate(total=Sum('rating')).values('total')), Decimal(0)),
+        actual_count=Coalesce(Subquery(ratings.annotate(count=Count('id')).values('count')), 0),
+    ).values('id', 'rating_sum', 'rating_count', 'actual_sum', 'actual_count')
+    for row in tenants.iterator(chunk_size=1000):
+        if (row['rating_sum'], row['rating_count']) != (row['actual_sum'], row['actual_count']):
+            drifted['TenantProfile'].append(row['id'])
+            if fix:
+                TenantProfile.objects.filter(id=row['id']).update(**touch_rating(TenantProfile, {
+                    'rating_sum': row['actual_sum'], 'rating_count': row['actual_count']}))
+                apply_tenant_rating_delta(row['id'], 0, 0)
+
+    if fix:
+        landlords = LandlordProfile.objects.filter(
+            id__in=drifted['LandlordProfile']).values_list('user_id', flat=True)
+        for user_id in landlords:
+            refresh_landlord_rating(user_id)
+        for i in range(0, len(drifted['Property']), 1000):
+            refresh_property_ratings(drifted['Property'][i:i + 1000])
+    return drifted
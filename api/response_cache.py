@@ -0,0 +1,102 @@
+"""
+Versioned response cache for the anonymous property browse endpoints.
+
+Each model a cached response is built from has a version counter in the
+cache. Saving or deleting one of its rows bumps the counter (api.signals;
+code that writes with QuerySet.update() calls bump_versions itself), which
+changes the key of every response built from that model, so stale entries
+are never served and simply expire. Counters are bumped once the writing
+transaction commits, so a response cached under the new version can't have
+been read before the change.
+
+Authenticated requests are never cached; comments render per-user flags.
+The ETag is a hash of the cached body, and If-None-Match is answered with
+304 from the cache alone.
+
+Local-memory caches are per process: with several worker processes use
+the file or Redis backend (CACHE_BACKEND in settings) so every worker sees
+the bumps.
+"""
+import hashlib
+import json
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def version_key(model):
+    return f'response_version:{model._meta.label_lower}'
+
+
+def model_versions(models):
+    """A string of the current version of each model, for building cache keys"""
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start from the clock rather than 1 so a counter lost to eviction
+            # or a restart can't come back to a value used before
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return ':'.join(str(versions[key]) for key in keys)
+
+
+def bump_versions(*models):
+    def bump():
+        for model in models:
+            try:
+                cache.incr(version_key(model))
+            except ValueError:
+                cache.set(version_key(model), time.time_ns(), None)
+    transaction.on_commit(bump)
+
+
+def response_cache_key(request, models):
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    # Absolute, since responses hold links (pagination, images) to this host
+    url = request.build_absolute_uri(request.path)
+    digest = hashlib.sha256(f'{url}?{query}'.encode()).hexdigest()
+    return f'response:{digest}:{model_versions(models)}'
+
+
+class CachedResponseMixin:
+    """
+    Cache anonymous GET responses of a DRF view, keyed by path, normalised
+    query string and the versions of cache_models. Views defining their own
+    get() call cached_get() from it.
+    """
+    cache_models = ()
+
+    def get(self, request, *args, **kwargs):
+        return self.cached_get(request, super().get, *args, **kwargs)
+
+    def cached_get(self, request, get, *args, **kwargs):
+        """The response of get(request, ...), from the cache when possible"""
+        if request.user.is_authenticated:
+            return get(request, *args, **kwargs)
+
+        key = response_cache_key(request, self.cache_models)
+        cached = cache.get(key)
+        if cached is None:
+            response = get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            body = json.dumps(response.data, sort_keys=True, default=str)
+            cached = (response.data, '"%s"' % hashlib.sha256(body.encode()).hexdigest()[:32])
+            cache.set(key, cached, settings.RESPONSE_CACHE_TIMEOUT)
+
+        data, etag = cached
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        # Clients must revalidate, which is cheap, rather than reuse blindly
+        patch_cache_control(response, no_cache=True)
+        return response
@@ -0,0 +1,200 @@
+"""
+Property search.
+
+On PostgreSQL, api_property has a generated, weighted tsvector column
+(search_vector: title A, address B, description C) with a GIN index, and
+pg_trgm GIN indexes on property addresses and titles and on location names
+(migration 0040). Matches are full-text (websearch syntax) or, for
+misspelt titles, addresses and locations, trigram-similar; results are
+ranked by ts_rank plus similarity. Every condition is an index lookup, so
+latency does not grow with the catalogue.
+
+Other databases, i.e. SQLite in tests and local development, use
+PropertyIndex: an inverted index over the same fields held in process
+memory, built on first use and kept current by the Property signals in
+api.signals. Bulk writes bypass those; call property_index.reset().
+"""
+import difflib
+import heapq
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Property, HouseLocation
+
+SEARCH_CONFIG = 'english'
+
+# Field weights, matching ts_rank's defaults for the A, B and C labels
+FIELD_WEIGHTS = {
+    'title': 1.0,
+    'address': 0.4,
+    'location__name': 0.4,
+    'description': 0.2,
+}
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Results ranked by the in-process index; the rest are dropped
+MAX_RESULTS = 1000
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def postgres_search(queryset, terms):
+    vector = RawSQL(f'"{Property._meta.db_table}"."search_vector"', [],
+                    output_field=SearchVectorField())
+    query = SearchQuery(terms, config=SEARCH_CONFIG, search_type='websearch')
+    # Locations are matched in their own (small, trigram indexed) table so
+    # each branch of the OR stays an index scan on api_property
+    locations = HouseLocation.objects.filter(name__trigram_similar=terms).values('id')
+    return queryset.alias(search_vector=vector).filter(
+        Q(search_vector=query) |
+        # Misspelt titles and addresses, through their trigram indexes
+        Q(title__trigram_similar=terms) |
+        Q(address__trigram_similar=terms) |
+        Q(location_id__in=locations)
+    ).annotate(search_rank=SearchRank(vector, query) + Greatest(
+        Coalesce(TrigramSimilarity('title', terms), Value(0.0)),
+        Coalesce(TrigramSimilarity('address', terms), Value(0.0)),
+        Coalesce(TrigramSimilarity('location__name', terms), Value(0.0)),
+    ))
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PropertyIndex:
+    def __init__(self):
+        self.postings = defaultdict(dict)  # token -> {property id: weight}
+        self.documents = {}  # property id -> tokens
+        self.vocabulary = defaultdict(set)  # trigram -> tokens, for fuzzy lookups
+        self.built = False
+        self.lock = threading.RLock()
+
+    def reset(self):
+        with self.lock:
+            self.postings.clear()
+            self.documents.clear()
+            self.vocabulary.clear()
+            self.built = False
+
+    def build(self):
+        with self.lock:
+            if self.built:
+                return
+            for row in Property.objects.values('id', *FIELD_WEIGHTS).iterator(chunk_size=2000):
+                self.add(row)
+            self.built = True
+
+    def add(self, row):
+        weights = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(row[field]):
+                weights[token] = max(weights[token], weight)
+        self.documents[row['id']] = set(weights)
+        for token, weight in weights.items():
+            if token not in self.postings:
+                for trigram in trigrams(token):
+                    self.vocabulary[trigram].add(token)
+            self.postings[token][row['id']] = weight
+
+    def remove(self, property_id):
+        with self.lock:
+            for token in self.documents.pop(property_id, ()):
+                postings = self.postings[token]
+                postings.pop(property_id, None)
+                if not postings:
+                    del self.postings[token]
+                    for trigram in trigrams(token):
+                        self.vocabulary[trigram].discard(token)
+
+    def refresh(self, property_id):
+        """Re-read one property after it changed; a no-op until the index is built"""
+        with self.lock:
+            if not self.built:
+                return
+            self.remove(property_id)
+            row = Property.objects.filter(id=property_id).values('id', *FIELD_WEIGHTS).first()
+            if row is not None:
+                self.add(row)
+
+    def variants(self, token):
+        """The token, or failing that the indexed tokens closest to it"""
+        if token in self.postings:
+            return [token]
+        shared = defaultdict(int)
+        for trigram in trigrams(token):
+            for candidate in self.vocabulary.get(trigram, ()):
+                shared[candidate] += 1
+        # Only tokens sharing a few trigrams can be close, which keeps this
+        # off the bulk of the vocabulary
+        candidates = [candidate for candidate, count in shared.items() if count >= 2]
+        return difflib.get_close_matches(token, candidates, n=3, cutoff=0.8)
+
+    def search(self, terms):
+        """[(property id, score)] for properties matching every term, best first"""
+        self.build()
+        with self.lock:
+            total = max(len(self.documents), 1)
+            matches = []
+            for token in set(tokenize(terms)):
+                postings = [self.postings[variant] for variant in self.variants(token)]
+                if not postings:
+                    return []
+                matches.append(postings)
+            if not matches:
+                return []
+
+            # Rarest term first, so only its postings are walked in full
+            matches.sort(key=lambda postings: sum(len(p) for p in postings))
+            scores = None
+            for postings in matches:
+                idf = math.log(1 + total / sum(len(p) for p in postings))
+                if scores is None:
+                    scores = defaultdict(float)
+                    for variant in postings:
+                        for property_id, weight in variant.items():
+                            scores[property_id] = max(scores[property_id], weight * idf)
+                    continue
+                narrowed = {}
+                for property_id, score in scores.items():
+                    weight = max(variant.get(property_id, 0) for variant in postings)
+                    if weight:
+                        narrowed[property_id] = score + weight * idf
+                scores = narrowed
+        return heapq.nlargest(MAX_RESULTS, scores.items(), key=lambda item: item[1])
+
+    def filter(self, queryset, terms):
+        results = self.search(terms)
+        if not results:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        # One WHEN per distinct score rather than per property
+        ranks = defaultdict(list)
+        for property_id, score in results:
+            ranks[round(score, 6)].append(property_id)
+        return queryset.filter(id__in=[property_id for property_id, _ in results]).annotate(
+            search_rank=Case(
+                *(When(id__in=ids, then=Value(score)) for score, ids in ranks.items()),
+                default=Value(0.0), output_field=FloatField()))
+
+
+property_index = PropertyIndex()
+
+
+def search_properties(queryset, terms):
+    """queryset narrowed to properties matching terms, annotated with search_rank"""
+    if connections[queryset.db].vendor == 'postgresql':
+        return postgres_search(queryset, terms)
+    return property_index.filter(queryset, terms)
@@ -0,0 +1,248 @@
+"""
+Comment sentiment scoring.
+
+score_comments() rates unrated comments in chunks. Identical comments are
+rated once and ratings are cached by content hash; the rest are packed
+several to a prompt (SENTIMENT_BATCH_SIZE) and sent SENTIMENT_CONCURRENCY
+at a time. Each chunk is written with one bulk_update, so an interrupted run
+keeps what it finished and the next run carries on with what is still
+unrated.
+
+The model is chosen by SENTIMENT_MODEL: OpenAISentimentModel, or
+StubSentimentModel, a keyword scorer for tests and local development.
+"""
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Comment
+from .ratings import apply_comment_delta
+from .response_cache import bump_versions
+
+logger = logging.getLogger(__name__)
+
+CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+SINGLE_PROMPT = ("You are a sentiment analysis expert. Rate the following property comment on a "
+                 "scale of 1 to 5, where 1 is very negative and 5 is very positive. Only respond "
+                 "with a single number.")
+BATCH_PROMPT = ("You are a sentiment analysis expert. You are given a JSON array of property "
+                "comments. Rate each comment on a scale of 1 to 5, where 1 is very negative and 5 "
+                "is very positive. Only respond with a JSON array of numbers, one per comment, in "
+                "the same order.")
+
+
+def clamp(rating):
+    return min(max(float(rating), 1), 5)  # Ensure rating is between 1 and 5
+
+
+class OpenAISentimentModel:
+    name = 'openai'
+
+    def __init__(self, max_attempts=6, base_delay=1.0):
+        # One client for the whole run; it pools connections and is thread safe.
+        # Retries are ours so rate limits pause every worker, not just one.
+        self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.lock = threading.Lock()
+        self.resume_at = 0
+
+    def wait_turn(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def back_off(self, attempt, error):
+        delay = self.base_delay * 2 ** attempt
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get('retry-after', 0)))
+            except ValueError:
+                pass
+        delay += random.uniform(0, self.base_delay)
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+        logger.warning(f"OpenAI {error.__class__.__name__}, retrying in {delay:.1f}s")
+
+    def complete(self, system, content, max_tokens):
+        for attempt in range(self.max_attempts):
+            self.wait_turn()
+            try:
+                response = self.client.chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "system", "content": system},
+                        {"role": "user", "content": content}
+                    ],
+                    temperature=0.3,
+                    max_tokens=max_tokens,
+                    top_p=1.0,
+                    frequency_penalty=0.0,
+                    presence_penalty=0.0
+                )
+                return response.choices[0].message.content.strip()
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                self.back_off(attempt, e)
+
+    def rate_one(self, text):
+        try:
+            return clamp(self.complete(SINGLE_PROMPT, text, 10))
+        except Exception as e:
+            logger.error(f"Error analyzing sentiment: {e}")
+            return None
+
+    def rate(self, texts):
+        """Ratings for texts, None where a comment could not be rated"""
+        if len(texts) == 1:
+            return [self.rate_one(texts[0])]
+        try:
+            ratings = json.loads(self.complete(
+                BATCH_PROMPT, json.dumps(texts), 8 * len(texts) + 10))
+            if isinstance(ratings, list) and len(ratings) == len(texts):
+                return [clamp(rating) for rating in ratings]
+        except (ValueError, TypeError):
+            pass
+        except Exception as e:
+            logger.error(f"Error analyzing sentiment: {e}")
+            return [None] * len(texts)
+        # The reply didn't line up with the comments; rate them one at a time
+        return [self.rate_one(text) for text in texts]
+
+
+class StubSentimentModel:
+    """Deterministic keyword scorer standing in for the API in tests"""
+    name = 'stub'
+
+    POSITIVE = {'good', 'great', 'excellent', 'nice', 'clean', 'quiet', 'safe',
+                'spacious', 'love', 'lovely', 'friendly', 'recommend', 'beautiful'}
+    NEGATIVE = {'bad', 'poor', 'dirty', 'noisy', 'unsafe', 'broken', 'small',
+                'rude', 'leak', 'leaking', 'expensive', 'terrible', 'avoid'}
+
+    def __init__(self, delay=0):
+        self.delay = delay  # seconds per request, to mimic API latency
+
+    def rate(self, texts):
+        if self.delay:
+            time.sleep(self.delay)
+        ratings = []
+        for text in texts:
+            words = re.findall(r"[a-z']+", text.lower())
+            score = sum(word in self.POSITIVE for word in words) - \
+                sum(word in self.NEGATIVE for word in words)
+            ratings.append(clamp(3 + score))
+        return ratings
+
+
+def get_model(name=None):
+    name = name or settings.SENTIMENT_MODEL
+    if name == 'stub':
+        return StubSentimentModel()
+    if name == 'openai':
+        return OpenAISentimentModel()
+    raise ValueError(f"Unknown sentiment model {name!r}")
+
+
+def cache_key(model, text):
+    digest = hashlib.sha256(text.strip().encode()).hexdigest()
+    return f"sentiment:{model.name}:{digest}"
+
+
+def rate_texts(model, texts, executor, batch_size):
+    """{text: rating} for the distinct texts, from the cache where possible"""
+    keys = {text: cache_key(model, text) for text in texts}
+    cached = cache.get_many(keys.values())
+    ratings = {text: cached[key] for text, key in keys.items() if key in cached}
+
+    missing = [text for text in texts if text not in ratings]
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    for batch, batch_ratings in zip(batches, executor.map(model.rate, batches)):
+        for text, rating in zip(batch, batch_ratings):
+            ratings[text] = rating
+
+    cache.set_many({keys[text]: ratings[text] for text in missing
+                    if ratings[text] is not None}, CACHE_TIMEOUT)
+    return ratings
+
+
+def score_comments(model=None, limit=None, after_id=0, chunk_size=200,
+                   batch_size=None, concurrency=None, on_chunk=None):
+    """
+    Rate unrated comments with ids above after_id, up to limit of them.
+    Returns the rated comments, with property and commenter loaded.
+    on_chunk(rated, failed, last_id) is called after each chunk is saved.
+    """
+    model = model or get_model()
+    batch_size = batch_size or settings.SENTIMENT_BATCH_SIZE
+    concurrency = concurrency or settings.SENTIMENT_CONCURRENCY
+    scored = []
+    seen = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while limit is None or seen < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - seen)
+            comments = list(
+                Comment.objects.filter(is_rated=False, id__gt=after_id)
+                .select_related('property', 'commenter').order_by('id')[:size])
+            if not comments:
+                break
+            seen += len(comments)
+            after_id = comments[-1].id
+
+            ratings = rate_texts(
+                model, list(dict.fromkeys(comment.content for comment in comments)),
+                executor, batch_size)
+
+            rated = []
+            now = timezone.now()
+            for comment in comments:
+                rating = ratings[comment.content]
+                if rating:
+                    comment.ai_rating = rating
+                    comment.is_rated = True
+                    # bulk_update skips auto_now, which update_property_ratings
+                    # uses to find changed comments
+                    comment.updated_at = now
+                    rated.append(comment)
+            failed = len(comments) - len(rated)
+
+            with transaction.atomic():
+                # Another worker may have rated some of the chunk meanwhile,
+                # or be saving them now; only write and count the rest
+                claimed = set(
+                    Comment.objects.select_for_update(skip_locked=True)
+                    .filter(id__in=[comment.id for comment in rated], is_rated=False)
+                    .values_list('id', flat=True))
+                rated = [comment for comment in rated if comment.id in claimed]
+                Comment.objects.bulk_update(rated, ['ai_rating', 'is_rated', 'updated_at'])
+                if rated:
+                    bump_versions(Comment)
+
+                # bulk_update skips the signals that keep property rating totals
+                totals = defaultdict(lambda: [0, 0])
+                for comment in rated:
+                    totals[comment.property_id][0] += comment.ai_rating
+                    totals[comment.property_id][1] += 1
+                for property_id, (rating, count) in totals.items():
+                    apply_comment_delta(property_id, rating, count)
+
+            scored.extend(rated)
+            if on_chunk is not None:
+                on_chunk(len(rated), failed, after_id)
+
+    return scored
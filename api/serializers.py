@@ -1,17 +1,33 @@
 from rest_framework import serializers
 from rest_framework import serializers
-from .models import Property, PropertyImage, Application, Message, LeaseAgreement, Review, HouseType, HouseLocation, Comment, RentPayment, LeaseDocumentPayment
+from .models import Property, PropertyImage, Application, Message, LeaseAgreement, Review, HouseType, HouseLocation, Comment, RentPayment, LeaseDocumentPayment, attach_replies
 from accounts.serializers import CustomUserSerializer, TenantProfileSerializer
 from django.contrib.auth import get_user_model
-from django.db.models import Max
+from django.db.models import Max, Prefetch
 
 User = get_user_model()
 
 
 class PropertyImageSerializer(serializers.ModelSerializer):
+    # {"thumb": {"url": ..., "width": 320, "height": 240}, "card": ..., "full": ...}
+    # Empty until process_property_images has run for the image
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = PropertyImage
-        fields = ['id', 'image', 'order']
+        fields = ['id', 'image', 'order', 'srcset']
+
+    def get_srcset(self, obj):
+        request = self.context.get('request')
+        storage = obj.image.storage
+        srcset = {}
+        for derivative, info in obj.derivatives.items():
+            url = storage.url(info['name'])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            srcset[derivative] = {
+                'url': url, 'width': info['width'], 'height': info['height']}
+        return srcset
 
 # class PropertySerializer(serializers.ModelSerializer):
 #     # owner = CustomUserSerializer(read_only=True)
@@ -39,10 +55,17 @@ class CommentSerializer(serializers.ModelSerializer):
                   'is_reply', 'replies']
         read_only_fields = ['commenter', 'created_at', 'updated_at']
 
+    # Comments loaded through Comment.objects.for_display() carry the user's
+    # reaction as annotations, and trees built by as_tree() or attach_replies()
+    # carry their replies; anything else falls back to queries.
+
     def get_replies(self, obj):
         if obj.is_reply:
             return []
-        replies = Comment.objects.filter(parent=obj).order_by('created_at')
+        replies = getattr(obj, 'loaded_replies', None)
+        if replies is None:
+            replies = Comment.objects.filter(parent=obj).for_display(
+                self.context['request'].user)
         return CommentSerializer(replies, many=True, context=self.context).data
 
     def get_commenter_name(self, obj):
@@ -56,11 +79,19 @@ class CommentSerializer(serializers.ModelSerializer):
 
     def get_has_liked(self, obj):
         user = self.context['request'].user
-        return obj.has_user_liked(user) if user.is_authenticated else False
+        if not user.is_authenticated:
+            return False
+        if hasattr(obj, 'user_liked'):
+            return obj.user_liked
+        return obj.has_user_liked(user)
 
     def get_has_disliked(self, obj):
         user = self.context['request'].user
-        return obj.has_user_disliked(user) if user.is_authenticated else False
+        if not user.is_authenticated:
+            return False
+        if hasattr(obj, 'user_disliked'):
+            return obj.user_disliked
+        return obj.has_user_disliked(user)
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -89,7 +120,7 @@ class PropertySerializer(serializers.ModelSerializer):
         write_only=True,
         required=False
     )
-    comments = CommentSerializer(many=True, read_only=True)
+    comments = serializers.SerializerMethodField()
     type = serializers.PrimaryKeyRelatedField(
         queryset=HouseType.objects.all(), required=False, write_only=True)
     location = serializers.PrimaryKeyRelatedField(
@@ -109,6 +140,86 @@ class PropertySerializer(serializers.ModelSerializer):
                   'accepts_cash_payment', 'proof_of_residence', 'affidavit', 'overall_rating']
         depth = 1
 
+    # Compact representation used by the browse grid
+    CARD_FIELDS = ['id', 'title', 'address', 'price', 'bedrooms', 'bathrooms',
+                   'main_image', 'overall_rating']
+    # Nested relations left out of a sparse fieldset unless asked for via expand
+    EXPANDABLE_FIELDS = ['owner', 'current_tenant', 'tenants_with_access', 'type_detail',
+                         'location_detail', 'main_image', 'images', 'comments']
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.select_fields(fields, expand)
+        if selected is not None:
+            for field_name in set(self.fields) - set(selected):
+                self.fields.pop(field_name)
+
+    @classmethod
+    def select_fields(cls, fields=None, expand=None):
+        """Resolve requested fields/expansions into the fields to render (None means all)"""
+        if not fields and not expand:
+            return None
+
+        if fields:
+            selected = [name for name in fields if name in cls.Meta.fields]
+        else:
+            selected = [name for name in cls.Meta.fields
+                        if name not in cls.EXPANDABLE_FIELDS]
+        selected += [name for name in expand or []
+                     if name in cls.Meta.fields and name not in selected]
+
+        if 'id' not in selected:
+            selected.insert(0, 'id')
+        return selected
+
+    # Relations each readable field needs, so list views can load a whole
+    # page in a fixed number of queries instead of one (or more) per row
+    SELECT_RELATED_FIELDS = {
+        'owner': ['owner'],
+        'current_tenant': ['current_tenant'],
+        'type_detail': ['type'],
+        'location_detail': ['location'],
+        'main_image': ['main_image'],
+    }
+    PREFETCH_RELATED_FIELDS = {
+        # depth=1 user objects render their groups/permissions as id lists
+        'owner': ['owner__groups', 'owner__user_permissions'],
+        'current_tenant': ['current_tenant__groups', 'current_tenant__user_permissions'],
+        'tenants_with_access': ['tenants_with_access__groups', 'tenants_with_access__user_permissions'],
+        'images': ['images'],
+    }
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, user=None):
+        """Add select_related/prefetch_related for the fields that will be rendered"""
+        if fields is None:
+            fields = cls.Meta.fields
+
+        select_related = []
+        prefetch_related = []
+        for field in fields:
+            select_related.extend(cls.SELECT_RELATED_FIELDS.get(field, []))
+            prefetch_related.extend(cls.PREFETCH_RELATED_FIELDS.get(field, []))
+
+        if 'comments' in fields:
+            # One query for the comments of every property, read by get_comments
+            prefetch_related.append(Prefetch(
+                'comments', queryset=Comment.objects.for_display(user), to_attr='comment_list'))
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def get_comments(self, obj):
+        comments = getattr(obj, 'comment_list', None)
+        if comments is None:
+            comments = Comment.objects.filter(property=obj).for_display(
+                self.context['request'].user)
+        comments = attach_replies(list(comments))
+        return CommentSerializer(comments, many=True, context=self.context).data
+
     def create(self, validated_data):
         # Remove image_files if present
         validated_data.pop('image_files', None)
@@ -126,6 +237,14 @@ class PropertySerializer(serializers.ModelSerializer):
         return property
 
 
+class PropertyCardSerializer(PropertySerializer):
+    """Compact property representation for list grids"""
+
+    @classmethod
+    def select_fields(cls, fields=None, expand=None):
+        return super().select_fields(fields or cls.CARD_FIELDS, expand)
+
+
 class ApplicationSerializer(serializers.ModelSerializer):
     applicant = CustomUserSerializer(read_only=True)
     property = PropertySerializer(read_only=True)
@@ -157,7 +276,8 @@ class ChatSerializer(serializers.Serializer):
     last_message = MessageSerializer()
     unread_count = serializers.IntegerField()
     total_messages = serializers.IntegerField()
-    messages = MessageSerializer(many=True)
+    # Only the most recent page of the history, and only where the view asks for it
+    messages = MessageSerializer(many=True, required=False)
 
     def get_other_user(self, obj):
         return {
@@ -0,0 +1,250 @@
+"""
+Keep the stored rating totals (see api.ratings) in step with the rows they
+summarise. pre_save remembers what an existing row contributed so post_save
+can apply the difference. QuerySet.update(), bulk_create() and bulk_update()
+skip these signals; code using them applies the deltas itself. A full save()
+leaves the totals alone (accounts.models.MaintainedFieldsMixin).
+"""
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from accounts.models import LandlordProfile, TenantProfile, TenantRating
+from .models import Property, PropertyImage, Review, Comment, HouseType, HouseLocation
+from .ratings import (
+    apply_review_delta, apply_comment_delta, apply_profile_change, apply_tenant_rating_delta)
+from .search import property_index
+from .response_cache import bump_versions
+from .conditional import touch, touch_property
+
+User = get_user_model()
+
+
+def comment_rating(comment):
+    """What a comment adds to its property's AI rating totals: (rating, count)"""
+    if comment.is_rated and comment.ai_rating is not None:
+        return comment.ai_rating, 1
+    return 0, 0
+
+
+def remember_previous(sender, instance, fields):
+    instance._rating_previous = None
+    if instance.pk:
+        instance._rating_previous = sender.objects.filter(
+            pk=instance.pk).values(*fields).first()
+
+
+@receiver(pre_save, sender=Review)
+def review_pre_save(sender, instance, **kwargs):
+    remember_previous(sender, instance, ['property_id', 'rating'])
+
+
+@receiver(post_save, sender=Review)
+def review_post_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_rating_previous', None)
+    if previous == {'property_id': instance.property_id, 'rating': instance.rating}:
+        return
+    if previous is not None:
+        apply_review_delta(previous['property_id'], -previous['rating'], -1)
+    apply_review_delta(instance.property_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def review_post_delete(sender, instance, **kwargs):
+    apply_review_delta(instance.property_id, -instance.rating, -1)
+
+
+@receiver(pre_save, sender=Comment)
+def comment_pre_save(sender, instance, **kwargs):
+    remember_previous(sender, instance, ['property_id', 'is_rated', 'ai_rating'])
+
+
+@receiver(post_save, sender=Comment)
+def comment_post_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_rating_previous', None)
+    old_rating, old_count = (0, 0)
+    if previous is not None:
+        old_rating, old_count = comment_rating(Comment(
+            is_rated=previous['is_rated'], ai_rating=previous['ai_rating']))
+    new_rating, new_count = comment_rating(instance)
+
+    if previous is not None and previous['property_id'] != instance.property_id:
+        if old_count:
+            apply_comment_delta(previous['property_id'], -old_rating, -old_count)
+        old_rating, old_count = 0, 0
+    if (new_rating, new_count) != (old_rating, old_count):
+        apply_comment_delta(instance.property_id, new_rating - old_rating, new_count - old_count)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_post_delete(sender, instance, **kwargs):
+    rating, count = comment_rating(instance)
+    if count:
+        apply_comment_delta(instance.property_id, -rating, -count)
+
+
+@receiver(post_save, sender=LandlordProfile)
+def landlord_profile_post_save(sender, instance, **kwargs):
+    apply_profile_change(instance)
+
+
+def tenant_rating_value(rating):
+    """(rating, count) a TenantRating adds; unrated rows don't count, as with Avg"""
+    if rating is None:
+        return 0, 0
+    # Freshly created rows still hold the raw request value; count what the
+    # two-decimal column stores
+    return Decimal(str(rating)).quantize(Decimal('0.01')), 1
+
+
+@receiver(pre_save, sender=TenantRating)
+def tenant_rating_pre_save(sender, instance, **kwargs):
+    remember_previous(sender, instance, ['tenant_id', 'rating'])
+
+
+@receiver(post_save, sender=TenantRating)
+def tenant_rating_post_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_rating_previous', None)
+    if previous is not None:
+        rating, count = tenant_rating_value(previous['rating'])
+        apply_tenant_rating_delta(previous['tenant_id'], -rating, -count)
+    rating, count = tenant_rating_value(instance.rating)
+    apply_tenant_rating_delta(instance.tenant_id, rating, count)
+
+
+@receiver(post_delete, sender=TenantRating)
+def tenant_rating_post_delete(sender, instance, **kwargs):
+    rating, count = tenant_rating_value(instance.rating)
+    apply_tenant_rating_delta(instance.tenant_id, -rating, -count)
+
+
+# The in-process search index (api.search) used when not on PostgreSQL,
+# where the tsvector column is generated by the database itself
+
+@receiver(post_save, sender=Property)
+def property_post_save(sender, instance, **kwargs):
+    property_index.refresh(instance.pk)
+
+
+@receiver(post_delete, sender=Property)
+def property_post_delete(sender, instance, **kwargs):
+    property_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=HouseLocation)
+@receiver(post_delete, sender=HouseLocation)
+def house_location_changed(sender, instance, **kwargs):
+    # Rare, and may touch many properties; rebuild on next search
+    property_index.reset()
+
+
+# Versions behind the anonymous response cache (api.response_cache)
+CACHED_MODELS = [Property, PropertyImage, Comment, Review, HouseType, HouseLocation]
+
+
+def bump_model_version(sender, **kwargs):
+    bump_versions(sender)
+
+
+def bump_m2m_owner_version(sender, instance, action, reverse, model, **kwargs):
+    if action.startswith('post_'):
+        bump_versions(model if reverse else type(instance))
+
+
+for model in CACHED_MODELS:
+    post_save.connect(bump_model_version, sender=model)
+    post_delete.connect(bump_model_version, sender=model)
+    # Likes, tenants with access and the like are rendered too. Django sends
+    # no save/delete signals for rows of these tables, so code writing them
+    # directly (Comment reactions) bumps the version itself.
+    for field in model._meta.many_to_many:
+        m2m_changed.connect(bump_m2m_owner_version, sender=field.remote_field.through)
+
+
+# Property.updated_at validates conditional GETs of the property detail
+# (api.conditional), which also renders these
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=PropertyImage)
+@receiver(post_delete, sender=PropertyImage)
+def touch_parent_property(sender, instance, **kwargs):
+    touch_property(instance.property_id)
+
+
+# Property many-to-many field for each through table
+PROPERTY_M2M_FIELDS = {field.remote_field.through: field.name for field in Property._meta.many_to_many}
+
+
+def touch_m2m_property(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            touch_property(instance.pk)
+        return
+    # Changed from the user's side: the properties are pk_set, or for a
+    # clear() the ones still linked just before it
+    if action in ('post_add', 'post_remove'):
+        properties = Property.objects.filter(id__in=pk_set)
+    elif action == 'pre_clear':
+        properties = Property.objects.filter(**{PROPERTY_M2M_FIELDS[sender]: instance})
+    else:
+        return
+    properties.update(**touch(Property, {}))
+
+
+for through in PROPERTY_M2M_FIELDS:
+    m2m_changed.connect(touch_m2m_property, sender=through)
+
+
+# Other rows the property detail renders (depth=1), and the Property fields
+# pointing at them. Deletes are handled before the row goes, while the
+# properties still point at it.
+PROPERTY_RELATED_FIELDS = {
+    User: ['owner', 'current_tenant', 'tenants_with_access'],
+    HouseType: ['type'],
+    HouseLocation: ['location'],
+}
+
+# The user fields a rendered property depends on. last_login is auto_now,
+# so every save (and each login) writes it; like password it is left out
+# so that logging in doesn't invalidate the user's properties.
+PROPERTY_USER_FIELDS = ['email', 'first_name', 'last_name', 'user_type',
+                        'is_active', 'is_staff', 'is_superuser']
+
+
+def touch_related_properties(sender, instance, **kwargs):
+    related = reduce(or_, (Q(**{field: instance}) for field in PROPERTY_RELATED_FIELDS[sender]))
+    if Property.objects.filter(related).update(**touch(Property, {})):
+        # Users aren't in the response cache's models; properties are
+        bump_versions(Property)
+
+
+@receiver(pre_save, sender=User)
+def user_pre_save(sender, instance, update_fields=None, **kwargs):
+    # One indexed read, skipped for saves of other fields such as logins
+    instance._property_fields = None
+    if instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(PROPERTY_USER_FIELDS):
+        return
+    instance._property_fields = User.objects.filter(pk=instance.pk).values(*PROPERTY_USER_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_post_save(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_property_fields', None)
+    if created or stored is None:
+        return
+    if any(stored[field] != getattr(instance, field) for field in PROPERTY_USER_FIELDS):
+        touch_related_properties(sender, instance)
+
+
+pre_delete.connect(touch_related_properties, sender=User)
+for model in (HouseType, HouseLocation):
+    post_save.connect(touch_related_properties, sender=model)
+    pre_delete.connect(touch_related_properties, sender=model)
@@ -1,3 +1,736 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from accounts.models import LandlordProfile, Payment, TenantProfile, TenantRating
+from .chat_buffer import MessageBuffer
+from .images import process_pending_images
+from .models import (
+    Comment, HouseLocation, HouseType, Message, Property, PropertyImage, RatingWatermark, RentPayment, Review)
+from .payments import FIRST_POLL_DELAY, MAX_POLL_DELAY, PAYMENT_TIMEOUT, finish_payment, reschedule_payment
+from .ratings import (
+    LANDLORD_WATERMARK, changed_landlords, changed_properties, property_inputs, property_rating,
+    update_landlord_ratings, verify_rating_totals)
+from .search import property_index
+from .sentiment import StubSentimentModel, rate_texts, score_comments
+from .views import ChatDetailView
+
+User = get_user_model()
+
+
+def create_user(email, user_type='tenant'):
+    return User.objects.create_user(email, 'First', 'Last', user_type, 'password')
+
+
+def create_property(owner, **fields):
+    defaults = {
+        'title': 'Garden cottage', 'description': 'Two bedroom cottage', 'address': '1 Main Road',
+        'price': 500, 'bedrooms': 2, 'bathrooms': 1, 'area': 80, 'is_approved': True,
+        'type': HouseType.objects.get_or_create(name='Cottage')[0],
+        'location': HouseLocation.objects.get_or_create(name='Avondale', city='Harare')[0],
+    }
+    return Property.objects.create(owner=owner, **{**defaults, **fields})
+
+
+class PaymentTests(TestCase):
+    def setUp(self):
+        self.landlord = create_user('landlord@example.com', 'landlord')
+        self.tenant = create_user('tenant@example.com')
+        self.property = create_property(self.landlord)
+        self.rent = RentPayment.objects.create(
+            property=self.property, tenant=self.tenant, amount=500,
+            due_date=timezone.now().date() + timedelta(days=5))
+        self.payment = Payment.objects.create(
+            purpose='rent', object_id=self.rent.id, amount=500, status='sent',
+            poll_url='https://paynow.example/poll', next_poll_at=timezone.now())
+
+    def test_pending_status_is_recorded_without_fulfilment(self):
+        payment = finish_payment(self.payment.id, 'Awaiting Payment')
+        self.assertFalse(payment.is_final)
+        self.assertIsNone(payment.completed_at)
+        self.rent.refresh_from_db()
+        self.assertEqual(self.rent.status, 'PENDING')
+
+    def test_paid_fulfils_once(self):
+        finish_payment(self.payment.id, 'Paid')
+        payment = finish_payment(self.payment.id, 'Paid')
+
+        self.assertEqual(payment.status, 'paid')
+        self.assertIsNotNone(payment.completed_at)
+        self.assertIsNone(payment.next_poll_at)
+        self.rent.refresh_from_db()
+        self.assertEqual(self.rent.status, 'PAID')
+        # Fulfilment creates the next month's rent, only the first time
+        self.assertEqual(RentPayment.objects.filter(property=self.property).count(), 2)
+
+    def test_final_status_is_not_overwritten(self):
+        finish_payment(self.payment.id, 'Cancelled')
+        payment = finish_payment(self.payment.id, 'Paid')
+        self.assertEqual(payment.status, 'cancelled')
+        self.rent.refresh_from_db()
+        self.assertEqual(self.rent.status, 'PENDING')
+
+    def test_reschedule_backs_off_exponentially_up_to_the_limit(self):
+        delays = []
+        for _ in range(8):
+            before = timezone.now()
+            reschedule_payment(self.payment)
+            self.payment.refresh_from_db()
+            delays.append(self.payment.next_poll_at - before)
+
+        self.assertEqual(self.payment.poll_attempts, 8)
+        self.assertAlmostEqual(delays[0].total_seconds(), (FIRST_POLL_DELAY * 2).total_seconds(), delta=1)
+        self.assertAlmostEqual(delays[1].total_seconds(), (FIRST_POLL_DELAY * 4).total_seconds(), delta=1)
+        self.assertAlmostEqual(delays[-1].total_seconds(), MAX_POLL_DELAY.total_seconds(), delta=1)
+
+    def test_reschedule_expires_old_payments(self):
+        Payment.objects.filter(id=self.payment.id).update(
+            created_at=timezone.now() - PAYMENT_TIMEOUT - timedelta(minutes=1))
+        self.payment.refresh_from_db()
+
+        payment = reschedule_payment(self.payment)
+        self.assertEqual(payment.status, 'expired')
+        self.assertIsNone(payment.next_poll_at)
+        self.assertEqual(payment.poll_attempts, 0)
+
+
+class RatingTotalsTests(TestCase):
+    def setUp(self):
+        self.landlord = create_user('landlord@example.com', 'landlord')
+        self.profile = LandlordProfile.objects.get(user=self.landlord)  # Created with the user
+        self.tenants = [create_user(f'tenant{i}@example.com') for i in range(3)]
+        self.property = create_property(self.landlord)
+
+    def assertTotalsMatch(self):
+        self.assertEqual(verify_rating_totals(),
+                         {'Property': [], 'LandlordProfile': [], 'TenantProfile': []})
+        for row in property_inputs():
+            self.assertEqual(row['overall_rating'], property_rating(row)['overall_rating'])
+
+    def test_review_deltas(self):
+        reviews = [
+            Review.objects.create(reviewer=tenant, reviewed=self.landlord,
+                                  property=self.property, rating=rating, comment='ok')
+            for tenant, rating in zip(self.tenants, [5, 3, 1])
+        ]
+        self.assertTotalsMatch()
+        self.property.refresh_from_db()
+        self.assertEqual((self.property.review_rating_sum, self.property.review_rating_count), (9, 3))
+
+        reviews[0].rating = 2
+        reviews[0].save()
+        self.assertTotalsMatch()
+
+        reviews[1].delete()
+        self.assertTotalsMatch()
+        self.profile.refresh_from_db()
+        self.assertEqual((self.profile.review_rating_sum, self.profile.review_rating_count), (3, 2))
+
+    def test_comment_rating_deltas(self):
+        comment = Comment.objects.create(property=self.property, commenter=self.tenants[0], content='Lovely')
+        comment.ai_rating, comment.is_rated = 4.5, True
+        comment.save()
+        self.assertTotalsMatch()
+
+        comment.ai_rating = 2.0
+        comment.save()
+        self.assertTotalsMatch()
+
+        comment.delete()
+        self.assertTotalsMatch()
+        self.property.refresh_from_db()
+        self.assertEqual(self.property.comment_rating_count, 0)
+
+    def test_tenant_rating_deltas(self):
+        tenant = TenantProfile.objects.get(user=self.tenants[0])
+        rating = TenantRating.objects.create(tenant=tenant, landlord=self.profile, rating=Decimal('4.00'))
+        self.assertTotalsMatch()
+
+        rating.rating = Decimal('2.50')
+        rating.save()
+        self.assertTotalsMatch()
+        tenant.refresh_from_db()
+        self.assertEqual(tenant.current_rating, Decimal('2.50'))
+
+        rating.delete()
+        self.assertTotalsMatch()
+
+    def test_full_save_after_delta_keeps_totals(self):
+        # Loaded before the review; a full save mustn't write the old totals back
+        stale_property = Property.objects.get(id=self.property.id)
+        stale_profile = LandlordProfile.objects.get(id=self.profile.id)
+        Review.objects.create(reviewer=self.tenants[0], reviewed=self.landlord,
+                              property=self.property, rating=4, comment='ok')
+
+        stale_property.title = 'Renamed'
+        stale_property.save()
+        stale_profile.phone = '0771234567'
+        stale_profile.save()
+        self.assertTotalsMatch()
+        self.property.refresh_from_db()
+        self.assertEqual(self.property.title, 'Renamed')
+        self.assertEqual((self.property.review_rating_sum, self.property.review_rating_count), (4, 1))
+
+        # Named in update_fields, as when repairing totals by hand, they are written
+        stale_property.save(update_fields=['review_rating_sum', 'review_rating_count'])
+        self.assertEqual(verify_rating_totals()['Property'], [self.property.id])
+
+    def test_comments_rated_meanwhile_are_not_counted_twice(self):
+        comments = [Comment.objects.create(property=self.property, commenter=tenant, content='Lovely and quiet')
+                    for tenant in self.tenants[:2]]
+
+        def rate_then_race(*args):
+            # Another worker saves its rating while this one waits on the model
+            other = Comment.objects.get(id=comments[0].id)
+            other.ai_rating, other.is_rated = 4.0, True
+            other.save()
+            return rate_texts(*args)
+
+        with mock.patch('api.sentiment.rate_texts', rate_then_race):
+            scored = score_comments(model=StubSentimentModel(), concurrency=1)
+        self.assertEqual([comment.id for comment in scored], [comments[1].id])
+        self.assertTotalsMatch()
+        self.property.refresh_from_db()
+        self.assertEqual(self.property.comment_rating_count, 2)
+
+    def test_rating_writes_do_not_mark_profiles_changed(self):
+        Review.objects.create(reviewer=self.tenants[0], reviewed=self.landlord,
+                              property=self.property, rating=4, comment='ok')
+        LandlordProfile.objects.filter(id=self.profile.id).update(current_rating=0)
+
+        update_landlord_ratings()
+        watermark = RatingWatermark.objects.get(name=LANDLORD_WATERMARK)
+        self.profile.refresh_from_db()
+        self.assertNotEqual(self.profile.current_rating, 0)
+        self.assertLess(self.profile.last_updated, watermark.computed_at)
+        self.assertEqual(changed_landlords(watermark.computed_at), set())
+
+    def test_edited_review_is_changed(self):
+        review = Review.objects.create(reviewer=self.tenants[0], reviewed=self.landlord,
+                                       property=self.property, rating=4, comment='ok')
+        update_landlord_ratings()
+        since = RatingWatermark.objects.get(name=LANDLORD_WATERMARK).computed_at
+        self.assertEqual(changed_landlords(since), set())
+
+        review.rating = 1
+        review.save()
+        self.assertEqual(changed_landlords(since), {self.landlord.id})
+        self.assertIn(self.property.id, changed_properties(since))
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.landlord = create_user('landlord@example.com', 'landlord')
+        self.tenant = create_user('tenant@example.com')
+        self.property = create_property(self.landlord)
+        self.property.tenants_with_access.add(self.tenant)
+        self.comment = Comment.objects.create(property=self.property, commenter=self.tenant, content='Nice')
+        self.url = reverse('property-detail', args=[self.property.id])
+
+    def get(self, url, client=None, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return (client or APIClient()).get(url, **headers)
+
+    def assertChanges(self, change, url=None, client=None):
+        """The ETag given before change() is no longer current after it"""
+        url = url or self.url
+        etag = self.get(url, client)['ETag']
+        self.assertEqual(self.get(url, client, etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.get(url, client, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_anonymous_responses_are_cached(self):
+        self.get(self.url)
+        with self.assertNumQueries(1):  # The conditional timestamp only
+            response = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_property_save_invalidates(self):
+        def change():
+            self.property.title = 'Renamed cottage'
+            self.property.save()
+        response = self.assertChanges(change)
+        self.assertEqual(response.data['title'], 'Renamed cottage')
+
+    def test_related_rows_invalidate(self):
+        def rename(obj, field, value):
+            def change():
+                setattr(obj, field, value)
+                obj.save()
+            return change
+
+        response = self.assertChanges(rename(self.landlord, 'first_name', 'Renamed'))
+        self.assertEqual(response.data['owner']['first_name'], 'Renamed')
+        self.assertChanges(rename(self.tenant, 'last_name', 'Renamed'))
+        self.assertChanges(rename(self.property.type, 'name', 'Villa'))
+        self.assertChanges(rename(self.property.location, 'name', 'Borrowdale'))
+        self.assertChanges(lambda: Comment.objects.create(
+            property=self.property, commenter=self.tenant, content='Another'))
+        self.assertChanges(lambda: self.tenant.properties_with_access.remove(self.property))
+
+    def test_unrelated_writes_keep_validators(self):
+        etag = self.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            create_user('someone@example.com')
+        self.assertEqual(self.get(self.url, etag=etag).status_code, 304)
+
+    def test_logins_and_unchanged_saves_keep_validators(self):
+        etag = self.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            self.landlord.save(update_fields=['last_login'])
+            self.tenant.save()
+        self.assertFalse([query for query in queries if '"api_property"' in query['sql']])
+        self.assertEqual(self.get(self.url, etag=etag).status_code, 304)
+
+    def test_reaction_invalidates_for_the_user(self):
+        client = APIClient()
+        client.force_authenticate(self.tenant)
+        self.assertChanges(
+            lambda: client.post(reverse('comment-like', args=[self.comment.id])), client=client)
+
+    def test_browse_list_sees_new_properties(self):
+        url = reverse('property-list-create')
+        self.assertEqual(len(self.get(url).data), 1)
+        response = self.assertChanges(
+            lambda: create_property(self.landlord, title='New flat'), url=url)
+        self.assertEqual(len(response.data), 2)
+
+    def test_profile_validator_follows_ratings(self):
+        client = APIClient()
+        client.force_authenticate(self.landlord)
+        self.assertChanges(lambda: Review.objects.create(
+            reviewer=self.tenant, reviewed=self.landlord, property=self.property, rating=5, comment='ok'),
+            url=reverse('landlord-profile'), client=client)
+
+
+class PropertyListingTests(TestCase):
+    url = '/api/properties-filter/'
+
+    def setUp(self):
+        self.landlord = create_user('landlord@example.com', 'landlord')
+        self.tenant = create_user('tenant@example.com')
+
+    def add_properties(self, count):
+        for i in range(count):
+            property = create_property(self.landlord, title=f'House {i}')
+            property.tenants_with_access.add(self.tenant)
+            comment = Comment.objects.create(property=property, commenter=self.tenant, content='Nice')
+            Comment.objects.create(property=property, commenter=self.landlord, content='Thanks', parent=comment)
+            comment.likes.add(self.landlord)
+
+    def get(self, query):
+        """(response, number of queries) for an uncached request"""
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def assertConstantQueries(self, query):
+        """The query count doesn't grow with the number of properties listed"""
+        self.add_properties(2)
+        _, few = self.get(query)
+        self.add_properties(6)
+        response, many = self.get(query)
+        self.assertEqual(few, many)
+        return response
+
+    def test_full_list_queries(self):
+        response = self.assertConstantQueries('')
+        self.assertEqual(len(response.data), 8)
+        self.assertEqual(response.data[0]['comments'][0]['replies'][0]['content'], 'Thanks')
+
+    def test_page_queries(self):
+        response = self.assertConstantQueries('?page_size=5')
+        self.assertEqual(len(response.data['results']), 5)
+        rest, _ = self.get('?' + response.data['next'].split('?', 1)[1])
+        self.assertEqual(len(rest.data['results']), 3)
+        self.assertIsNone(rest.data['next'])
+
+    def test_card_queries(self):
+        response = self.assertConstantQueries('?view=card')
+        self.assertEqual(set(response.data[0]), {
+            'id', 'title', 'address', 'price', 'bedrooms', 'bathrooms', 'main_image', 'overall_rating'})
+
+    def test_selected_fields_skip_unrendered_relations(self):
+        response = self.assertConstantQueries('?fields=title,price&expand=owner')
+        self.assertEqual(set(response.data[0]), {'id', 'title', 'price', 'owner'})
+        # The properties, their owners, and the owners' groups and permissions
+        _, queries = self.get('?fields=title,price&expand=owner')
+        self.assertEqual(queries, 3)
+        _, queries = self.get('?fields=title,price')
+        self.assertEqual(queries, 1)
+
+
+class PropertyFacetTests(TestCase):
+    url = '/api/properties-facets/'
+
+    def setUp(self):
+        cache.clear()
+        landlord = create_user('landlord@example.com', 'landlord')
+        borrowdale = HouseLocation.objects.create(name='Borrowdale', city='Harare')
+        flat = HouseType.objects.create(name='Flat')
+        self.property = create_property(landlord, bedrooms=2, garden=True, pool=True)
+        create_property(landlord, bedrooms=6, type=flat, accepts_pets=True)
+        create_property(landlord, bedrooms=5, location=borrowdale, garden=True)
+        create_property(landlord, is_approved=False)  # Not listed, so not counted
+
+    def get(self, query=''):
+        response = APIClient().get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts(self):
+        with self.assertNumQueries(1):
+            facets = self.get()
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual([(entry['name'], entry['count']) for entry in facets['location']],
+                         [('Avondale', 2), ('Borrowdale', 1)])
+        self.assertEqual([(entry['name'], entry['count']) for entry in facets['type']],
+                         [('Cottage', 2), ('Flat', 1)])
+        self.assertEqual(facets['bedrooms'], [{'value': '2', 'count': 1}, {'value': '5+', 'count': 2}])
+        self.assertEqual(facets['amenities'], {
+            'pool': 1, 'garden': 2, 'has_solar_power': 0, 'has_borehole': 0,
+            'accepts_pets': 1, 'accepts_smokers': 0})
+
+    def test_counts_follow_the_filter(self):
+        facets = self.get('?garden=true&bedrooms_min=3')
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(facets['location'], [{'id': facets['location'][0]['id'], 'name': 'Borrowdale', 'count': 1}])
+
+    def test_cached_per_filter_until_properties_change(self):
+        self.get('?garden=true&pool=true')
+        with self.assertNumQueries(0):
+            # Same filter, other parameter order and a display-only parameter
+            self.assertEqual(self.get('?pool=true&garden=true&page_size=5')['total'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_property(self.property.owner, garden=True, pool=True)
+        self.assertEqual(self.get('?garden=true&pool=true')['total'], 2)
+
+
+class PropertySearchTests(TestCase):
+    url = '/api/properties-filter/'
+
+    def setUp(self):
+        property_index.reset()
+        self.addCleanup(property_index.reset)
+        landlord = create_user('landlord@example.com', 'landlord')
+        self.in_title = create_property(landlord, title='Sunny cottage', description='Quiet garden')
+        self.in_description = create_property(landlord, title='Garden flat', description='Sunny balcony')
+        create_property(landlord, title='Town house', description='Close to shops')
+
+    def search(self, terms, **params):
+        cache.clear()
+        response = APIClient().get(self.url, {'search': terms, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual([row['id'] for row in self.search('sunny')],
+                         [self.in_title.id, self.in_description.id])
+        # Every term has to match
+        self.assertEqual([row['id'] for row in self.search('sunny balcony')], [self.in_description.id])
+        self.assertEqual(self.search('penthouse'), [])
+
+    def test_ranked_pages(self):
+        page = self.search('garden', page_size=1)
+        self.assertEqual([row['id'] for row in page['results']], [self.in_description.id])
+        page = APIClient().get(page['next']).data
+        self.assertEqual([row['id'] for row in page['results']], [self.in_title.id])
+        self.assertIsNone(page['next'])
+
+    def test_misspelt_terms_fall_back_to_close_words(self):
+        self.assertEqual([row['id'] for row in self.search('cotage')], [self.in_title.id])
+
+    def test_index_follows_edits(self):
+        self.search('sunny')  # Builds the index
+        self.in_description.title = 'Penthouse'
+        self.in_description.save()
+        self.assertEqual([row['id'] for row in self.search('penthouse')], [self.in_description.id])
+
+
+class CommentTreeTests(TestCase):
+    def setUp(self):
+        self.landlord = create_user('landlord@example.com', 'landlord')
+        self.tenant = create_user('tenant@example.com')
+        self.property = create_property(self.landlord)
+        self.url = reverse('property-comment-list', args=[self.property.id])
+        self.client = APIClient()
+        self.client.force_authenticate(self.tenant)
+
+    def add_thread(self):
+        comment = Comment.objects.create(property=self.property, commenter=self.tenant, content='Is it quiet?')
+        for content in ['Very', 'Mostly']:
+            Comment.objects.create(property=self.property, commenter=self.landlord, content=content, parent=comment)
+        comment.toggle_like(self.landlord)
+        comment.toggle_dislike(self.tenant)
+        return comment
+
+    def get(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_tree_loads_in_fixed_queries(self):
+        self.add_thread()
+        _, few = self.get()
+        comment = self.add_thread()
+        self.add_thread()
+        data, many = self.get()
+        self.assertEqual(few, many)
+
+        thread = next(item for item in data if item['id'] == comment.id)
+        self.assertEqual([reply['content'] for reply in thread['replies']], ['Very', 'Mostly'])
+        self.assertEqual((thread['like_count'], thread['dislike_count']), (1, 1))
+        self.assertEqual((thread['has_liked'], thread['has_disliked']), (False, True))
+        self.assertEqual(thread['commenter_name'], 'First Last')
+
+
+class CommentReactionTests(TestCase):
+    def setUp(self):
+        self.landlord = create_user('landlord@example.com', 'landlord')
+        self.tenant = create_user('tenant@example.com')
+        self.comment = Comment.objects.create(
+            property=create_property(self.landlord), commenter=self.landlord, content='Welcome')
+
+    def assertCounts(self, likes, dislikes):
+        self.comment.refresh_from_db()
+        self.assertEqual((self.comment.like_count, self.comment.dislike_count), (likes, dislikes))
+        self.assertEqual((self.comment.likes.count(), self.comment.dislikes.count()), (likes, dislikes))
+
+    def test_toggle_like(self):
+        self.assertTrue(self.comment.toggle_like(self.tenant))
+        self.assertCounts(1, 0)
+        self.assertFalse(self.comment.toggle_like(self.tenant))
+        self.assertCounts(0, 0)
+
+    def test_dislike_replaces_like(self):
+        self.comment.toggle_like(self.tenant)
+        self.assertTrue(self.comment.toggle_dislike(self.tenant))
+        self.assertCounts(0, 1)
+        self.assertTrue(self.comment.toggle_like(self.tenant))
+        self.assertCounts(1, 0)
+
+    def test_counts_come_from_the_database(self):
+        # Two requests holding the comment as loaded before either toggled
+        first, second = Comment.objects.get(pk=self.comment.pk), Comment.objects.get(pk=self.comment.pk)
+        self.assertTrue(first.toggle_like(self.tenant))
+        self.assertTrue(second.toggle_like(self.landlord))
+        self.assertEqual(second.like_count, 2)
+
+        # The tenant's like is seen even though this copy predates it
+        self.assertTrue(second.toggle_dislike(self.tenant))
+        self.assertEqual((second.like_count, second.dislike_count), (1, 1))
+        self.assertCounts(1, 1)
+
+    def test_toggle_queries(self):
+        self.comment.toggle_dislike(self.tenant)
+        # Lock and read, clear the dislike, add the like, write both counters
+        with self.assertNumQueries(6):  # Plus the transaction's savepoint and release
+            self.comment.toggle_like(self.tenant)
+        with self.assertNumQueries(5):
+            self.comment.toggle_like(self.tenant)
+        self.assertCounts(0, 0)
+
+
+class ImageProcessingTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        upload = BytesIO()
+        Image.new('RGB', (400, 300), 'white').save(upload, 'JPEG')
+        self.image = PropertyImage.objects.create(
+            property=create_property(create_user('landlord@example.com', 'landlord')),
+            image=ContentFile(upload.getvalue(), name='house.jpg'))
+
+    def test_processed_files_replace_the_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_pending_images(), (1, 0))
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.processing_status, 'DONE')
+        self.assertEqual(sorted(os.listdir(self.media)), sorted(
+            [self.image.image.name] + [d['name'] for d in self.image.derivatives.values()]))
+
+    def test_rolled_back_save_leaves_no_files(self):
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(PropertyImage, 'save', side_effect=OperationalError('gone away')), \
+                self.assertLogs('api.images', 'ERROR'):
+            self.assertEqual(process_pending_images(), (0, 1))
+        self.assertEqual(os.listdir(self.media), ['house.jpg'])
+
+
+class MessageBufferTests(TransactionTestCase):
+    """Transactional: database_sync_to_async closes connections left in a transaction"""
+
+    def setUp(self):
+        self.sender = create_user('sender@example.com')
+        self.receiver = create_user('receiver@example.com')
+        self.buffer = MessageBuffer(interval=60000, size=100, limit=3, attempts=2)
+
+    def message(self, content, receiver_id=None):
+        return Message(sender_id=self.sender.id, receiver_id=receiver_id or self.receiver.id, content=content)
+
+    def flush(self):
+        async def flush():
+            written = await self.buffer.flush()
+            if self.buffer.timer is not None:
+                self.buffer.timer.cancel()
+                self.buffer.timer = None
+            return written
+        return async_to_sync(flush)()
+
+    def add(self, message):
+        async def add():
+            added = self.buffer.add(message)
+            if self.buffer.timer is not None:
+                self.buffer.timer.cancel()
+                self.buffer.timer = None
+            return added
+        return async_to_sync(add)()
+
+    def test_bad_row_is_dropped_and_the_rest_saved(self):
+        self.add(self.message('first'))
+        self.add(self.message('orphan', receiver_id=999999))
+        self.add(self.message('second'))
+
+        with self.assertLogs('api.chat_buffer', 'ERROR') as logs:
+            self.assertEqual(self.flush(), 2)
+        self.assertIn("'orphan'", '\n'.join(logs.output))
+        self.assertEqual(self.buffer.pending, [])
+        self.assertEqual(sorted(Message.objects.values_list('content', flat=True)), ['first', 'second'])
+
+    def test_failing_rows_are_retried_then_dropped(self):
+        self.add(self.message('hello'))
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=OperationalError('gone away')), \
+                mock.patch.object(Message, 'save', side_effect=OperationalError('gone away')), \
+                self.assertLogs('api.chat_buffer', 'ERROR'):
+            self.assertEqual(self.flush(), 0)
+            self.assertEqual(len(self.buffer.pending), 1)
+            self.assertEqual(self.flush(), 0)
+        self.assertEqual(self.buffer.pending, [])
+        self.assertFalse(Message.objects.exists())
+
+    def test_buffer_is_bounded(self):
+        for i in range(3):
+            self.assertTrue(self.add(self.message(f'message {i}')))
+        with self.assertLogs('api.chat_buffer', 'ERROR'):
+            self.assertFalse(self.add(self.message('one too many')))
+        self.assertEqual(self.flush(), 3)
+        self.assertTrue(self.add(self.message('room again')))
+
+
+class ChatInboxTests(TestCase):
+    def setUp(self):
+        self.user = create_user('reader@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_conversation(self, email):
+        other = create_user(email, 'landlord')
+        Message.objects.create(sender=other, receiver=self.user, content='Hello', is_read=True)
+        Message.objects.create(sender=other, receiver=self.user, content='Still free?')
+        Message.objects.create(sender=self.user, receiver=other, content='Yes')
+        Message.objects.create(sender=other, receiver=self.user, content='Viewing Friday?')
+        return other
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_inbox_counts(self):
+        first = self.add_conversation('first@example.com')
+        second = self.add_conversation('second@example.com')
+        Message.objects.create(sender=self.user, receiver=first, content='See you then')
+
+        data, _ = self.get(reverse('chat-list'))
+        self.assertEqual([chat['other_user']['id'] for chat in data], [first.id, second.id])
+        self.assertEqual([(chat['unread_count'], chat['total_messages']) for chat in data], [(2, 5), (2, 4)])
+        self.assertEqual(data[0]['last_message']['content'], 'See you then')
+        self.assertEqual(data[0]['chat_id'], f'{self.user.id}_{first.id}')
+
+    def test_inbox_queries(self):
+        self.add_conversation('first@example.com')
+        _, few = self.get(reverse('available-chats') + '?messages=2')
+        self.add_conversation('second@example.com')
+        self.add_conversation('third@example.com')
+        data, many = self.get(reverse('available-chats') + '?messages=2')
+        self.assertEqual(few, many)
+        # The most recent messages, oldest first
+        self.assertEqual([message['content'] for message in data[0]['messages']], ['Yes', 'Viewing Friday?'])
+
+
+class ChatReadTests(TestCase):
+    def setUp(self):
+        self.user = create_user('reader@example.com')
+        self.other = create_user('writer@example.com')
+        self.messages = [Message.objects.create(sender=self.other, receiver=self.user, content=f'm{i}')
+                         for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('chat-detail', args=[self.other.id])
+
+    @mock.patch('api.views.notify_messages_read')
+    def test_fetch_marks_read_and_notifies_the_count(self, notify):
+        self.client.get(self.url)
+        notify.assert_called_once_with(self.user.id, {self.other.id: 3})
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+
+    @mock.patch('api.views.notify_messages_read')
+    def test_overlapping_fetch_only_counts_what_it_marked(self, notify):
+        get_page = ChatDetailView.get_page
+
+        def get_page_then_race(view, queryset):
+            page = get_page(view, queryset)
+            # Another fetch marks two of them between our read and our update
+            Message.objects.filter(id__in=[m.id for m in self.messages[:2]]).update(is_read=True)
+            return page
+
+        with mock.patch.object(ChatDetailView, 'get_page', get_page_then_race):
+            self.client.get(self.url)
+        notify.assert_called_once_with(self.user.id, {self.other.id: 1})
+
+    @mock.patch('api.views.notify_messages_read')
+    def test_paging_by_before_and_after(self, notify):
+        self.messages += [Message.objects.create(sender=self.user, receiver=self.other, content=f'm{i}')
+                          for i in range(3, 6)]
+        Message.objects.create(sender=self.other, receiver=create_user('else@example.com'), content='other chat')
+        ids = [message.id for message in self.messages]
+
+        latest = self.client.get(self.url, {'limit': 2}).data
+        self.assertEqual([message['id'] for message in latest], ids[4:])
+        older = self.client.get(self.url, {'limit': 2, 'before': ids[4]}).data
+        self.assertEqual([message['id'] for message in older], ids[2:4])
+        newer = self.client.get(self.url, {'limit': 3, 'after': ids[0]}).data
+        self.assertEqual([message['id'] for message in newer], ids[1:4])
+
+        # Only the returned messages sent to the reader were marked read
+        self.assertEqual(list(Message.objects.filter(is_read=True).values_list('id', flat=True)), ids[1:3])
+        self.assertEqual(self.client.get(self.url, {'before': 'x'}).status_code, 400)
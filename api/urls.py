@@ -5,6 +5,8 @@ urlpatterns = [
     # Property URLs
     path('properties-filter/', views.PropertyListCreateView.as_view(),
          name='property-list-create'),
+    path('properties-facets/', views.PropertyFacetsView.as_view(),
+         name='property-facets'),
     path('properties/', views.PropertyList.as_view(), name='property-list'),
     path('own-properties/', views.OwnPropertyList.as_view(),
          name='own-property-list'),
@@ -127,6 +129,8 @@ urlpatterns = [
 
     path('process-lease-document-payment/', views.ProcessLeaseDocumentPaymentView.as_view(),
          name='process-lease-document-payment'),
+    path('payments/metrics/', views.PaynowMetricsView.as_view(),
+         name='paynow-metrics'),
 
 
 ]
@@ -1,65 +1,147 @@
 from PIL import Image
 from io import BytesIO
+from functools import lru_cache
 from django.core.files.uploadedfile import InMemoryUploadedFile
 import os
 from django.conf import settings
 
 WATERMARK_PATH = os.path.join(settings.STATIC_ROOT, 'images', 'RO-JA.png')
 
-def add_watermark(image_file):
+
+@lru_cache(maxsize=1)
+def decode_watermark(path, mtime):
+    watermark = Image.open(path)
+    # Convert watermark to RGBA if it's not
+    if watermark.mode != 'RGBA':
+        watermark = watermark.convert('RGBA')
+    watermark.load()
+    return watermark
+
+
+@lru_cache(maxsize=32)
+def scaled_watermark(path, mtime, width):
+    watermark = decode_watermark(path, mtime)
+
+    # Calculate watermark size while maintaining aspect ratio
+    watermark_ratio = watermark.width / watermark.height
+    new_height = int(width / watermark_ratio)
+
+    # Resize watermark maintaining aspect ratio
+    return watermark.resize((width, new_height), Image.LANCZOS)
+
+
+def load_watermark(image_width):
+    """
+    The watermark as RGBA, scaled to 20% of the image width. Decoded and
+    scaled copies are cached per process; passing the file's mtime into
+    the cache keys means a replaced RO-JA.png is picked up on the next call.
+    """
+    desired_width = int(image_width * 0.2)  # 20% of main image width
+    return scaled_watermark(WATERMARK_PATH, os.path.getmtime(WATERMARK_PATH), desired_width)
+
+
+def clear_watermark_cache():
+    scaled_watermark.cache_clear()
+    decode_watermark.cache_clear()
+
+
+def open_rgb(data):
     # Open the main image
-    image = Image.open(image_file)
-    
+    image = Image.open(BytesIO(data))
+
     # Convert main image to RGB if it's not
     if image.mode != 'RGB':
         image = image.convert('RGB')
-    
+    return image
+
+
+def apply_watermark(image):
+    """Paste the watermark onto an RGB image in place"""
     try:
-        # Open and prepare watermark
-        watermark = Image.open(WATERMARK_PATH)
-        # Convert watermark to RGBA if it's not
-        if watermark.mode != 'RGBA':
-            watermark = watermark.convert('RGBA')
-        
-        # Calculate watermark size while maintaining aspect ratio
-        watermark_ratio = watermark.width / watermark.height
-        desired_width = int(image.width * 0.2)  # 20% of main image width
-        new_height = int(desired_width / watermark_ratio)
-        
-        # Resize watermark maintaining aspect ratio
-        watermark = watermark.resize((desired_width, new_height), Image.LANCZOS)
-        
-        # Create a new blank image with the same size as the original
-        watermarked = Image.new('RGB', image.size, (0, 0, 0))
-        
-        # Paste the original image
-        watermarked.paste(image, (0, 0))
-        
+        watermark = load_watermark(image.width)
+
         # Calculate position (bottom-right corner)
         position = (
             image.width - watermark.width - 10,
             image.height - watermark.height - 10
         )
-        
-        # Paste the watermark
-        watermarked.paste(watermark, position, watermark)
-        
+
+        # Paste the watermark straight onto the decoded image rather than
+        # copying it onto a new canvas first
+        image.paste(watermark, position, watermark)
+
     except Exception as e:
         print(f"Error applying watermark: {str(e)}")
         # If watermark fails, return original image
-        watermarked = image
-    
+
+
+def encode_jpeg(image):
     # Save to BytesIO
     output = BytesIO()
-    watermarked.save(output, format='JPEG', quality=95)
-    output.seek(0)
-    
+    image.save(output, format='JPEG', quality=95)
+    return output.getvalue()
+
+
+def watermark_image_bytes(data):
+    """
+    Watermark an encoded image and return it as JPEG bytes. Takes and
+    returns plain bytes so it can run in a worker process.
+    """
+    image = open_rgb(data)
+    apply_watermark(image)
+    return encode_jpeg(image)
+
+
+# Responsive copies served next to each property image, by maximum width.
+# Pillow 11.0 has no AVIF encoder, so they are WebP.
+DERIVATIVE_WIDTHS = {
+    'thumb': 320,
+    'card': 800,
+    'full': 1600,
+}
+DERIVATIVE_QUALITY = 80
+
+
+def make_derivatives(image):
+    """Encode WebP copies of an RGB image: {name: (bytes, width, height)}"""
+    derivatives = {}
+    # Largest first, each copy is shrunk from the previous one
+    for name, width in sorted(DERIVATIVE_WIDTHS.items(), key=lambda item: -item[1]):
+        if image.width > width:
+            image = image.resize(
+                (width, round(image.height * width / image.width)), Image.LANCZOS)
+        output = BytesIO()
+        image.save(output, format='WEBP', quality=DERIVATIVE_QUALITY, method=4)
+        derivatives[name] = (output.getvalue(), image.width, image.height)
+    return {name: derivatives[name] for name in DERIVATIVE_WIDTHS}
+
+
+def derivative_name(name, derivative):
+    return f"{os.path.splitext(name)[0]}_{derivative}.webp"
+
+
+def watermarked_name(name):
+    return f"{os.path.splitext(name)[0]}_watermarked.jpg"
+
+
+def add_watermark(image_file):
+    output = BytesIO(watermark_image_bytes(image_file.read()))
+
     # Return as InMemoryUploadedFile
     return InMemoryUploadedFile(
         output,
         'ImageField',
-        f"{os.path.splitext(image_file.name)[0]}_watermarked.jpg",
+        watermarked_name(image_file.name),
         'image/jpeg',
-        output.tell(),
+        len(output.getvalue()),
         None
-    ) 
\ No newline at end of file
+    )
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list; 0.0 when empty"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1,
+                int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -1,4 +1,5 @@
-from django.db.models import Q, Max, Count, Case, When, IntegerField, F, Avg
+from django.db.models import Q, Max, Count, Case, When, IntegerField, F, Avg, Value
+from django.db.models.functions import Coalesce
 from .serializers import ChatSerializer, MessageSerializer
 from rest_framework import generics, permissions, status, serializers
 from rest_framework.response import Response
@@ -10,13 +11,14 @@ from django_filters import rest_framework as filters
 # from .serializers import SiteSerializer
 # from .filters import SiteFilter
 from rest_framework.permissions import AllowAny
-from .filters import PropertyFilter
+from .filters import PropertyFilter, PropertySearchFilter
+from .pagination import PropertyCursorPagination, PropertySearchCursorPagination
 from django.db.models import Q
 from django.conf import settings
 from django.contrib.auth import get_user_model
 
 from .models import Property, PropertyImage, Application, Message, LeaseAgreement, Review, HouseType, HouseLocation, Comment, RentPayment, PhoneVerification, LeaseDocumentPayment
-from .serializers import PropertySerializer, PropertyImageSerializer, ApplicationSerializer, MessageSerializer, LeaseAgreementSerializer, ReviewSerializer, HouseTypeSerializer, HouseLocationSerializer, CommentSerializer, ChatSerializer, RentPaymentSerializer, LeaseDocumentPaymentSerializer
+from .serializers import PropertySerializer, PropertyCardSerializer, PropertyImageSerializer, ApplicationSerializer, MessageSerializer, LeaseAgreementSerializer, ReviewSerializer, HouseTypeSerializer, HouseLocationSerializer, CommentSerializer, ChatSerializer, RentPaymentSerializer, LeaseDocumentPaymentSerializer
 from accounts.models import TenantProfile
 from collections import defaultdict  # Add this import
 
@@ -27,9 +29,19 @@ from django.utils import timezone
 import uuid
 import time
 
-from paynow import Paynow
+from .payments import start_mobile_payment, PaymentError
+from .paynow_gateway import get_gateway
+from .mail import queue_email, queue_mail
+from .notifications import notify_new_messages, notify_messages_read
+from .sentiment import score_comments
+from .facets import facet_cache_key, property_facets
+from django.core.cache import cache
+from .response_cache import CachedResponseMixin, model_versions, bump_versions
+from .conditional import ConditionalGetMixin, touch_property
+from .ratings import (
+    landlord_profiles, update_landlord_ratings, property_inputs, property_rating,
+    update_property_ratings)
 
-from .utils import add_watermark
 
 import openai
 
@@ -51,11 +63,54 @@ import json
 
 
 # Property views
-class PropertyList(generics.ListCreateAPIView):
+class PropertyFieldSelectionMixin:
+    """
+    Sparse fieldsets for property lists: ?fields=title,price renders only those
+    fields, ?expand=images,comments adds nested relations and ?view=card
+    returns the compact card representation. Relations that are not rendered
+    are not loaded either.
+    """
+
+    def get_property_serializer_class(self):
+        if self.request.query_params.get('view') == 'card':
+            return PropertyCardSerializer
+        return PropertySerializer
+
+    def get_field_selection(self):
+        if self.request.method not in permissions.SAFE_METHODS:
+            return {}
+
+        selection = {}
+        for param in ('fields', 'expand'):
+            value = self.request.query_params.get(param)
+            if value:
+                selection[param] = [name.strip()
+                                    for name in value.split(',') if name.strip()]
+        return selection
+
+    def eager_load(self, queryset):
+        serializer_class = self.get_property_serializer_class()
+        fields = serializer_class.select_fields(**self.get_field_selection())
+        return serializer_class.setup_eager_loading(queryset, fields, self.request.user)
+
+    def get_serializer_class(self):
+        if self.request.method in permissions.SAFE_METHODS:
+            return self.get_property_serializer_class()
+        return super().get_serializer_class()
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(self.get_field_selection())
+        return super().get_serializer(*args, **kwargs)
+
+
+class PropertyList(PropertyFieldSelectionMixin, generics.ListCreateAPIView):
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        return self.eager_load(super().get_queryset())
+
     def perform_create(self, serializer):
         # Get image files directly from request.FILES
         image_files = self.request.FILES.getlist('image_files')
@@ -67,16 +122,14 @@ class PropertyList(generics.ListCreateAPIView):
         # Create property instance with owner
         property_instance = serializer.save(owner=self.request.user)
 
-        # Process each image
+        # Store the uploads as they are; process_property_images
+        # watermarks them outside the request
         for index, image_file in enumerate(image_files):
-            # Add watermark to image
-            watermarked_image = add_watermark(image_file)
-
-            # Create PropertyImage instance with watermarked image
             PropertyImage.objects.create(
                 property=property_instance,
-                image=watermarked_image,
-                order=index
+                image=image_file,
+                order=index,
+                processing_status='PENDING'
             )
 
         # Set main image
@@ -147,13 +200,13 @@ class PropertyList(generics.ListCreateAPIView):
             for attachment in attachments:
                 email.attach(*attachment)
 
-            # Send email
-            email.send(fail_silently=False)
+            # Queue email; send_queued_emails delivers it
+            queue_email(email)
             print(
-                f"Property approval email sent successfully for: {property_instance.title}")
+                f"Property approval email queued for: {property_instance.title}")
 
         except Exception as e:
-            print(f"Failed to send property approval email: {str(e)}")
+            print(f"Failed to queue property approval email: {str(e)}")
             # Don't raise error, just log it
             # Property creation was successful even if email fails
 
@@ -172,7 +225,7 @@ class PropertyList(generics.ListCreateAPIView):
         return content_types.get(extension, 'application/octet-stream')
 
 
-class OwnPropertyList(generics.ListCreateAPIView):
+class OwnPropertyList(PropertyFieldSelectionMixin, generics.ListCreateAPIView):
     serializer_class = PropertySerializer
     # Changed to IsAuthenticated
     permission_classes = [permissions.IsAuthenticated]
@@ -182,21 +235,28 @@ class OwnPropertyList(generics.ListCreateAPIView):
         This view should return a list of all the properties
         for the currently authenticated user.
         """
-        return Property.objects.filter(owner=self.request.user)
+        return self.eager_load(Property.objects.filter(owner=self.request.user))
 
 
-class PropertyDetail(generics.RetrieveUpdateDestroyAPIView):
+# Models rendered into property responses, for the response cache
+PROPERTY_CACHE_MODELS = [Property, PropertyImage, Comment, Review, HouseType, HouseLocation]
+
+
+class PropertyDetail(ConditionalGetMixin, CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
+    conditional_model = Property
+    cache_models = PROPERTY_CACHE_MODELS
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
-class PropertyListCreateView(APIView):
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+class PropertyListCreateView(CachedResponseMixin, PropertyFieldSelectionMixin, APIView):
+    cache_models = PROPERTY_CACHE_MODELS
+    filter_backends = [DjangoFilterBackend, PropertySearchFilter, OrderingFilter]
     filterset_class = PropertyFilter
-    search_fields = ['title', 'description', 'address']
     ordering_fields = ['price', 'bedrooms', 'bathrooms', 'area']
     permission_classes = [AllowAny]
+    pagination_class = PropertyCursorPagination
 
     def get_queryset(self):
         return Property.objects.filter(current_tenant__isnull=True, is_approved=True).order_by('-overall_rating')
@@ -206,21 +266,68 @@ class PropertyListCreateView(APIView):
             queryset = backend().filter_queryset(self.request, queryset, self)
         return queryset
 
-    def get(self, request, format=None):
+    def paginate(self, request):
+        """Cursor pagination is opt-in so existing clients keep getting a plain list"""
+        return 'cursor' in request.query_params or 'page_size' in request.query_params
+
+    def get_filtered_queryset(self):
         queryset = self.get_queryset()
 
-        show_all = request.query_params.get(
+        show_all = self.request.query_params.get(
             'show_all', 'false').lower() == 'true'
 
         if show_all:
             queryset = Property.objects.all().order_by('-id')
 
-        filtered_queryset = self.filter_queryset(queryset)
-        serializer = PropertySerializer(
-            filtered_queryset, many=True, context={'request': request})
+        return self.filter_queryset(queryset)
+
+    def get_browse_queryset(self):
+        """The filtered queryset get() serves, also replayed by explain_browse_queries"""
+        filtered_queryset = self.eager_load(self.get_filtered_queryset())
+        if self.paginate(self.request):
+            filtered_queryset = filtered_queryset.annotate(
+                rating_rank=Coalesce('overall_rating', Value(0.0)))
+        return filtered_queryset
+
+    def get_paginator(self, queryset):
+        if 'search_rank' in queryset.query.annotations:
+            return PropertySearchCursorPagination()
+        return self.pagination_class()
+
+    def get(self, request, format=None):
+        return self.cached_get(request, self.list_properties, format)
+
+    def list_properties(self, request, format=None):
+        filtered_queryset = self.get_browse_queryset()
+        serializer_class = self.get_property_serializer_class()
+        selection = self.get_field_selection()
+
+        if self.paginate(request):
+            paginator = self.get_paginator(filtered_queryset)
+            page = paginator.paginate_queryset(
+                filtered_queryset, request, view=self)
+            serializer = serializer_class(
+                page, many=True, context={'request': request}, **selection)
+            return paginator.get_paginated_response(serializer.data)
+
+        serializer = serializer_class(
+            filtered_queryset, many=True, context={'request': request}, **selection)
         return Response(serializer.data)
 
 
+class PropertyFacetsView(PropertyListCreateView):
+    """Facet counts for what properties-filter/ returns with the same query string"""
+
+    def get(self, request, format=None):
+        key = facet_cache_key(request.query_params) + ':' + \
+            model_versions([Property, HouseType, HouseLocation])
+        facets = cache.get(key)
+        if facets is None:
+            facets = property_facets(self.get_filtered_queryset())
+            cache.set(key, facets, settings.FACET_CACHE_TIMEOUT)
+        return Response(facets)
+
+
 # PropertyImage views
 class PropertyImageList(generics.ListCreateAPIView):
     queryset = PropertyImage.objects.all()
@@ -235,7 +342,8 @@ class PropertyImageDetail(generics.RetrieveUpdateDestroyAPIView):
 
 
 # House Type Views
-class HouseTypeList(generics.ListCreateAPIView):
+class HouseTypeList(CachedResponseMixin, generics.ListCreateAPIView):
+    cache_models = [HouseType]
     queryset = HouseType.objects.all()
     serializer_class = HouseTypeSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -249,7 +357,8 @@ class HouseTypeDetail(generics.RetrieveUpdateDestroyAPIView):
 # House Location Views
 
 
-class HouseLocationList(generics.ListCreateAPIView):
+class HouseLocationList(CachedResponseMixin, generics.ListCreateAPIView):
+    cache_models = [HouseLocation]
     queryset = HouseLocation.objects.all()
     serializer_class = HouseLocationSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -306,6 +415,7 @@ class MessageListCreateView(generics.ListCreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save(sender=self.request.user, receiver=receiver)
+        notify_new_messages([serializer.instance])
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -335,8 +445,9 @@ class MarkMessageAsReadView(generics.GenericAPIView):
     def post(self, request, pk):
         try:
             message = Message.objects.get(id=pk, receiver=request.user)
-            message.is_read = True
-            message.save()
+            # Only the request that flips the flag sends the decrement
+            if Message.objects.filter(id=message.id, is_read=False).update(is_read=True):
+                notify_messages_read(request.user.id, {message.sender_id: 1})
             return Response({"status": "Message marked as read"}, status=status.HTTP_200_OK)
         except Message.DoesNotExist:
             return Response({"error": "Message not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -389,31 +500,44 @@ class ReviewDetail(generics.RetrieveUpdateDestroyAPIView):
 # Comment views
 
 
-class CommentList(generics.ListCreateAPIView):
-    queryset = Comment.objects.all()
+class CommentTreeListMixin:
+    """List comments with replies and reaction counts loaded in a single query"""
+
+    def list(self, request, *args, **kwargs):
+        comments = self.filter_queryset(self.get_queryset()).as_tree()
+        serializer = self.get_serializer(comments, many=True)
+        return Response(serializer.data)
+
+
+class CommentList(CommentTreeListMixin, generics.ListCreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        return Comment.objects.for_display(self.request.user)
+
     def perform_create(self, serializer):
         serializer.save(commenter=self.request.user)
 
 
 class CommentDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        return Comment.objects.for_display(self.request.user)
+
     def perform_update(self, serializer):
         serializer.save(commenter=self.request.user)
 
 
-class PropertyCommentList(generics.ListCreateAPIView):
+class PropertyCommentList(CommentTreeListMixin, generics.ListCreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
         property_id = self.kwargs['property_id']
-        return Comment.objects.filter(property_id=property_id)
+        return Comment.objects.filter(property_id=property_id).for_display(self.request.user)
 
     def perform_create(self, serializer):
         property_id = self.kwargs['property_id']
@@ -424,103 +548,117 @@ class PropertyCommentList(generics.ListCreateAPIView):
 User = get_user_model()
 
 
-class ChatListView(generics.ListAPIView):
+class ConversationIndexMixin:
+    """Build the inbox from Message.objects.conversations() in a fixed number of queries"""
+
+    def get_conversations(self, history=0):
+        """
+        One entry per conversation partner, newest first. With history > 0,
+        each entry also carries its `history` most recent messages, oldest
+        first, fetched in one extra query; older ones come from ChatDetailView.
+        """
+        user = self.request.user
+        chats = []
+        for last_message in Message.objects.conversations(user):
+            other_user_id = last_message.partner_id
+            chats.append({
+                'chat_id': f"{min(user.id, other_user_id)}_{max(user.id, other_user_id)}",
+                'other_user': last_message.receiver if last_message.sender_id == user.id else last_message.sender,
+                'last_message': last_message,
+                'unread_count': last_message.unread_count,
+                'total_messages': last_message.total_messages,
+            })
+
+        if history > 0 and chats:
+            recent = defaultdict(list)
+            for message in Message.objects.latest_per_conversation(user, history).order_by('id'):
+                recent[message.partner_id].append(message)
+            for chat in chats:
+                chat['messages'] = recent[chat['last_message'].partner_id]
+
+        return chats
+
+
+class ChatListView(ConversationIndexMixin, generics.ListAPIView):
     serializer_class = ChatSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        chats = Message.objects.filter(Q(sender=user) | Q(receiver=user)).values(
-            'sender', 'receiver'
-        ).annotate(
-            last_message_id=Max('id'),
-            other_user_id=Case(
-                When(sender=user, then=F('receiver')),
-                default=F('sender'),
-                output_field=IntegerField(),
-            ),
-            unread_count=Count(
-                Case(When(receiver=user, is_read=False, then=1)))
-        ).order_by('-last_message_id')
-
-        return [
-            {
-                'other_user': User.objects.get(id=chat['other_user_id']),
-                'last_message': Message.objects.get(id=chat['last_message_id']),
-                'unread_count': chat['unread_count']
-            }
-            for chat in chats
-        ]
+        return self.get_conversations()
 
 
 class ChatDetailView(generics.ListAPIView):
+    """
+    A page of the history with one user, oldest first. Without parameters
+    it is the latest page; ?before=<message id> pages back through older
+    messages and ?after=<message id> fetches newer ones. ?limit= sets the
+    page size.
+    """
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    default_limit = 50
+    max_limit = 200
 
     def get_queryset(self):
         user = self.request.user
         other_user_id = self.kwargs['user_id']
-        return Message.objects.filter(
-            (Q(sender=user) & Q(receiver_id=other_user_id)) |
-            (Q(receiver=user) & Q(sender_id=other_user_id))
-        ).order_by('timestamp')
+        return Message.objects.between(user, other_user_id).select_related('sender', 'receiver')
+
+    def get_page(self, queryset):
+        params = self.request.query_params
+        limit = min(int(params.get('limit', self.default_limit)), self.max_limit)
+        if limit < 1:
+            raise ValueError('limit must be positive')
+
+        if params.get('after'):
+            return list(queryset.filter(id__gt=int(params['after'])).order_by('id')[:limit])
+
+        if params.get('before'):
+            queryset = queryset.filter(id__lt=int(params['before']))
+        page = list(queryset.order_by('-id')[:limit])
+        page.reverse()
+        return page
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        queryset.filter(receiver=request.user,
-                        is_read=False).update(is_read=True)
-        return super().list(request, *args, **kwargs)
+        try:
+            messages = self.get_page(self.get_queryset())
+        except ValueError:
+            return Response({"error": "before, after and limit must be positive integers"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Only the messages being returned are marked as read
+        unread = [message for message in messages
+                  if message.receiver_id == request.user.id and not message.is_read]
+        if unread:
+            # is_read=False so overlapping fetches don't both count a message;
+            # the decrement is the number of rows this request flipped
+            marked = Message.objects.filter(
+                id__in=[message.id for message in unread], is_read=False).update(is_read=True)
+            for message in unread:
+                message.is_read = True
+            notify_messages_read(request.user.id, {int(self.kwargs['user_id']): marked})
+
+        serializer = self.get_serializer(messages, many=True)
+        return Response(serializer.data)
 
 
-class AvailableChatsView(generics.ListAPIView):
+class AvailableChatsView(ConversationIndexMixin, generics.ListAPIView):
     serializer_class = ChatSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Recent messages included per chat; ?messages=N overrides, 0 leaves them out
+    default_history = 20
+    max_history = 100
+
+    def get_history(self):
+        try:
+            history = int(self.request.query_params.get(
+                'messages', self.default_history))
+        except ValueError:
+            history = self.default_history
+        return max(0, min(history, self.max_history))
 
     def get_queryset(self):
-        user = self.request.user
-        chats = Message.objects.filter(Q(sender=user) | Q(receiver=user)).values(
-            'sender', 'receiver'
-        ).annotate(
-            last_message_id=Max('id'),
-            other_user_id=Case(
-                When(sender=user, then=F('receiver')),
-                default=F('sender'),
-                output_field=IntegerField(),
-            ),
-            unread_count=Count(
-                Case(When(receiver=user, is_read=False, then=1))),
-            total_messages=Count('id', distinct=True)  # Use distinct=True here
-        ).order_by('-last_message_id')
-
-        chat_dict = {}
-
-        for chat in chats:
-            other_user_id = chat['other_user_id']
-            if other_user_id not in chat_dict:
-                other_user = User.objects.get(id=other_user_id)
-                chat_dict[other_user_id] = {
-                    'chat_id': f"{min(user.id, other_user_id)}_{max(user.id, other_user_id)}",
-                    'other_user': other_user,
-                    'last_message': Message.objects.get(id=chat['last_message_id']),
-                    'unread_count': chat['unread_count'],
-                    'total_messages': chat['total_messages'],
-                    'messages': set()  # Use a set instead of a list to avoid duplicates
-                }
-
-            messages = Message.objects.filter(
-                (Q(sender=user) & Q(receiver_id=other_user_id)) |
-                (Q(receiver=user) & Q(sender_id=other_user_id))
-            ).order_by('timestamp')
-
-            chat_dict[other_user_id]['messages'].update(
-                messages)  # Use update instead of extend
-
-        # Convert sets back to sorted lists
-        for chat in chat_dict.values():
-            chat['messages'] = sorted(
-                chat['messages'], key=lambda x: x.timestamp)
-
-        return list(chat_dict.values())
+        return self.get_conversations(self.get_history())
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -528,7 +666,9 @@ class AvailableChatsView(generics.ListAPIView):
         return Response(serializer.data)
 
 
-class PropertyReviewList(generics.ListAPIView):
+class PropertyReviewList(CachedResponseMixin, generics.ListAPIView):
+    # Each review renders its whole property
+    cache_models = PROPERTY_CACHE_MODELS
     serializer_class = ReviewSerializer
     permission_classes = [AllowAny]
 
@@ -617,20 +757,18 @@ class CommentLikeView(APIView):
 
     def post(self, request, pk):
         try:
-            print(
-                f"Attempting to like comment {pk} by user {request.user.email}")
             comment = Comment.objects.get(pk=pk)
-            print(f"Found comment: {comment}")
-            print(f"Current likes: {comment.get_like_count()}")
             liked = comment.toggle_like(request.user)
-            print(
-                f"After toggle - liked: {liked}, new count: {comment.get_like_count()}")
+            bump_versions(Comment)
+            touch_property(comment.property_id)
+            # A like and a dislike never coexist, so after toggling a like
+            # the user cannot be disliking the comment
             return Response({
                 'liked': liked,
                 'like_count': comment.get_like_count(),
                 'dislike_count': comment.get_dislike_count(),
-                'has_liked': comment.has_user_liked(request.user),
-                'has_disliked': comment.has_user_disliked(request.user)
+                'has_liked': liked,
+                'has_disliked': False
             })
         except Comment.DoesNotExist:
             return Response(
@@ -652,6 +790,8 @@ class CommentDislikeView(APIView):
         try:
             comment = Comment.objects.get(pk=pk)
             disliked = comment.toggle_dislike(request.user)
+            bump_versions(Comment)
+            touch_property(comment.property_id)
             return Response({
                 'disliked': disliked,
                 'like_count': comment.get_like_count(),
@@ -725,70 +865,27 @@ class ProcessRentPaymentView(APIView):
                     'error': 'Email and phone number are required'
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Initialize Paynow
-            paynow = Paynow(
-                settings.PAYNOW_INTEGRATION_ID,
-                settings.PAYNOW_INTEGRATION_KEY,
-                settings.PAYNOW_RESULT_URL,
-                settings.PAYNOW_RETURN_URL
-            )
-
             # Create payment reference
             reference = f'Rent_{payment.id}_{uuid.uuid4()}'
-            paynow_payment = paynow.create_payment(reference, email)
-            paynow_payment.add('Rent Payment', float(0.02))
-            # TODO: change to payment.amount
 
+            # Send the EcoCash prompt; the payment is completed by the Paynow
+            # callback, a status check or the poll_payments command
             try:
-                response = paynow.send_mobile(paynow_payment, phone, 'ecocash')
-
-                if response.success:
-                    time.sleep(30)  # Wait for payment processing
-                    status_response = paynow.check_transaction_status(
-                        response.poll_url)
-
-                    if status_response.status == 'paid':
-                        # Update rent payment
-                        payment.status = 'PAID'
-                        payment.payment_date = timezone.now().date()
-                        payment.transaction_id = reference
-                        payment.save()
-
-                        # Update landlord balance
-                        payment.update_landlord_balance()
-
-                        # Create next month's payment
-                        next_due_date = payment.due_date + \
-                            timezone.timedelta(days=30)
-                        RentPayment.objects.create(
-                            property=payment.property,
-                            tenant=payment.tenant,
-                            amount=payment.amount,
-                            due_date=next_due_date,
-                            status='PENDING'
-                        )
-
-                        return Response({
-                            "message": "Payment processed successfully and next month's payment created",
-                            # "payment": RentPaymentSerializer(payment).data,
-                            "poll_url": response.poll_url,
-                            "reference": reference,
-                            "status": status_response.status
-                        })
-                    else:
-                        return Response({
-                            "error": "Payment not completed",
-                            "status": status_response.status
-                        }, status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    return Response({
-                        'error': response.data['error']
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-            except Exception as e:
+                paynow_payment = start_mobile_payment(
+                    'rent', reference, 'Rent Payment', 0.02, email, phone,
+                    object_id=payment.id)
+                # TODO: change to payment.amount
+            except PaymentError as e:
                 return Response({
                     'error': str(e)
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response({
+                "message": "Payment initiated, confirm it on your phone",
+                "poll_url": paynow_payment.poll_url,
+                "reference": reference,
+                "status": paynow_payment.status
+            }, status=status.HTTP_202_ACCEPTED)
 
         except RentPayment.DoesNotExist:
             return Response(
@@ -797,7 +894,7 @@ class ProcessRentPaymentView(APIView):
             )
 
 
-class TenantAccessibleProperties(generics.ListAPIView):
+class TenantAccessibleProperties(PropertyFieldSelectionMixin, generics.ListAPIView):
     serializer_class = PropertySerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -813,11 +910,11 @@ class TenantAccessibleProperties(generics.ListAPIView):
         if user.user_type != 'tenant':
             return Property.objects.none()
 
-        return Property.objects.filter(
+        return self.eager_load(Property.objects.filter(
             Q(tenants_with_access=user) |
             Q(current_tenant=user)
             # Q(previous_tenants_with_access=user)
-        ).distinct()
+        ).distinct())
 
 
 class TenantCurrentProperty(generics.ListAPIView):
@@ -1216,12 +1313,11 @@ Your property listing "{property.title}" has been approved and is now visible on
 Best regards,
 ROJA ACCOMODATION Team"""
 
-            send_mail(
+            queue_mail(
                 subject=subject,
                 message=message,
                 from_email=settings.EMAIL_HOST_USER,
                 recipient_list=[property.owner.email],
-                fail_silently=False,
             )
 
             return Response({
@@ -1269,12 +1365,11 @@ Please make the necessary adjustments and submit again.
 Best regards,
 ROJA ACCOMODATION Team"""
 
-            send_mail(
+            queue_mail(
                 subject=subject,
                 message=message,
                 from_email=settings.EMAIL_HOST_USER,
                 recipient_list=[property.owner.email],
-                fail_silently=False,
             )
 
             return Response({
@@ -1332,7 +1427,7 @@ class ContactFormView(APIView):
                 reply_to=[email]
             )
             email_message.content_subtype = "html"  # Main content is now HTML
-            email_message.send()
+            queue_email(email_message)
 
             return Response({
                 'message': 'Your message has been sent successfully. We will get back to you soon.'
@@ -1348,112 +1443,23 @@ class ContactFormView(APIView):
 class UpdateLandlordRatingsView(APIView):
     permission_classes = [permissions.AllowAny]
 
-    def calculate_profile_completeness(self, profile):
-        """Calculate profile completeness percentage and bonus rating"""
-        fields_to_check = {
-            # Most important verifications (highest weights)
-            'is_phone_verified': 1.0,  # Phone verification is most important
-            'is_verified': 0.8,        # General verification
-            'is_profile_complete': 0.8,  # Profile completion status
-
-            # Identity verification (high weights)
-            'id_number': 0.7,
-            'id_image': 0.7,
-            'proof_of_residence': 0.7,
-
-            # Contact information (medium-high weights)
-            'phone': 0.6,
-            'alternate_phone': 0.4,
-            'emergency_contact_name': 0.5,
-            'emergency_contact_phone': 0.5,
-
-            # Personal information (medium weights)
-            'profile_image': 0.5,
-            'date_of_birth': 0.4,
-            'marital_status': 0.3,
-
-            # Additional information (lower weights)
-            'additional_notes': 0.2
-        }
-
-        completeness_score = 0
-        max_score = sum(fields_to_check.values())
-
-        for field, weight in fields_to_check.items():
-            field_value = getattr(profile, field, None)
-            if field_value not in [None, '', False]:  # Check for empty values
-                completeness_score += weight
-
-        # Convert to percentage
-        completeness_percentage = (completeness_score / max_score) * 100
-
-        # Calculate bonus rating (up to 1.0 extra points for a fully complete profile)
-        bonus_rating = (completeness_percentage / 100) * 1.0
-
-        return completeness_percentage, bonus_rating
-
     def post(self, request):
+        """Recompute every landlord's rating; see api.ratings"""
         try:
-            landlords = get_user_model().objects.filter(user_type='landlord')
-            updated_count = 0
-            ratings_details = []
-
-            for landlord in landlords:
-                try:
-                    # Get all properties owned by this landlord
-                    properties = Property.objects.filter(owner=landlord)
-                    total_rating = 0
-                    total_reviews = 0
-
-                    # Calculate property reviews rating
-                    for property in properties:
-                        property_reviews = Review.objects.filter(
-                            property=property)
-                        if property_reviews.exists():
-                            total_rating += sum(
-                                review.rating for review in property_reviews)
-                            total_reviews += property_reviews.count()
-
-                    # Calculate base rating from reviews
-                    base_rating = 0
-                    if total_reviews > 0:
-                        base_rating = total_rating / total_reviews
-
-                    # Calculate profile completeness and bonus
-                    landlord_profile = landlord.landlord_profile
-                    completeness_percentage, profile_bonus = self.calculate_profile_completeness(
-                        landlord_profile)
-
-                    # Calculate final rating (base rating + profile completeness bonus)
-                    final_rating = base_rating + profile_bonus
-                    # Cap at 5.0 and round to 1 decimal
-                    final_rating = min(5.0, round(final_rating, 1))
-
-                    # Update profile
-                    landlord_profile.current_rating = final_rating
-                    landlord_profile.profile_completeness = round(
-                        completeness_percentage, 1)
-                    landlord_profile.save()
-                    updated_count += 1
-
-                    # Store details for response
-                    ratings_details.append({
-                        "landlord_name": f"{landlord.first_name} {landlord.last_name}",
-                        "email": landlord.email,
-                        "base_rating": round(base_rating, 1),
-                        "profile_completeness": round(completeness_percentage, 1),
-                        "profile_bonus": round(profile_bonus, 1),
-                        "final_rating": final_rating,
-                        "total_reviews": total_reviews
-                    })
-
-                except Exception as e:
-                    print(
-                        f"Error updating landlord {landlord.email}: {str(e)}")
+            rows = update_landlord_ratings()
+            ratings_details = [{
+                "landlord_name": f"{row['user__first_name']} {row['user__last_name']}",
+                "email": row['user__email'],
+                "base_rating": round(row['base_rating'], 1),
+                "profile_completeness": round(row['completeness'], 1),
+                "profile_bonus": round(row['profile_bonus'], 1),
+                "final_rating": row['final_rating'],
+                "total_reviews": row['review_count']
+            } for row in rows]
 
             return Response({
-                "message": f"Successfully updated {updated_count} landlord ratings",
-                "total_landlords": landlords.count(),
+                "message": f"Successfully updated {len(rows)} landlord ratings",
+                "total_landlords": get_user_model().objects.filter(user_type='landlord').count(),
                 "ratings_details": ratings_details
             }, status=status.HTTP_200_OK)
 
@@ -1465,28 +1471,14 @@ class UpdateLandlordRatingsView(APIView):
     def get(self, request):
         """Get current ratings and profile completeness for all landlords"""
         try:
-            landlords = get_user_model().objects.filter(user_type='landlord')
-            ratings_data = []
-
-            for landlord in landlords:
-                try:
-                    profile = landlord.landlord_profile
-                    properties = Property.objects.filter(owner=landlord)
-                    completeness_percentage, _ = self.calculate_profile_completeness(
-                        profile)
-
-                    ratings_data.append({
-                        "landlord_name": f"{landlord.first_name} {landlord.last_name}",
-                        "email": landlord.email,
-                        "current_rating": profile.current_rating,
-                        "profile_completeness": round(completeness_percentage, 1),
-                        "total_properties": properties.count(),
-                        "total_reviews": Review.objects.filter(property__in=properties).count()
-                    })
-
-                except Exception as e:
-                    print(
-                        f"Error getting data for landlord {landlord.email}: {str(e)}")
+            ratings_data = [{
+                "landlord_name": f"{row['user__first_name']} {row['user__last_name']}",
+                "email": row['user__email'],
+                "current_rating": row['current_rating'],
+                "profile_completeness": round(row['completeness'], 1),
+                "total_properties": row['property_count'],
+                "total_reviews": row['review_count']
+            } for row in landlord_profiles().iterator(chunk_size=1000)]
 
             return Response(ratings_data, status=status.HTTP_200_OK)
 
@@ -1498,72 +1490,35 @@ class UpdateLandlordRatingsView(APIView):
 
 class AnalyzeCommentSentimentsView(APIView):
     permission_classes = [permissions.AllowAny]
-
-    def analyze_sentiment(self, comment_text):
-        """Use OpenAI to analyze comment sentiment and return a rating"""
-        try:
-            client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-
-            messages = [
-                {"role": "system", "content": "You are a sentiment analysis expert. Rate the following property comment on a scale of 1 to 5, where 1 is very negative and 5 is very positive. Only respond with a single number."},
-                {"role": "user", "content": comment_text}
-            ]
-
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                temperature=0.3,
-                max_tokens=10,
-                top_p=1.0,
-                frequency_penalty=0.0,
-                presence_penalty=0.0
-            )
-
-            # Extract the rating from the response
-            rating = float(response.choices[0].message.content.strip())
-            return min(max(rating, 1), 5)  # Ensure rating is between 1 and 5
-
-        except Exception as e:
-            print(f"Error analyzing sentiment: {str(e)}")
-            return None
+    # Comments rated per request; larger backlogs are for the
+    # score_comment_sentiments command
+    default_limit = 200
 
     def post(self, request):
         try:
-            # Get unrated comments
-            unrated_comments = Comment.objects.filter(is_rated=False)
-
-            if not unrated_comments.exists():
+            if not Comment.objects.filter(is_rated=False).exists():
                 return Response({
                     "message": "No unrated comments found"
                 }, status=status.HTTP_200_OK)
 
-            results = []
-            for comment in unrated_comments:
-                try:
-                    # Get sentiment rating
-                    sentiment_rating = self.analyze_sentiment(comment.content)
-
-                    if sentiment_rating:
-                        # Update comment with the AI-generated rating
-                        comment.ai_rating = sentiment_rating
-                        comment.is_rated = True
-                        comment.save()
-
-                        results.append({
-                            "comment_id": comment.id,
-                            "content": comment.content,
-                            "ai_rating": sentiment_rating,
-                            "property": comment.property.title,
-                            "commenter": f"{comment.commenter.first_name} {comment.commenter.last_name}"
-                        })
-
-                except Exception as e:
-                    print(f"Error processing comment {comment.id}: {str(e)}")
-                    continue
+            try:
+                limit = int(request.query_params.get('limit', self.default_limit))
+            except ValueError:
+                limit = self.default_limit
+            comments = score_comments(limit=max(1, min(limit, self.default_limit)))
+
+            results = [{
+                "comment_id": comment.id,
+                "content": comment.content,
+                "ai_rating": comment.ai_rating,
+                "property": comment.property.title,
+                "commenter": f"{comment.commenter.first_name} {comment.commenter.last_name}"
+            } for comment in comments]
 
             return Response({
                 "message": f"Successfully analyzed {len(results)} comments",
-                "results": results
+                "results": results,
+                "remaining": Comment.objects.filter(is_rated=False).count()
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
@@ -1599,159 +1554,23 @@ class AnalyzeCommentSentimentsView(APIView):
 class UpdatePropertyRatingsView(APIView):
     permission_classes = [permissions.AllowAny]
 
-    def to_float(self, value):
-        """Convert Decimal to float safely"""
-        if value is None:
-            return 0.0
-        return float(value)
-
-    def calculate_property_rating(self, property):
-        """Calculate overall property rating based on reviews, comments, and landlord rating"""
-        try:
-            # Get all reviews for the property
-            reviews = Review.objects.filter(property=property)
-            review_count = reviews.count()
-            avg_review_rating = 0.0
-
-            if review_count > 0:
-                review_ratings = sum(self.to_float(review.rating)
-                                     for review in reviews)
-                avg_review_rating = review_ratings / review_count
-
-            # Get all AI-rated comments
-            comments = Comment.objects.filter(
-                property=property,
-                is_rated=True,
-                ai_rating__isnull=False
-            )
-            comment_count = comments.count()
-            avg_comment_rating = 0.0
-
-            if comment_count > 0:
-                comment_ratings = sum(self.to_float(comment.ai_rating)
-                                      for comment in comments)
-                avg_comment_rating = comment_ratings / comment_count
-
-            # Get landlord rating
-            landlord_rating = 0.0
-            try:
-                landlord_profile = property.owner.landlord_profile
-                if landlord_profile and landlord_profile.current_rating:
-                    landlord_rating = self.to_float(
-                        landlord_profile.current_rating)
-            except Exception as e:
-                print(f"Error getting landlord rating: {str(e)}")
-
-            # Define base weights and adjust based on available data
-            base_weights = {
-                'review': 0.5,    # 50% for reviews
-                'comment': 0.3,   # 30% for comments
-                'landlord': 0.2   # 20% for landlord rating
-            }
-
-            # Determine which components are valid
-            has_reviews = review_count > 0
-            has_comments = comment_count > 0
-            has_landlord_rating = landlord_rating > 0
-
-            # Calculate adjusted weights based on available components
-            adjusted_weights = {}
-            total_base = 0
-
-            if has_reviews:
-                adjusted_weights['review'] = base_weights['review']
-                total_base += base_weights['review']
-
-            if has_comments:
-                adjusted_weights['comment'] = base_weights['comment']
-                total_base += base_weights['comment']
-
-            if has_landlord_rating:
-                # Only count landlord rating if there's at least one other component
-                if has_reviews or has_comments:
-                    adjusted_weights['landlord'] = base_weights['landlord']
-                    total_base += base_weights['landlord']
-                else:
-                    # If only landlord rating exists, cap its weight
-                    # Cap at 30% if it's the only component
-                    adjusted_weights['landlord'] = 0.3
-                    total_base = 0.3
-
-            # Normalize weights if necessary
-            if total_base > 0:
-                for key in adjusted_weights:
-                    adjusted_weights[key] = adjusted_weights[key] / total_base
-
-            # Calculate weighted average
-            weighted_sum = 0.0
-            if has_reviews:
-                weighted_sum += float(avg_review_rating) * \
-                    adjusted_weights['review']
-            if has_comments:
-                weighted_sum += float(avg_comment_rating) * \
-                    adjusted_weights['comment']
-            if has_landlord_rating:
-                weighted_sum += float(landlord_rating) * \
-                    adjusted_weights['landlord']
-
-            # Calculate final rating
-            overall_rating = weighted_sum if total_base > 0 else 0.0
-
-            return {
-                'overall_rating': round(float(overall_rating), 1),
-                'review_rating': round(float(avg_review_rating), 1),
-                'comment_rating': round(float(avg_comment_rating), 1),
-                'landlord_rating': round(float(landlord_rating), 1),
-                'review_count': review_count,
-                'comment_count': comment_count,
-                'weights_used': adjusted_weights,
-                'components_present': {
-                    'has_reviews': has_reviews,
-                    'has_comments': has_comments,
-                    'has_landlord_rating': has_landlord_rating
-                }
-            }
-
-        except Exception as e:
-            print(
-                f"Error calculating rating for property {property.id}: {str(e)}")
-            return None
-
     def post(self, request):
+        """Recompute every property's overall rating; see api.ratings"""
         try:
-            # Get all properties
-            properties = Property.objects.all()
-            updated_count = 0
-            results = []
-
-            for property in properties:
-                try:
-                    rating_data = self.calculate_property_rating(property)
-
-                    if rating_data:
-                        # Update property rating
-                        property.overall_rating = rating_data['overall_rating']
-                        property.save()
-                        updated_count += 1
-
-                        # Store results
-                        results.append({
-                            "property_id": property.id,
-                            "title": property.title,
-                            "overall_rating": rating_data['overall_rating'],
-                            "review_rating": rating_data['review_rating'],
-                            "comment_rating": rating_data['comment_rating'],
-                            "review_count": rating_data['review_count'],
-                            "comment_count": rating_data['comment_count']
-                        })
-
-                except Exception as e:
-                    print(f"Error updating property {property.id}: {str(e)}")
-                    continue
+            rows = update_property_ratings()
+            results = [{
+                "property_id": row['id'],
+                "title": row['title'],
+                "overall_rating": row['rating']['overall_rating'],
+                "review_rating": row['rating']['review_rating'],
+                "comment_rating": row['rating']['comment_rating'],
+                "review_count": row['rating']['review_count'],
+                "comment_count": row['rating']['comment_count']
+            } for row in rows]
 
             return Response({
-                "message": f"Successfully updated {updated_count} property ratings",
-                "total_properties": properties.count(),
+                "message": f"Successfully updated {len(rows)} property ratings",
+                "total_properties": len(rows),
                 "results": results
             }, status=status.HTTP_200_OK)
 
@@ -1763,27 +1582,19 @@ class UpdatePropertyRatingsView(APIView):
     def get(self, request):
         """Get current ratings for all properties"""
         try:
-            properties = Property.objects.all()
             ratings_data = []
-
-            for property in properties:
-                try:
-                    rating_data = self.calculate_property_rating(property)
-                    if rating_data:
-                        ratings_data.append({
-                            "property_id": property.id,
-                            "title": property.title,
-                            "current_rating": property.overall_rating,
-                            "calculated_rating": rating_data['overall_rating'],
-                            "review_rating": rating_data['review_rating'],
-                            "comment_rating": rating_data['comment_rating'],
-                            "review_count": rating_data['review_count'],
-                            "comment_count": rating_data['comment_count']
-                        })
-
-                except Exception as e:
-                    print(
-                        f"Error getting data for property {property.id}: {str(e)}")
+            for row in property_inputs().iterator(chunk_size=1000):
+                rating_data = property_rating(row)
+                ratings_data.append({
+                    "property_id": row['id'],
+                    "title": row['title'],
+                    "current_rating": row['overall_rating'],
+                    "calculated_rating": rating_data['overall_rating'],
+                    "review_rating": rating_data['review_rating'],
+                    "comment_rating": rating_data['comment_rating'],
+                    "review_count": rating_data['review_count'],
+                    "comment_count": rating_data['comment_count']
+                })
 
             return Response(ratings_data, status=status.HTTP_200_OK)
 
@@ -1804,11 +1615,6 @@ class ProcessLeaseDocumentPaymentView(APIView):
             propertyId = request.data.get('property_id')
             amount = 0.02  # Fixed amount for lease document payment - specify as float
 
-            print("Request data:", request.data)
-            print("Property ID:", propertyId)
-            print("Email:", email)
-            print("Phone:", phone)
-
             if not all([email, phone, propertyId]):
                 return Response({
                     'error': 'Email, phone number and propertyId required'
@@ -1829,79 +1635,36 @@ class ProcessLeaseDocumentPaymentView(APIView):
                 property=property
             )
 
-            print("Payment created:", payment.id)
-
-            # Initialize Paynow
-            paynow = Paynow(
-                settings.PAYNOW_INTEGRATION_ID,
-                settings.PAYNOW_INTEGRATION_KEY,
-                settings.PAYNOW_RESULT_URL,
-                settings.PAYNOW_RETURN_URL
-            )
-
             # Create payment reference
             reference = f'lease_document_{payment.id}_{uuid.uuid4()}'
-            print("Payment reference:", reference)
-
-            paynow_payment = paynow.create_payment(reference, email)
-            print("TRACK 1")
-            # Make sure amount is converted to float
-            paynow_payment.add('Lease Document Payment', float(amount))
-            print("TRACK 2")
-            print("Attempting mobile payment...")
-            response = paynow.send_mobile(paynow_payment, phone, 'ecocash')
-            print("TRACK 3")
-            print("Paynow response:", response.__dict__)
-
-            if response.success:
-                print("TRACK 4")
-                time.sleep(30)  # Wait for payment processing
-                status_response = paynow.check_transaction_status(
-                    response.poll_url)
-                print("TRACK 5")
-                print("Status response:", status_response.__dict__)
-                print(status_response.status)
-
-                if status_response.status == 'paid':
-                    print("TRACK 6")
-                    payment.status = 'PAID'
-                    print("TRACK 7")
-                    payment.payment_date = timezone.now().date()
-                    print("TRACK 8")
-                    payment.transaction_id = reference
-                    print("TRACK 9")
-                    payment.save()
-                    print("TRACK 10")
-                    return Response({
-                        "message": "Payment processed successfully",
-                        # "payment": LeaseDocumentPaymentSerializer(payment).data,
-                        "poll_url": response.poll_url,
-                        "reference": reference,
-                        "status": status_response.status
-                    })
-                    print("TRACK 11")
-                else:
-                    print("TRACK 12")
-                    return Response({
 
-                        "error": "Payment not completed",
-                        "status": status_response.status
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                    print("TRACK 13")
-            else:
-                print("TRACK 14")
-                error_message = response.data.get('error') if hasattr(
-                    response, 'data') else 'Payment initialization failed'
-                print("TRACK 15")
+            try:
+                paynow_payment = start_mobile_payment(
+                    'lease_document', reference, 'Lease Document Payment',
+                    amount, email, phone, object_id=payment.id)
+            except PaymentError as e:
                 return Response({
-
-                    'error': error_message
+                    'error': str(e)
                 }, status=status.HTTP_400_BAD_REQUEST)
 
+            return Response({
+                "message": "Payment initiated, confirm it on your phone",
+                "poll_url": paynow_payment.poll_url,
+                "reference": reference,
+                "status": paynow_payment.status
+            }, status=status.HTTP_202_ACCEPTED)
+
         except Exception as e:
-            print("TRACK 20")
             print("General error:", str(e))
             return Response({
 
                 'error': f'An error occurred: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class PaynowMetricsView(APIView):
+    """Latency and error counts for this process's calls to Paynow"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(get_gateway().metrics.snapshot())
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'social_django',
@@ -306,19 +307,75 @@ PAYNOW_INTEGRATION_ID = os.getenv('PAYNOW_INTEGRATION_ID')
 PAYNOW_INTEGRATION_KEY = os.getenv('PAYNOW_INTEGRATION_KEY')
 PAYNOW_RESULT_URL = os.getenv('PAYNOW_RESULT_URL')
 PAYNOW_RETURN_URL = os.getenv('PAYNOW_RETURN_URL')
+# Point at `python manage.py fake_paynow` to run payments offline
+PAYNOW_API_URL = os.getenv(
+    'PAYNOW_API_URL', 'https://www.paynow.co.zw/interface')
+PAYNOW_TIMEOUT = float(os.getenv('PAYNOW_TIMEOUT', 15))  # seconds
+PAYNOW_POOL_SIZE = int(os.getenv('PAYNOW_POOL_SIZE', 10))
 
 # Add Channels configuration
 ASGI_APPLICATION = 'core.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+# Set CHANNEL_REDIS_URL (comma separated for several shards) to share chat
+# groups between Daphne processes and hosts. Without it every process has
+# its own in-memory layer, which only works with a single worker.
+CHANNEL_REDIS_URL = os.getenv('CHANNEL_REDIS_URL')
+
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_REDIS_URL.split(','),
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
     }
-}
+
+# Chat messages are broadcast straight away and saved in batches: whichever
+# comes first of this many milliseconds or this many waiting messages
+CHAT_FLUSH_INTERVAL = int(os.getenv('CHAT_FLUSH_INTERVAL', 50))
+CHAT_FLUSH_SIZE = int(os.getenv('CHAT_FLUSH_SIZE', 100))
+# Messages the buffer may hold while the database is unavailable, and how
+# many times a message is tried before it is dropped and logged
+CHAT_BUFFER_LIMIT = int(os.getenv('CHAT_BUFFER_LIMIT', 10000))
+CHAT_SAVE_ATTEMPTS = int(os.getenv('CHAT_SAVE_ATTEMPTS', 8))
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Comment sentiment scoring (api.sentiment): 'openai', or 'stub' to score
+# locally without API calls
+SENTIMENT_MODEL = os.getenv('SENTIMENT_MODEL', 'openai')
+SENTIMENT_BATCH_SIZE = int(os.getenv('SENTIMENT_BATCH_SIZE', 10))  # comments per prompt
+SENTIMENT_CONCURRENCY = int(os.getenv('SENTIMENT_CONCURRENCY', 4))  # requests in flight
+
+# Seconds facet counts (api.facets) are cached per filter
+FACET_CACHE_TIMEOUT = int(os.getenv('FACET_CACHE_TIMEOUT', 60))
+
+# Cache for responses (api.response_cache), facets and sentiment ratings:
+# 'locmem' (one process), 'file' (shared by the processes on one host) or
+# 'redis'. CACHE_LOCATION is the directory or Redis URL.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'roja'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.getenv('CACHE_LOCATION', CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'OPTIONS': {'MAX_ENTRIES': 10000} if CACHE_BACKEND != 'redis' else {},
+    }
+}
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+
 # Twilio Configuration
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')